@@ -6,6 +6,9 @@ from . import episode  # noqa: F401
 from . import export  # noqa: F401
 from . import food  # noqa: F401
 from . import glucose  # noqa: F401
+from . import glucose_aggregates  # noqa: F401
+from . import glucose_archive  # noqa: F401
+from . import glucose_encoding  # noqa: F401
 from . import hba1c  # noqa: F401
 from . import http_request_log  # noqa: F401
 from . import http_request_log_route  # noqa: F401
@@ -13,12 +16,23 @@ from . import instant_glucose  # noqa: F401
 from . import insulin  # noqa: F401
 from . import jmespath  # noqa: F401
 from . import last  # noqa: F401
+from . import locks  # noqa: F401
 from . import logging  # noqa: F401
 from . import login  # noqa: F401
 from . import low  # noqa: F401
+from . import metrics  # noqa: F401
+from . import metrics_route  # noqa: F401
+from . import pagination  # noqa: F401
+from . import record_store  # noqa: F401
 from . import redis  # noqa: F401
+from . import response_cache  # noqa: F401
+from . import retention  # noqa: F401
+from . import revision_cache  # noqa: F401
+from . import revision_watch  # noqa: F401
 from . import server  # noqa: F401
+from . import stats  # noqa: F401
 from . import upload  # noqa: F401
 from . import userdata  # noqa: F401
 from . import users  # noqa: F401
+from . import webhook_dispatcher  # noqa: F401
 from . import webhooks  # noqa: F401
@@ -10,12 +10,13 @@ from .episode import get_current_episode_record
 from .glucose import (GlucoseRecordType, get_latest_glucose_records,
                       get_merged_glucose_records)
 from .login import assert_get_current_request_redis_client
-from .redis import get_revision
-from .server import app
+from .response_cache import get_cached_response, set_cached_response
+from .server import app, limiter, polling_rate_limit
 from .utils import parse_timestamp
 
 
 @app.route("/opengluck/glucose/current")
+@limiter.limit(polling_rate_limit)
 def _get_current_glucose_data():
     # TODO LEGACY this is a legacy route and should be removed
     return _handle_get_current(
@@ -25,6 +26,7 @@ def _get_current_glucose_data():
 
 
 @app.route("/opengluck/current")
+@limiter.limit(polling_rate_limit)
 def _get_current_data():
     return _handle_get_current(
         current_glucose_record_field_name="current_glucose_record",
@@ -37,11 +39,15 @@ def _handle_get_current(
 ):
     redis_client = assert_get_current_request_redis_client()
 
-    revision = get_revision(redis_client)
+    revision, cached = get_cached_response(redis_client)
     if_none_match = request.headers.get("if-none-match")
     if if_none_match is not None and if_none_match == str(revision):
         logging.debug("Sending 304")
         return Response(status=304)
+    if cached is not None:
+        return Response(
+            cached, headers={"content-type": "application/json", "etag": revision}
+        )
 
     has_cgm_real_time_data = do_we_have_realtime_cgm_data()
 
@@ -58,27 +64,28 @@ def _handle_get_current(
             last_historic = historic_records[1] if len(historic_records) > 1 else None
 
         current_episode_record = get_current_episode_record()
+        body = json.dumps(
+            {
+                current_glucose_record_field_name: records[0],
+                last_historic_field_name: last_historic,
+                "current_episode": current_episode_record["episode"]
+                if current_episode_record is not None
+                else None,
+                "current_episode_timestamp": current_episode_record["timestamp"]
+                if current_episode_record is not None
+                else None,
+                "has_cgm_real_time_data": has_cgm_real_time_data,
+                "revision": revision,
+                "current_instant_glucose_record": instant_glucose_records[0]
+                if instant_glucose_records
+                and parse_timestamp(instant_glucose_records[0]["timestamp"])
+                >= parse_timestamp(records[0]["timestamp"])
+                else None,
+            }
+        )
+        set_cached_response(redis_client, body, revision=revision)
         return Response(
-            json.dumps(
-                {
-                    current_glucose_record_field_name: records[0],
-                    last_historic_field_name: last_historic,
-                    "current_episode": current_episode_record["episode"]
-                    if current_episode_record is not None
-                    else None,
-                    "current_episode_timestamp": current_episode_record["timestamp"]
-                    if current_episode_record is not None
-                    else None,
-                    "has_cgm_real_time_data": has_cgm_real_time_data,
-                    "revision": revision,
-                    "current_instant_glucose_record": instant_glucose_records[0]
-                    if instant_glucose_records
-                    and parse_timestamp(instant_glucose_records[0]["timestamp"])
-                    >= parse_timestamp(records[0]["timestamp"])
-                    else None,
-                }
-            ),
-            headers={"content-type": "application/json", "etag": revision},
+            body, headers={"content-type": "application/json", "etag": revision}
         )
     else:
         return Response(
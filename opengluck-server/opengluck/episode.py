@@ -13,14 +13,14 @@ from enum import Enum
 from typing import List, Optional, TypedDict, cast
 
 from flask import Response, abort, request
-from redis import WatchError
 
 from .cgm import get_current_cgm_properties, set_current_cgm_device_properties
 from .config import merge_record_high_threshold, merge_record_low_threshold, tz
 from .login import (assert_current_request_logged_in,
                     assert_get_current_request_redis_client)
-from .redis import bump_revision
-from .server import app
+from .redis import (bump_revision, bump_revision_lua, get_bump_revision_args,
+                    get_redis_client, revision_keys)
+from .server import app, limiter, upload_rate_limit
 from .webhooks import call_webhooks
 
 
@@ -44,6 +44,49 @@ class EpisodeRecord(TypedDict):
 
 _key = "episode"
 
+# Insert episodes in order, skipping those when the previous one is the same.
+# If the following episode is the same, it is replaced: it actually started at
+# this timestamp. Returns the current episode before and after inserting, then
+# the status and the previous episode of each inserted episode.
+_insert_episodes_script = get_redis_client(db=0).register_script(
+    bump_revision_lua
+    + """
+local function get_episode(member)
+    return member and cjson.decode(member)["episode"] or "unknown"
+end
+local current = redis.call("ZREVRANGE", KEYS[1], 0, 0)[1] or false
+local result = {current, current}
+local changed = false
+for i = 3, #ARGV, 3 do
+    local ts, member, episode = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    local previous = redis.call(
+        "ZREVRANGEBYSCORE", KEYS[1], ts, "-inf", "LIMIT", 0, 1
+    )[1] or false
+    local status = "duplicate"
+    if get_episode(previous) ~= episode then
+        status = "inserted"
+        local following = redis.call(
+            "ZRANGEBYSCORE", KEYS[1], ts, "+inf", "WITHSCORES", "LIMIT", 0, 1
+        )
+        redis.call("ZREMRANGEBYSCORE", KEYS[1], ts, ts)
+        redis.call("ZADD", KEYS[1], ts, member)
+        if following[1] and get_episode(following[1]) == episode then
+            status = "replaced"
+            redis.call("ZREMRANGEBYSCORE", KEYS[1], following[2], following[2])
+        end
+        changed = true
+    end
+    table.insert(result, status)
+    table.insert(result, previous)
+end
+if changed then
+    result[2] = redis.call("ZREVRANGE", KEYS[1], 0, 0)[1]
+    bump_revision({KEYS[2], KEYS[3]}, {ARGV[1], ARGV[2]})
+end
+return result
+"""
+)
+
 
 def _member_to_episode_record(member: bytes) -> EpisodeRecord:
     """Convert a member to an episode record."""
@@ -149,101 +192,106 @@ class InsertEpisodeStatus(str, Enum):
     duplicate = "duplicate"
 
 
+def _member_to_optional_episode_record(
+    member: Optional[bytes],
+) -> Optional[EpisodeRecord]:
+    return _member_to_episode_record(member) if member else None
+
+
+class _InsertedEpisode(TypedDict):
+    record: EpisodeRecord
+    status: InsertEpisodeStatus
+    previous: Optional[EpisodeRecord]
+
+
+def _insert_episodes(
+    episodes: List[EpisodeRecord], *, trigger_episode_changes: bool
+) -> List[_InsertedEpisode]:
+    """Insert episode records in order, in a single transaction.
+
+    Returns:
+        the inserted episodes
+    """
+    redis_client = assert_get_current_request_redis_client()
+    records: List[EpisodeRecord] = []
+    args = get_bump_revision_args(redis_client)
+    for episode in episodes:
+        timestamp = datetime.fromtimestamp(
+            datetime.fromisoformat(episode["timestamp"]).timestamp(), tz=tz
+        )
+        ts = str(timestamp.timestamp())
+        records.append(
+            EpisodeRecord(timestamp=timestamp.isoformat(), episode=episode["episode"])
+        )
+        args.extend(
+            [
+                ts,
+                json.dumps({"ts": ts, "episode": episode["episode"]}),
+                episode["episode"],
+            ]
+        )
+    previous_current, new_current, *statuses = _insert_episodes_script(
+        keys=[_key, *revision_keys], args=args, client=redis_client
+    )
+    inserted = [
+        _InsertedEpisode(
+            record=record,
+            status=InsertEpisodeStatus(status.decode("utf-8")),
+            previous=_member_to_optional_episode_record(previous),
+        )
+        for record, status, previous in zip(records, statuses[::2], statuses[1::2])
+    ]
+    for inserted_episode in inserted:
+        logging.debug(
+            f"Inserted episode {inserted_episode['record']}: "
+            + f"{inserted_episode['status'].value}"
+        )
+    previous_current_episode_record = _member_to_optional_episode_record(
+        previous_current
+    )
+    new_current_episode_record = _member_to_optional_episode_record(new_current)
+    if (
+        trigger_episode_changes
+        and new_current_episode_record != previous_current_episode_record
+    ):
+        if (
+            new_current_episode_record
+            and previous_current_episode_record
+            and datetime.fromisoformat(new_current_episode_record["timestamp"])
+            < datetime.fromisoformat(previous_current_episode_record["timestamp"])
+        ):
+            logging.debug(
+                "new_current_episode_record is older than previous; it "
+                + "was replaced by an earlier one in which case we do not "
+                + "want to trigger the webhook"
+            )
+        else:
+            # the new current episode is the last one inserted at its timestamp
+            current = [
+                inserted_episode
+                for inserted_episode in inserted
+                if inserted_episode["record"] == new_current_episode_record
+                and inserted_episode["status"] != InsertEpisodeStatus.duplicate
+            ]
+            if current:
+                just_updated_episode(
+                    previous=current[-1]["previous"],
+                    current_episode_record=current[-1]["record"],
+                )
+    return inserted
+
+
 def insert_episode(
     *, episode: Episode, timestamp: datetime, trigger_episode_changes: bool = True
 ) -> InsertEpisodeStatus:
     """Insert an episode."""
-    redis_client = assert_get_current_request_redis_client()
     # LATER DEPRECATED setting trigger_episode_changes to True is deprecated
-    timestamp = datetime.fromtimestamp(timestamp.timestamp(), tz=tz)
-    ts = str(timestamp.timestamp())
-    previous_episode_record = None
-    previous_current_episode_record = get_current_episode_record()
-    while True:
-        try:
-            p = redis_client.pipeline()
-            p.watch(_key)
-            previous_episode_record = get_current_episode_record(until_date=timestamp)
-            logging.debug(f"Current episode record: {previous_episode_record}")
-            previous_episode = (
-                previous_episode_record["episode"]
-                if previous_episode_record
-                else Episode.unknown
-            )
-            logging.debug(
-                f"Will try insert episode {episode} at timestamp {timestamp}, ts {ts}, "
-                + f"current episode: {previous_episode}"
-            )
-            if previous_episode == episode:
-                logging.debug(" -> duplicate")
-                status = InsertEpisodeStatus.duplicate
-            else:
-                # is the same episode happening just later? if so, we need to
-                # delete the later episode, and correctly record that it
-                # started earlier than we thought
-                res = redis_client.zrangebyscore(
-                    _key, ts, "+inf", start=0, num=1, withscores=True
-                )
-                following_score = None
-                status = InsertEpisodeStatus.inserted
-                if res:
-                    (following_episode, following_score) = res[0]
-                    logging.debug(f" -> following episode {following_episode}")
-                    following_episode = _member_to_episode_record(following_episode)
-                    logging.debug(
-                        f"check if {following_episode['episode']} == {episode}"
-                    )
-                    if following_episode["episode"] == episode:
-                        logging.debug(
-                            " -> same episode happening later, will delete later "
-                            + f"episode {following_episode} "
-                            + f"with score {following_score}"
-                        )
-                        status = InsertEpisodeStatus.replaced
-                if status == InsertEpisodeStatus.inserted:
-                    logging.debug(" -> new episode")
-                else:
-                    logging.debug(" -> replaced episode")
-
-                p.zremrangebyscore(_key, ts, ts)
-                p.multi()
-                p.zadd(_key, {json.dumps({"ts": ts, "episode": episode}): ts})
-                if status == InsertEpisodeStatus.replaced:
-                    assert following_score
-                    p.zremrangebyscore(_key, following_score, following_score)
-
-            p.execute()
-            bump_revision(redis_client)
-            if trigger_episode_changes:
-                new_current_episode_record = get_current_episode_record()
-                if new_current_episode_record != previous_current_episode_record:
-                    if (
-                        new_current_episode_record
-                        and previous_current_episode_record
-                        and datetime.fromisoformat(
-                            new_current_episode_record["timestamp"]
-                        )
-                        < datetime.fromisoformat(
-                            previous_current_episode_record["timestamp"]
-                        )
-                    ):
-                        logging.debug(
-                            "new_current_episode_record is older than previous; it "
-                            + "was replaced by an earlier one in which case we do not "
-                            + "want to trigger the webhook"
-                        )
-                    else:
-                        just_updated_episode(
-                            previous=previous_episode_record,
-                            current_episode_record=EpisodeRecord(
-                                timestamp=timestamp.isoformat(), episode=episode
-                            ),
-                        )
-            return status
-            break
-        except WatchError:
-            logging.debug("WatchError, will retry")
-            continue
+    logging.debug(f"Will try insert episode {episode} at timestamp {timestamp}")
+    (inserted,) = _insert_episodes(
+        [EpisodeRecord(timestamp=timestamp.isoformat(), episode=episode)],
+        trigger_episode_changes=trigger_episode_changes,
+    )
+    return inserted["status"]
 
 
 @app.route("/opengluck/episode", methods=["DELETE"])
@@ -301,34 +349,30 @@ class InsertEpisodesStatus(TypedDict):
 
 
 def insert_episodes(
-    episodes: List[EpisodeRecord],
+    episodes: List[EpisodeRecord], *, trigger_episode_changes: bool = False
 ) -> InsertEpisodesStatus:
     """Insert episode records at once.
 
+    Episodes are inserted in a single transaction, and the revision is bumped
+    once.
+
     Args:
         episodes: the episode records to insert
+        trigger_episode_changes: whether to call the episode:changed webhook
+            if the current episode changes
     Returns:
         the response
     """
     episodes = sorted(episodes, key=lambda e: e["timestamp"])
-    nb_duplicates = 0
-    nb_inserted = 0
-    nb_replaced = 0
-    for episode in episodes:
-        timestamp = datetime.fromisoformat(episode["timestamp"])
-        status = insert_episode(
-            episode=episode["episode"],
-            timestamp=timestamp,
-            trigger_episode_changes=False,
+    statuses = [
+        inserted["status"]
+        for inserted in _insert_episodes(
+            episodes, trigger_episode_changes=trigger_episode_changes
         )
-        if status == InsertEpisodeStatus.duplicate:
-            nb_duplicates += 1
-        elif status == InsertEpisodeStatus.inserted:
-            nb_inserted += 1
-        elif status == InsertEpisodeStatus.replaced:
-            nb_replaced += 1
-        else:
-            raise ValueError(f"unexpected status: {status}")
+    ]
+    nb_inserted = statuses.count(InsertEpisodeStatus.inserted)
+    nb_replaced = statuses.count(InsertEpisodeStatus.replaced)
+    nb_duplicates = statuses.count(InsertEpisodeStatus.duplicate)
     return InsertEpisodesStatus(
         success=True,
         status=f"added {nb_inserted} record(s), "
@@ -340,6 +384,7 @@ def insert_episodes(
 
 
 @app.route("/opengluck/episode/upload", methods=["POST"])
+@limiter.limit(upload_rate_limit)
 def _set_episode_api():
     """Inserts a list of episodes, skipping duplicates."""
     # LATER DEPRECATED this route is deprecated
@@ -351,35 +396,8 @@ def _set_episode_api():
     current_cgm_device_properties = body.get("current-cgm-device-properties", None)
     if current_cgm_device_properties is not None:
         set_current_cgm_device_properties(current_cgm_device_properties)
-    episodes = sorted(episodes, key=lambda e: e["timestamp"])
-    nb_duplicates = 0
-    nb_inserted = 0
-    nb_replaced = 0
-    for episode in episodes:
-        timestamp = datetime.fromisoformat(episode["timestamp"])
-        status = insert_episode(episode=episode["episode"], timestamp=timestamp)
-        if status == InsertEpisodeStatus.duplicate:
-            nb_duplicates += 1
-        elif status == InsertEpisodeStatus.inserted:
-            nb_inserted += 1
-        elif status == InsertEpisodeStatus.replaced:
-            nb_replaced += 1
-        else:
-            raise ValueError(f"unexpected status: {status}")
     return Response(
-        json.dumps(
-            {
-                "success": True,
-                "status": (
-                    f"added {nb_inserted} record(s), "
-                    f"replaced {nb_replaced} record(s), "
-                    + f"skipped {nb_duplicates} duplicate(s)"
-                ),
-                "nb_inserted": nb_inserted,
-                "nb_replaced": nb_replaced,
-                "nb_duplicates": nb_duplicates,
-            }
-        ),
+        json.dumps(insert_episodes(episodes, trigger_episode_changes=True)),
         content_type="application/json",
     )
 
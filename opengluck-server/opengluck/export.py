@@ -1,27 +1,73 @@
+import csv
+import io
 import json
 from datetime import datetime
 from enum import Enum
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List
 
-from flask import Response, request
+from flask import Response, request, stream_with_context
 
-from .glucose import GlucoseRecord, GlucoseRecordType, find_glucose_records
-from .insulin import InsulinRecord, find_insulin_records
+from .food import iter_food_records
+from .glucose import GlucoseRecordType, iter_glucose_records
+from .insulin import iter_insulin_records
 from .login import assert_current_request_logged_in
+from .low import iter_low_records
 from .server import app
 
+# Exports are streamed: records are read by pages and written as soon as they
+# are read, so that exporting a long time range does not need to hold all the
+# records in memory.
+
 
 class _ExportType(str, Enum):
     json = "json"
     swift = "swift"
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class _Series(str, Enum):
+    glucose = "glucose"
+    insulin = "insulin"
+    food = "food"
+    low = "low"
+
+
+_default_series = [_Series.glucose, _Series.insulin]
 
+# the columns of each series, in CSV exports
+_csv_fields: Dict[_Series, List[str]] = {
+    _Series.glucose: ["timestamp", "mgDl", "record_type"],
+    _Series.insulin: ["id", "timestamp", "units", "deleted"],
+    _Series.food: [
+        "id",
+        "timestamp",
+        "deleted",
+        "name",
+        "carbs",
+        "comps",
+        "record_until",
+        "remember_recording",
+    ],
+    _Series.low: ["id", "timestamp", "sugar_in_grams", "deleted"],
+}
 
-def _export_swift(
-    *,
-    glucose_records: List[GlucoseRecord],
-    insulin_records: List[InsulinRecord],
-    to_date: datetime,
-) -> Response:
+
+def _iter_series(
+    series: _Series, *, from_date: datetime, to_date: datetime, desc: bool = False
+) -> Iterator[Any]:
+    if series == _Series.glucose:
+        # glucose records are always exported oldest first
+        return iter_glucose_records(GlucoseRecordType.historic, from_date, to_date)
+    iter_records: Dict[_Series, Callable[..., Iterator[Any]]] = {
+        _Series.insulin: iter_insulin_records,
+        _Series.food: iter_food_records,
+        _Series.low: iter_low_records,
+    }
+    return iter_records[series](from_date, to_date, desc=desc)
+
+
+def _export_swift(*, from_date: datetime, to_date: datetime) -> Iterator[str]:
     # result is a text that looks like:
     #      static let sample = CarbsSample(
     #        id: "sample",
@@ -36,49 +82,88 @@ def _export_swift(
     #            GlucoseRecord(timestamp: iso2date("2022-12-22T13:20:00+01:00"), mgDl: 165),
     #        ]),
     #     ])
-    result = f"""static let sample = CarbsSample(
+    yield f"""static let sample = CarbsSample(
     id: "sample",
     name: "Sample",
     expectedUnits: 0,
     expectedCarbsInGrams: nil,
     foodTimestamp: iso2date("{to_date.isoformat(timespec='seconds')}"),
     data: Data(records: ["""
-    for insulin_record in insulin_records:
+    for insulin_record in iter_insulin_records(from_date, to_date, desc=True):
         timestamp = datetime.fromisoformat(insulin_record["timestamp"]).isoformat(
             timespec="seconds"
         )
         units = insulin_record["units"]
-        result += f"""
+        yield f"""
         InsulinRecord(timestamp: iso2date("{timestamp}"), units: {units}),"""
-    result += """
+    yield """
     ]),
     glucoseData: GlucoseData(records: ["""
-    for glucose_record in glucose_records:
+    for glucose_record in iter_glucose_records(
+        GlucoseRecordType.historic, from_date, to_date
+    ):
         timestamp = datetime.fromisoformat(glucose_record["timestamp"]).isoformat(
             timespec="seconds"
         )
         mg_dl = glucose_record["mgDl"]
-        result += f"""
+        yield f"""
         GlucoseRecord(timestamp: iso2date("{timestamp}"), mgDl: {mg_dl}),"""
-    result += """
+    yield """
     ])
 )
     """
-    return Response(result, mimetype="text/plain")
 
 
 def _export_json(
-    *, glucose_records: List[GlucoseRecord], insulin_records: List[InsulinRecord]
-) -> Response:
-    return Response(
-        json.dumps(
-            {
-                "glucose": glucose_records,
-                "insulin": insulin_records,
-            }
-        ),
-        mimetype="application/json",
-    )
+    *, series: List[_Series], from_date: datetime, to_date: datetime
+) -> Iterator[str]:
+    # the same output as json.dumps, an object with the records of each series;
+    # insulin records have always been exported most recent first
+    for i, name in enumerate(series):
+        yield ("{" if i == 0 else "], ") + json.dumps(name.value) + ": ["
+        records = _iter_series(
+            name, from_date=from_date, to_date=to_date, desc=name == _Series.insulin
+        )
+        for j, record in enumerate(records):
+            yield (", " if j else "") + json.dumps(record)
+    yield "]}" if series else "{}"
+
+
+def _export_ndjson(
+    *, series: List[_Series], from_date: datetime, to_date: datetime
+) -> Iterator[str]:
+    for name in series:
+        for record in _iter_series(name, from_date=from_date, to_date=to_date):
+            yield json.dumps({"series": name.value, **record}) + "\n"
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (bool, dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _export_csv(
+    *, series: List[_Series], from_date: datetime, to_date: datetime
+) -> Iterator[str]:
+    fields: List[str] = []
+    for name in series:
+        fields.extend(field for field in _csv_fields[name] if field not in fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["series", *fields])
+    for name in series:
+        for record in _iter_series(name, from_date=from_date, to_date=to_date):
+            writer.writerow(
+                [name.value, *(_csv_value(record.get(field)) for field in fields)]
+            )
+            if buffer.tell() >= 8192:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
 
 
 @app.route("/opengluck/export", methods=["POST"])
@@ -89,22 +174,23 @@ def _export_route():
     from_date = datetime.fromisoformat(request.json.get("from", ""))
     to_date = datetime.fromisoformat(request.json.get("to", ""))
     type = request.json.get("type", "")
-
-    glucose_records = find_glucose_records(
-        from_date=from_date, to_date=to_date, record_type=GlucoseRecordType.historic
-    )
-
-    insulin_records = find_insulin_records(from_date=from_date, to_date=to_date)
+    try:
+        series = [_Series(name) for name in request.json.get("series", _default_series)]
+    except ValueError:
+        return Response(status=400, response="Invalid export series")
 
     if type == _ExportType.swift:
-        return _export_swift(
-            glucose_records=glucose_records,
-            insulin_records=insulin_records,
-            to_date=to_date,
-        )
+        result = _export_swift(from_date=from_date, to_date=to_date)
+        mimetype = "text/plain"
     elif type == _ExportType.json:
-        return _export_json(
-            glucose_records=glucose_records, insulin_records=insulin_records
-        )
+        result = _export_json(series=series, from_date=from_date, to_date=to_date)
+        mimetype = "application/json"
+    elif type == _ExportType.ndjson:
+        result = _export_ndjson(series=series, from_date=from_date, to_date=to_date)
+        mimetype = "application/x-ndjson"
+    elif type == _ExportType.csv:
+        result = _export_csv(series=series, from_date=from_date, to_date=to_date)
+        mimetype = "text/csv"
     else:
         return Response(status=400, response="Invalid export type")
+    return Response(stream_with_context(result), mimetype=mimetype)
@@ -1,30 +1,85 @@
 """A class to read and store glucose data."""
+import bisect
+import itertools
 import json
 import logging
+import math
 import time
 from datetime import datetime
 from enum import Enum
-from threading import Lock
-from typing import List, Optional, TypedDict
+from typing import Any, Iterator, List, Optional, Tuple, TypedDict, Union
 
+import redis
 from flask import Response, abort, request
+from redis.client import Pipeline
 
 from .cgm import (do_we_have_realtime_cgm_data, get_current_cgm_properties,
                   set_current_cgm_device_properties)
 from .config import merge_record_high_threshold, merge_record_low_threshold, tz
-from .instant_glucose import record_instant_glucose_data
+from .glucose_aggregates import (GlucoseAggregate,
+                                 delete_daily_glucose_aggregates,
+                                 get_daily_glucose_aggregates_key,
+                                 get_glucose_aggregate, get_glucose_buckets,
+                                 rebuild_daily_glucose_aggregates,
+                                 update_daily_glucose_aggregates)
+from .glucose_archive import (archive_glucose_readings,
+                              delete_archived_glucose_readings,
+                              find_glucose_readings, get_glucose_archive_keys,
+                              get_latest_glucose_readings,
+                              iter_glucose_readings)
+from .glucose_encoding import (decode_glucose_member, decode_glucose_members,
+                               encode_glucose_member, is_encoded_glucose_member)
+from .instant_glucose import record_instant_glucose_records
+from .locks import LockTimeoutError, user_lock
 from .login import (assert_current_request_logged_in,
                     assert_get_current_request_redis_client)
-from .redis import bump_revision
-from .server import app
+from .metrics import incr_metric
+from .pagination import encode_cursor, get_page_args, page_response
+from .record_store import trim_sorted_set
+from .redis import bump_revision, get_redis_client, queue_bump_revision
+from .revision_cache import get_revision_cached, set_revision_cached
+from .server import app, limiter, upload_rate_limit
 from .userdata import get_userdata, set_userdata
 from .utils import parse_timestamp
-from .webhooks import call_webhooks
+from .webhooks import call_webhooks, call_webhooks_many
 
 # We keep track of the last used scan, so that we don't backtrack in time when
-# historic records shifts and we no longer have matching scan records
+# historic records shifts and we no longer have matching scan records (and of
+# its timestamp, so that it only moves forward)
 _key_last_used_scan = "last_used_scan"
-_merged_glucose_records_lock = Lock()
+_key_last_used_scan_ts = "last_used_scan:ts"
+# The merged glucose records, cached for the current revision
+_key_merged = "glucose:merged"
+
+# replace legacy JSON members with their binary encoding, unless they have
+# changed since we read them
+_migrate_encoding_script = get_redis_client(db=0).register_script(
+    """
+local migrated = 0
+for i = 1, #ARGV, 3 do
+    local score = redis.call("ZSCORE", KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 2]) then
+        redis.call("ZREM", KEYS[1], ARGV[i])
+        redis.call("ZADD", KEYS[1], ARGV[i + 2], ARGV[i + 1])
+        migrated = migrated + 1
+    end
+end
+return migrated
+"""
+)
+
+# set the last used scan, unless a more recent one has been set
+_set_last_used_scan_script = get_redis_client(db=0).register_script(
+    """
+local current = redis.call("GET", KEYS[2])
+if current and tonumber(current) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1])
+redis.call("SET", KEYS[2], ARGV[2])
+return 1
+"""
+)
 
 """ The minimum duration between two scan records to be kept."""
 keep_scan_records_apart_duration = 4 * 60 + 50
@@ -45,6 +100,25 @@ class GlucoseRecord(TypedDict):
     record_type: GlucoseRecordType
 
 
+class GlucoseBucket(TypedDict):
+    """The aggregate of the glucose records of a time bucket.
+
+    mgDl is the average of the records, interpolated minute by minute.
+    """
+
+    timestamp: str
+    mgDl: float
+    min: int
+    max: int
+    record_type: GlucoseRecordType
+
+
+# the minimum duration of the buckets, in seconds
+_min_bucket_resolution = 60
+
+_DAY = 24 * 60 * 60
+
+
 def record_glucose_data(
     record_type: GlucoseRecordType,
     timestamp: datetime,
@@ -53,32 +127,7 @@ def record_glucose_data(
 ) -> None:
     """Record a new glucose reading."""
     # LATER DEPRECATED setting trigger_episode_changes to True is deprecated
-    redis_client = assert_get_current_request_redis_client()
-    key = _key(record_type)
-    ts = str(timestamp.timestamp())
-    logging.info(f"Recording glucose data, key={key}, ts={ts}, mgDl={mgDl}")
-    res = (
-        redis_client.pipeline()
-        .zrangebyscore(key, ts, ts)
-        .zremrangebyscore(key, ts, ts)
-        .zadd(key, {json.dumps({"ts": ts, "mgDl": mgDl}): ts})
-        .execute()
-    )
-    should_bump_revision: bool = True
-    if res[0]:
-        previous_record_at_timestamp = json.loads(res[0][0].decode("utf-8"))
-        if (
-            "mgDl" in previous_record_at_timestamp
-            and previous_record_at_timestamp["mgDl"] == mgDl
-        ):
-            logging.info("Duplicate glucose record, not bumping revision")
-            should_bump_revision = False
-    if should_bump_revision:
-        bump_revision(redis_client)
-        call_webhooks(
-            f"glucose:new:{record_type.value}",
-            {"timestamp": timestamp.isoformat(), "mgDl": mgDl},
-        )
+    record_glucose_records(record_type, [(timestamp, mgDl)])
     from .episode import get_episode_for_mgdl, insert_episode
 
     if trigger_episode_changes:
@@ -89,15 +138,202 @@ def record_glucose_data(
         insert_episode(episode=episode, timestamp=timestamp)
 
 
-def _member_to_glucose_record(
-    record_type: GlucoseRecordType, member: bytes
-) -> GlucoseRecord:
-    record = json.loads(member.decode("utf-8"))
-    return GlucoseRecord(
-        timestamp=datetime.fromtimestamp(float(record["ts"]), tz=tz).isoformat(),
-        mgDl=record["mgDl"],
-        record_type=record_type,
+def record_glucose_records(
+    record_type: GlucoseRecordType, records: List[Tuple[datetime, int]]
+) -> int:
+    """Record many glucose readings at once.
+
+    The existing readings of the uploaded time range are read at once, then all
+    the readings that have changed are written in a single transaction, the
+    revision is bumped once, and the webhooks are called from a single thread.
+
+    Args:
+        record_type: the type of the records
+        records: the (timestamp, mgDl) of the readings to record
+    Returns:
+        the number of readings that have changed
+    Raises:
+        LockTimeoutError: if the merged-glucose-records lock of the user could
+            not be acquired in time
+    """
+    if not records:
+        return 0
+    redis_client = assert_get_current_request_redis_client()
+    key = _key(record_type)
+    # when a timestamp is present more than once, the last reading wins
+    readings = {timestamp.timestamp(): (timestamp, mgDl) for timestamp, mgDl in records}
+    previous_mgdls = dict(
+        find_glucose_readings(
+            redis_client, key=key, min_ts=min(readings), max_ts=max(readings)
+        )
+    )
+    changed = [
+        (ts, timestamp, mgDl)
+        for ts, (timestamp, mgDl) in sorted(readings.items())
+        if previous_mgdls.get(ts) != mgDl
+    ]
+    logging.info(
+        f"Recording glucose data, key={key}, {len(changed)} changed record(s) "
+        + f"out of {len(records)}"
+    )
+    if not changed:
+        logging.info("Duplicate glucose records, not bumping revision")
+        return 0
+    # the last used scan is read and written while holding the lock, so that
+    # concurrent merges do not move it from stale records
+    with user_lock(redis_client, "merged-glucose-records"):
+        merged = _replay_merged_glucose_records(record_type, changed)
+        p = redis_client.pipeline()
+        for ts, _, _ in changed:
+            p.zremrangebyscore(key, ts, ts)
+        p.zadd(key, {encode_glucose_member(ts, mgDl): ts for ts, _, mgDl in changed})
+        if merged is not None and merged[1] is not None:
+            _set_last_used_scan(p, merged[1])
+        revision_index = len(p)
+        queue_bump_revision(p)
+        revision = p.execute()[revision_index]
+    update_daily_glucose_aggregates(
+        redis_client, key=key, timestamps=[ts for ts, _, _ in changed]
+    )
+    if merged is not None:
+        # keep the merged records for the new revision, so that we don't need to
+        # merge them again when reading them
+        set_revision_cached(
+            redis_client,
+            _key_merged,
+            _merged_field(288, do_we_have_realtime_cgm_data()),
+            json.dumps(merged[0]),
+            revision=revision,
+        )
+    call_webhooks_many(
+        f"glucose:new:{record_type.value}",
+        [
+            {"timestamp": timestamp.isoformat(), "mgDl": mgDl}
+            for _, timestamp, mgDl in changed
+        ],
+    )
+    return len(changed)
+
+
+def _replay_merged_glucose_records(
+    record_type: GlucoseRecordType, changed: List[Tuple[float, datetime, int]]
+) -> Optional[Tuple[List[GlucoseRecord], Optional[str]]]:
+    """Replays merging glucose records after each of the given changed readings.
+
+    Merging glucose records updates the last used scan, and we used to merge
+    them after recording each reading (when calling webhooks). When recording
+    many readings at once, we replay these intermediary merges in memory before
+    recording them, so that the last used scan still evolves the same way.
+
+    Returns:
+        the merged records once all readings are recorded (as the next read
+        would merge them, with the new last used scan), and the new last used
+        scan if it has changed; or None if merging does not depend on the last
+        used scan
+    """
+    if not changed:
+        return None
+    redis_client = assert_get_current_request_redis_client()
+    records_historic = get_latest_glucose_records(GlucoseRecordType.historic)
+    if record_type == GlucoseRecordType.scan and not records_historic:
+        # no historic records, merging does not use the last used scan
+        return None
+    if record_type == GlucoseRecordType.historic:
+        # historic records can only move forward, so we fetch the scan records
+        # more recent than the last historic record of the first merge
+        min_scan_ts = changed[0][0]
+        if records_historic:
+            min_scan_ts = max(min_scan_ts, _record_ts(records_historic[0]))
+    else:
+        min_scan_ts = _record_ts(records_historic[0])
+    last_historic_ts = _record_ts(records_historic[0]) if records_historic else None
+    records_scan = _readings_to_glucose_records(
+        GlucoseRecordType.scan,
+        find_glucose_readings(
+            redis_client,
+            key=_key(GlucoseRecordType.scan),
+            min_ts=min_scan_ts,
+            max_ts=math.inf,
+            min_exclusive=True,
+        ),
     )
+    last_used_scan = _get_last_used_scan()
+    has_cgm_realtime_data = do_we_have_realtime_cgm_data()
+
+    historic_by_ts = {_record_ts(record): record for record in records_historic}
+    scan_by_ts = {_record_ts(record): record for record in records_scan}
+    scan_timestamps = sorted(scan_by_ts)
+    merged_records: List[GlucoseRecord] = []
+    new_last_used_scan: Optional[str] = None
+    for ts, _, mgDl in changed:
+        record = GlucoseRecord(
+            timestamp=datetime.fromtimestamp(ts, tz=tz).isoformat(),
+            mgDl=mgDl,
+            record_type=record_type,
+        )
+        if record_type == GlucoseRecordType.historic:
+            historic_by_ts[ts] = record
+            # keep the last 288 historic records, as get_last() does
+            historic_timestamps = sorted(historic_by_ts, reverse=True)
+            for old_ts in historic_timestamps[288:]:
+                del historic_by_ts[old_ts]
+            step_records_historic = [
+                historic_by_ts[ts] for ts in historic_timestamps[:288]
+            ]
+            step_records_scan = [
+                scan_by_ts[ts] for ts in scan_timestamps if ts > historic_timestamps[0]
+            ]
+        else:
+            # scan records older than the last historic record are not merged
+            assert last_historic_ts is not None
+            if ts > last_historic_ts:
+                if ts not in scan_by_ts:
+                    bisect.insort(scan_timestamps, ts)
+                scan_by_ts[ts] = record
+            step_records_historic = records_historic
+            step_records_scan = [scan_by_ts[ts] for ts in scan_timestamps]
+        merged_records, step_last_used_scan = _merge_glucose_records(
+            records_historic=step_records_historic,
+            records_scan=step_records_scan,
+            last_used_scan=last_used_scan,
+            has_cgm_realtime_data=has_cgm_realtime_data,
+        )
+        if step_last_used_scan is not None:
+            new_last_used_scan = step_last_used_scan
+            last_used_scan = datetime.fromisoformat(new_last_used_scan)
+    if step_last_used_scan is not None:
+        # the last merge moved the last used scan, merge again with it, as
+        # reading the merged records would
+        merged_records, _ = _merge_glucose_records(
+            records_historic=step_records_historic,
+            records_scan=step_records_scan,
+            last_used_scan=last_used_scan,
+            has_cgm_realtime_data=has_cgm_realtime_data,
+        )
+    return merged_records, new_last_used_scan
+
+
+def _record_ts(record: GlucoseRecord) -> float:
+    return datetime.fromisoformat(record["timestamp"]).timestamp()
+
+
+def _members_to_glucose_records(
+    record_type: GlucoseRecordType, members: List[bytes]
+) -> List[GlucoseRecord]:
+    return _readings_to_glucose_records(record_type, decode_glucose_members(members))
+
+
+def _readings_to_glucose_records(
+    record_type: GlucoseRecordType, readings: List[Tuple[float, Any]]
+) -> List[GlucoseRecord]:
+    return [
+        GlucoseRecord(
+            timestamp=datetime.fromtimestamp(ts, tz=tz).isoformat(),
+            mgDl=mgDl,
+            record_type=record_type,
+        )
+        for ts, mgDl in readings
+    ]
 
 
 def _key(record_type: GlucoseRecordType) -> str:
@@ -109,12 +345,10 @@ def get_latest_glucose_records(
 ) -> List[GlucoseRecord]:
     """Gets the latest last_n records of a given type."""
     redis_client = assert_get_current_request_redis_client()
-    records = []
-    key = _key(record_type)
-    # use zrange to return the last last_n entries ranked by score
-    res = redis_client.zrange(key, -last_n, -1)
-    for member in res:
-        records.append(_member_to_glucose_record(record_type, member))
+    records = _readings_to_glucose_records(
+        record_type,
+        get_latest_glucose_readings(redis_client, key=_key(record_type), last_n=last_n),
+    )
     records.reverse()
     return records
 
@@ -124,19 +358,64 @@ def get_merged_glucose_records(
 ) -> List[GlucoseRecord]:
     """Gets last historic records, and all more recent scan records.
 
-    This is a wrapper around the implementation, with a mutex to make sure that
-    we won't run this concurrently.
+    This is a wrapper around the implementation. Merged records are computed
+    once per revision and kept in a cache (recording glucose readings keep it
+    up to date), and we use a lock of the user to make sure that we won't
+    compute them concurrently (if we can not get it in time, we compute them
+    anyway, but leave the last used scan and the cache alone).
     """
-    with _merged_glucose_records_lock:
+    redis_client = assert_get_current_request_redis_client()
+    field = _merged_field(last_n_historic, do_we_have_realtime_cgm_data())
+    _, cached = get_revision_cached(redis_client, _key_merged, field)
+    if cached is not None:
+        incr_metric("glucose.merged.hits")
+        return json.loads(cached)
+    try:
+        with user_lock(redis_client, "merged-glucose-records"):
+            # check if another request has merged records while we were waiting
+            revision, cached = get_revision_cached(redis_client, _key_merged, field)
+            if cached is not None:
+                incr_metric("glucose.merged.hits")
+                return json.loads(cached)
+            incr_metric("glucose.merged.misses")
+            records = _get_merged_glucose_records_impl(
+                last_n_historic=last_n_historic, last_n_scan=last_n_scan
+            )
+            set_revision_cached(
+                redis_client,
+                _key_merged,
+                field,
+                json.dumps(records),
+                revision=revision,
+            )
+            return records
+    except LockTimeoutError:
+        incr_metric("glucose.merged.misses")
         return _get_merged_glucose_records_impl(
-            last_n_historic=last_n_historic, last_n_scan=last_n_scan
+            last_n_historic=last_n_historic,
+            last_n_scan=last_n_scan,
+            update_last_used_scan=False,
         )
 
 
+def _merged_field(last_n_historic: int, has_cgm_realtime_data: bool) -> str:
+    return f"{last_n_historic}:{int(has_cgm_realtime_data)}"
+
+
 def _get_merged_glucose_records_impl(
-    last_n_historic: int = 288, last_n_scan: int = 288
+    last_n_historic: int = 288,
+    last_n_scan: int = 288,
+    *,
+    update_last_used_scan: bool = True,
 ) -> List[GlucoseRecord]:
-    """Gets last historic records, and all more recent scan records."""
+    """Gets last historic records, and all more recent scan records.
+
+    Args:
+        last_n_historic: the number of historic records
+        last_n_scan: the number of scan records
+        update_last_used_scan: whether to record the last used scan, which
+            should only be done while holding the merged-glucose-records lock
+    """
     redis_client = assert_get_current_request_redis_client()
     records_historic = get_latest_glucose_records(
         GlucoseRecordType.historic, last_n=last_n_historic
@@ -149,18 +428,71 @@ def _get_merged_glucose_records_impl(
     last_historic_ts = datetime.fromisoformat(
         records_historic[0]["timestamp"]
     ).timestamp()
-    last_used_scan = datetime.fromisoformat(
-        (redis_client.get(_key_last_used_scan) or b"1970-01-01T00:00:00Z").decode()
-    )
+    last_used_scan = _get_last_used_scan()
     logging.debug("last_used_scan=%s", last_used_scan)
-    last_used_scan_ts = last_used_scan.timestamp()
 
-    res = redis_client.zrangebyscore(
-        _key(GlucoseRecordType.scan), f"({last_historic_ts}", "+inf"
+    records_scan = _readings_to_glucose_records(
+        GlucoseRecordType.scan,
+        find_glucose_readings(
+            redis_client,
+            key=_key(GlucoseRecordType.scan),
+            min_ts=last_historic_ts,
+            max_ts=math.inf,
+            min_exclusive=True,
+        ),
+    )
+
+    results, new_last_used_scan = _merge_glucose_records(
+        records_historic=records_historic,
+        records_scan=records_scan,
+        last_used_scan=last_used_scan,
+        has_cgm_realtime_data=do_we_have_realtime_cgm_data(),
+    )
+    if new_last_used_scan is not None and update_last_used_scan:
+        _set_last_used_scan(redis_client, new_last_used_scan)
+
+    return results
+
+
+def _set_last_used_scan(
+    redis_client: Union[redis.Redis, Pipeline], last_used_scan: str
+) -> None:
+    _set_last_used_scan_script(
+        keys=[_key_last_used_scan, _key_last_used_scan_ts],
+        args=[last_used_scan, datetime.fromisoformat(last_used_scan).timestamp()],
+        client=redis_client,
+    )
+
+
+def _get_last_used_scan() -> datetime:
+    redis_client = assert_get_current_request_redis_client()
+    return datetime.fromisoformat(
+        (redis_client.get(_key_last_used_scan) or b"1970-01-01T00:00:00Z").decode()
     )
-    records_scan = []
-    for member in res:
-        records_scan.append(_member_to_glucose_record(GlucoseRecordType.scan, member))
+
+
+def _merge_glucose_records(
+    *,
+    records_historic: List[GlucoseRecord],
+    records_scan: List[GlucoseRecord],
+    last_used_scan: datetime,
+    has_cgm_realtime_data: bool,
+) -> Tuple[List[GlucoseRecord], Optional[str]]:
+    """Merges last historic records with the more recent scan records.
+
+    Args:
+        records_historic: the last historic records, most recent first
+        records_scan: the scan records more recent than the last historic
+            record, oldest first
+        last_used_scan: the timestamp of the last used scan
+        has_cgm_realtime_data: whether we have realtime CGM data
+    Returns:
+        the merged records, and the new last used scan if it has changed
+    """
+    last_historic_ts = datetime.fromisoformat(
+        records_historic[0]["timestamp"]
+    ).timestamp()
+    last_used_scan_ts = last_used_scan.timestamp()
 
     # keep the last scan record, we'll check if it crosses with the current
     # last, and add it back if it does
@@ -169,7 +501,6 @@ def _get_merged_glucose_records_impl(
         last_scan_record = records_scan[-1]
     logging.debug(f"last_scan_record={last_scan_record}")
 
-    has_cgm_realtime_data = do_we_have_realtime_cgm_data()
     logging.debug(f"has_cgm_realtime_data={has_cgm_realtime_data}")
 
     # keep only records around 4 minutes 50 seconds apart the last historic
@@ -196,7 +527,7 @@ def _get_merged_glucose_records_impl(
     #    # no records around 5 minutes apart, keep the last one
     #    records_scan.reverse()
     #    records_scan = [records_scan[0]]
-    records_scan.reverse()
+    records_scan = list(reversed(records_scan))
 
     results = records_scan + records_historic
 
@@ -235,9 +566,9 @@ def _get_merged_glucose_records_impl(
     if new_scans and new_scans[0]:
         new_last_used_scan = new_scans[0]["timestamp"]
         if datetime.fromisoformat(new_last_used_scan) > last_used_scan:
-            redis_client.set(_key_last_used_scan, new_last_used_scan)
+            return results, new_last_used_scan
 
-    return results
+    return results, None
 
 
 def get_current_glucose_record() -> Optional[GlucoseRecord]:
@@ -269,36 +600,41 @@ def insert_glucose_records(
     glucose_records = sorted(
         glucose_records, key=lambda record: record["timestamp"], reverse=False
     )
-    for record in glucose_records:
-        if _get_record_type(record) != "historic":
-            continue
-        record_glucose_data(
-            GlucoseRecordType.historic,
-            parse_timestamp(record["timestamp"]),
-            record["mgDl"],
-            trigger_episode_changes=False,
-        )
+    record_glucose_records(
+        GlucoseRecordType.historic,
+        [
+            (parse_timestamp(record["timestamp"]), record["mgDl"])
+            for record in glucose_records
+            if _get_record_type(record) == "historic"
+        ],
+    )
     if device is not None:
         model_name = device["model_name"]
         device_id = device["device_id"]
     else:
         model_name = "Unknown"
         device_id = "00000000-0000-0000-0000-000000000000"
-    for record in glucose_records:
-        if _get_record_type(record) != "scan":
-            continue
-        record_glucose_data(
-            GlucoseRecordType.scan,
-            parse_timestamp(record["timestamp"]),
-            record["mgDl"],
-            trigger_episode_changes=False,
-        )
-        record_instant_glucose_data(
-            parse_timestamp(record["timestamp"]),
-            record["mgDl"],
-            model_name=record.get("model_name", model_name),
-            device_id=record.get("device_id", device_id),
-        )
+    scan_records = [
+        record for record in glucose_records if _get_record_type(record) == "scan"
+    ]
+    record_glucose_records(
+        GlucoseRecordType.scan,
+        [
+            (parse_timestamp(record["timestamp"]), record["mgDl"])
+            for record in scan_records
+        ],
+    )
+    record_instant_glucose_records(
+        [
+            (
+                parse_timestamp(record["timestamp"]),
+                record["mgDl"],
+                record.get("model_name", model_name),
+                record.get("device_id", device_id),
+            )
+            for record in scan_records
+        ]
+    )
     return InsertGlucoseRecordsStatus(
         success=True, status=f"added {len(glucose_records)} record(s)"
     )
@@ -331,13 +667,25 @@ def just_updated_glucose(
     )
 
 
+def get_glucose_keys() -> List[str]:
+    """Get the keys holding the glucose records of a user."""
+    keys: List[str] = []
+    for record_type in GlucoseRecordType:
+        keys += [
+            _key(record_type),
+            *get_glucose_archive_keys(_key(record_type)),
+            get_daily_glucose_aggregates_key(_key(record_type)),
+        ]
+    return keys
+
+
 @app.route("/opengluck/glucose", methods=["DELETE"])
 def _clear_all_glucose_records():
     """Delete all glucose records."""
     redis_client = assert_get_current_request_redis_client()
-    redis_client.delete(_key(GlucoseRecordType.historic))
-    redis_client.delete(_key(GlucoseRecordType.scan))
-    redis_client.delete(_key_last_used_scan)
+    redis_client.delete(*get_glucose_keys())
+    redis_client.delete(_key_last_used_scan, _key_last_used_scan_ts)
+    redis_client.delete(_key_merged)
     bump_revision(redis_client)
     return Response(status=204)
 
@@ -371,6 +719,7 @@ def _get_record_type(record: dict) -> str:
 
 
 @app.route("/opengluck/glucose/upload", methods=["GET", "POST"])
+@limiter.limit(upload_rate_limit)
 def _upload_glucose_data():
     # decode the POST payload as an array of glucose records
     # LATER DEPRECATED this route is deprecated
@@ -425,22 +774,304 @@ def _upload_glucose_data():
     )
 
 
+def migrate_glucose_records_encoding(
+    redis_client: redis.Redis, *, chunk_size: int = 1000
+) -> int:
+    """Migrate the glucose records of a user to the binary encoding.
+
+    This can run while the server is running: records are migrated by chunks,
+    in a script that skips records that have changed in the meantime.
+
+    Args:
+        redis_client: the redis client of the user
+        chunk_size: the number of records to migrate at once
+    Returns:
+        the number of migrated records
+    """
+    migrated = 0
+    for record_type in GlucoseRecordType:
+        key = _key(record_type)
+        min_score = "-inf"
+        while True:
+            members = redis_client.zrangebyscore(
+                key, min_score, "+inf", start=0, num=chunk_size, withscores=True
+            )
+            args = []
+            for member, score in members:
+                if is_encoded_glucose_member(member):
+                    continue
+                new_member = encode_glucose_member(*decode_glucose_member(member))
+                if new_member != member:
+                    args.extend((member, new_member, score))
+            if args:
+                migrated += _migrate_encoding_script(
+                    keys=[key], args=args, client=redis_client
+                )
+            if len(members) < chunk_size:
+                break
+            min_score = f"({members[-1][1]!r}"
+    return migrated
+
+
+def archive_glucose_records(
+    redis_client: redis.Redis, *, before: datetime, max_days: Optional[int] = None
+) -> Tuple[int, bool]:
+    """Move the glucose records of the days over before a date to the archive.
+
+    Archived records are still returned when reading records, see
+    glucose_archive.
+
+    Args:
+        redis_client: the redis client of the user
+        before: only archive the days that are over at this date
+        max_days: the maximum number of days to archive per record type, the
+            next ones are archived on the next call
+    Returns:
+        the number of archived records, and whether all the days before the
+        date have been processed
+    """
+    archived = 0
+    done = True
+    for record_type in GlucoseRecordType:
+        record_type_archived, record_type_done = archive_glucose_readings(
+            redis_client,
+            key=_key(record_type),
+            before_ts=before.timestamp(),
+            max_days=max_days,
+        )
+        archived += record_type_archived
+        done &= record_type_done
+    return archived, done
+
+
+def delete_glucose_records(
+    redis_client: redis.Redis,
+    *,
+    record_type: GlucoseRecordType,
+    before: datetime,
+    max_days: int,
+) -> Tuple[int, bool]:
+    """Delete the glucose records of the days over before a date.
+
+    Records are deleted from the sorted set and the archive, and the daily
+    aggregates of these days are deleted as well.
+
+    Args:
+        redis_client: the redis client of the user
+        record_type: the type of the records
+        before: only delete the days that are over at this date
+        max_days: the maximum number of days to delete from the sorted set,
+            the next ones are deleted on the next call
+    Returns:
+        the number of deleted records, and whether all the records before the
+        date have been deleted
+    """
+    key = _key(record_type)
+    before_ts = math.floor(before.timestamp() / _DAY) * _DAY
+    deleted, deleted_until = trim_sorted_set(
+        redis_client, key=key, before_ts=before_ts, max_days=max_days
+    )
+    deleted += delete_archived_glucose_readings(
+        redis_client, key=key, before_ts=deleted_until
+    )
+    if deleted:
+        delete_daily_glucose_aggregates(redis_client, key=key, before_ts=deleted_until)
+        bump_revision(redis_client)
+    logging.info(f"Deleted {deleted} record(s) of {key} before {deleted_until}")
+    return deleted, deleted_until == before_ts
+
+
 def find_glucose_records(
     record_type: GlucoseRecordType, from_date: datetime, to_date: datetime
 ) -> List[GlucoseRecord]:
     """Find glucose records in the given time range."""
+    result = _readings_to_glucose_records(
+        record_type, find_glucose_values(record_type, from_date, to_date)
+    )
+    logging.debug(f"Found {len(result)} record(s)")
+    return result
+
+
+def iter_glucose_records(
+    record_type: GlucoseRecordType, from_date: datetime, to_date: datetime
+) -> Iterator[GlucoseRecord]:
+    """Find glucose records in the given time range, reading them by pages."""
+    redis_client = assert_get_current_request_redis_client()
+    for ts, mgDl in iter_glucose_readings(
+        redis_client,
+        key=_key(record_type),
+        min_ts=from_date.timestamp(),
+        max_ts=to_date.timestamp(),
+    ):
+        yield GlucoseRecord(
+            timestamp=datetime.fromtimestamp(ts, tz=tz).isoformat(),
+            mgDl=mgDl,
+            record_type=record_type,
+        )
+
+
+def find_glucose_records_page(
+    record_type: GlucoseRecordType,
+    from_date: datetime,
+    to_date: datetime,
+    *,
+    limit: int,
+    after: Optional[float] = None,
+) -> Tuple[List[GlucoseRecord], Optional[float]]:
+    """Find a page of glucose records in the given time range.
+
+    Args:
+        record_type: the type of the records
+        from_date: the start of the time range
+        to_date: the end of the time range
+        limit: the maximum number of records to return
+        after: the timestamp of the last record of the previous page
+    Returns:
+        the records, and the timestamp of the last one if there are more
+    """
     redis_client = assert_get_current_request_redis_client()
     from_ts = from_date.timestamp()
-    to_ts = to_date.timestamp()
+    readings = list(
+        itertools.islice(
+            iter_glucose_readings(
+                redis_client,
+                key=_key(record_type),
+                min_ts=from_ts if after is None else max(from_ts, after),
+                max_ts=to_date.timestamp(),
+                min_exclusive=after is not None and after >= from_ts,
+            ),
+            limit + 1,
+        )
+    )
+    records = _readings_to_glucose_records(record_type, readings[:limit])
+    return records, readings[limit - 1][0] if len(readings) > limit else None
+
+
+def find_glucose_values(
+    record_type: GlucoseRecordType, from_date: datetime, to_date: datetime
+) -> List[Tuple[float, Any]]:
+    """Find the timestamp and mgDl of glucose records in the given time range.
+
+    This is faster than find_glucose_records, when records are not needed.
+    """
+    redis_client = assert_get_current_request_redis_client()
     key = _key(record_type)
     from_ts = from_date.timestamp()
     to_ts = to_date.timestamp()
-    result = []
     logging.debug(f"Finding records for key {key} between {from_ts} and {to_ts}")
-    for member in redis_client.zrangebyscore(key, from_ts, to_ts):
-        result.append(_member_to_glucose_record(record_type, member))
-    logging.debug(f"Found {len(result)} record(s)")
-    return result
+    return find_glucose_readings(redis_client, key=key, min_ts=from_ts, max_ts=to_ts)
+
+
+def aggregate_glucose_records(
+    record_type: GlucoseRecordType, from_date: datetime, to_date: datetime
+) -> Optional[GlucoseAggregate]:
+    """Aggregate the glucose records of the given time range.
+
+    Records are interpolated minute by minute, see glucose_aggregates.
+    """
+    redis_client = assert_get_current_request_redis_client()
+    return get_glucose_aggregate(
+        redis_client,
+        key=_key(record_type),
+        from_ts=from_date.timestamp(),
+        to_ts=to_date.timestamp(),
+    )
+
+
+def find_glucose_buckets(
+    record_type: GlucoseRecordType,
+    from_date: datetime,
+    to_date: datetime,
+    *,
+    resolution: float,
+) -> List[GlucoseBucket]:
+    """Aggregate the glucose records of the given time range by buckets.
+
+    Args:
+        record_type: the type of the records
+        from_date: the start of the time range
+        to_date: the end of the time range
+        resolution: the duration of the buckets, in seconds
+    Returns:
+        the buckets with records, see glucose_aggregates.get_glucose_buckets
+    """
+    redis_client = assert_get_current_request_redis_client()
+    return [
+        GlucoseBucket(
+            timestamp=datetime.fromtimestamp(ts, tz=tz).isoformat(),
+            # readings within a minute of the previous one have no count
+            mgDl=(
+                aggregate["sum"] / aggregate["count"]
+                if aggregate["count"]
+                else aggregate["min"]
+            ),
+            min=aggregate["min"],
+            max=aggregate["max"],
+            record_type=record_type,
+        )
+        for ts, aggregate in get_glucose_buckets(
+            redis_client,
+            key=_key(record_type),
+            from_ts=from_date.timestamp(),
+            to_ts=to_date.timestamp(),
+            resolution=resolution,
+        )
+    ]
+
+
+def get_bucket_resolution(
+    from_date: datetime, to_date: datetime, *, max_points: int
+) -> int:
+    """Get the duration of the buckets to return at most max_points buckets.
+
+    Durations are rounded up to whole minutes, or whole days if longer, so that
+    buckets can use the daily aggregates.
+    """
+    # the first and last buckets may be partial
+    duration = (to_date - from_date).total_seconds() / max(max_points - 1, 1)
+    unit = _DAY if duration > _DAY else _min_bucket_resolution
+    return max(math.ceil(duration / unit) * unit, _min_bucket_resolution)
+
+
+def rebuild_glucose_aggregates(redis_client: redis.Redis) -> int:
+    """Compute the daily aggregates of the glucose records of a user again.
+
+    Returns:
+        the number of days with records
+    """
+    return sum(
+        rebuild_daily_glucose_aggregates(redis_client, key=_key(record_type))
+        for record_type in GlucoseRecordType
+    )
+
+
+def _find_glucose_buckets(
+    record_type: GlucoseRecordType, from_date: datetime, to_date: datetime
+) -> Response:
+    page_args = get_page_args(GlucoseBucket.__annotations__)
+    # buckets are not paginated
+    if page_args["limit"] is not None:
+        return abort(400)
+    try:
+        if "resolution" in request.args:
+            resolution = int(request.args["resolution"])
+            max_points = None
+        else:
+            max_points = int(request.args["max_points"])
+    except ValueError:
+        return abort(400)
+    if max_points is not None:
+        if max_points < 1:
+            return abort(400)
+        resolution = get_bucket_resolution(from_date, to_date, max_points=max_points)
+    if resolution < _min_bucket_resolution:
+        return abort(400)
+    buckets = find_glucose_buckets(
+        record_type, from_date, to_date, resolution=resolution
+    )
+    response = page_response(buckets, next_cursor=None, fields=page_args["fields"])
+    response.headers["x-opengluck-resolution"] = str(resolution)
+    return response
 
 
 @app.route("/opengluck/glucose/find")
@@ -451,7 +1082,25 @@ def _find_glucose_records():
     if from_date is None or to_date is None:
         return abort(400)
     record_type = GlucoseRecordType(request.args.get("type", "historic"))
-    records = find_glucose_records(
-        record_type, parse_timestamp(from_date), parse_timestamp(to_date)
+    if "resolution" in request.args or "max_points" in request.args:
+        return _find_glucose_buckets(
+            record_type, parse_timestamp(from_date), parse_timestamp(to_date)
+        )
+    page_args = get_page_args(GlucoseRecord.__annotations__)
+    if page_args["limit"] is None:
+        records = find_glucose_records(
+            record_type, parse_timestamp(from_date), parse_timestamp(to_date)
+        )
+        return page_response(records, next_cursor=None, fields=page_args["fields"])
+    records, last_ts = find_glucose_records_page(
+        record_type,
+        parse_timestamp(from_date),
+        parse_timestamp(to_date),
+        limit=page_args["limit"],
+        after=page_args["cursor"][0] if page_args["cursor"] else None,
+    )
+    return page_response(
+        records,
+        next_cursor=encode_cursor(last_ts) if last_ts is not None else None,
+        fields=page_args["fields"],
     )
-    return Response(json.dumps(records), content_type="application/json")
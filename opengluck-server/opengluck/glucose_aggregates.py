@@ -0,0 +1,428 @@
+"""Aggregate glucose readings per day, to compute averages over long ranges.
+
+The average glucose of a range is computed by interpolating readings minute
+by minute, when they are at most an hour apart. Each reading contributes the
+interpolated values since the previous reading (or its own value, after a
+gap), so that the sum and the number of values of a range can be added up.
+
+We keep these per (UTC) day in a hash, updated when readings are recorded.
+The average of a range is then the sum of the days it covers, and we only need
+to read the readings of the partial days at both ends.
+
+Ranges can also be aggregated by buckets (e.g. to draw charts of long ranges),
+in which case each reading contributes to the bucket it belongs to. Buckets
+start at multiples of their duration, so that buckets of whole days are made
+of the daily aggregates.
+"""
+import json
+import math
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TypedDict
+
+import numpy as np
+import redis
+from redis import WatchError
+from redis.client import Pipeline
+
+from .glucose_archive import find_glucose_readings, get_glucose_archive_keys
+from .metrics import incr_metric
+
+_DAY = 24 * 60 * 60
+
+"""Readings further apart than this number of seconds are not interpolated."""
+max_interpolation_duration = 60 * 60
+
+# the hash always has this field once it has been built
+_built_field = "built"
+
+# concurrent updates of the same days are retried, after waiting for a random
+# duration of up to _RETRY_BACKOFF * 2^retry seconds
+_MAX_RETRIES = 5
+_RETRY_BACKOFF = 0.01
+
+
+class GlucoseAggregate(TypedDict):
+    """The aggregate of glucose readings, interpolated minute by minute."""
+
+    sum: float
+    count: int
+    min: Any
+    max: Any
+
+
+def get_daily_glucose_aggregates_key(key: str) -> str:
+    """Get the key of the daily aggregates of the readings of a sorted set."""
+    return f"{key}:daily"
+
+
+def _day(ts: float) -> int:
+    return math.floor(ts / _DAY)
+
+
+def _interpolate(
+    previous: Optional[Tuple[float, Any]], ts: float, mgDl: Any
+) -> Tuple[float, int]:
+    """Get the sum and number of the values interpolated since a reading.
+
+    Args:
+        previous: the previous reading, if any
+        ts: the timestamp of the reading
+        mgDl: the glucose value of the reading
+    """
+    if previous is None or ts - previous[0] > max_interpolation_duration:
+        return mgDl, 1
+    # one value per minute after the previous reading, up to this one
+    minutes = int((ts - previous[0]) // 60)
+    if minutes == 0:
+        return 0, 0
+    slope = (mgDl - previous[1]) / ((ts - previous[0]) / 60)
+    return minutes * previous[1] + slope * minutes * (minutes + 1) / 2, minutes
+
+
+def _add(
+    aggregate: Optional[GlucoseAggregate], other: Optional[GlucoseAggregate]
+) -> Optional[GlucoseAggregate]:
+    if aggregate is None or other is None:
+        return aggregate or other
+    return GlucoseAggregate(
+        sum=aggregate["sum"] + other["sum"],
+        count=aggregate["count"] + other["count"],
+        min=min(aggregate["min"], other["min"]),
+        max=max(aggregate["max"], other["max"]),
+    )
+
+
+def aggregate_glucose_readings(
+    readings: Iterable[Tuple[float, Any]],
+    *,
+    previous: Optional[Tuple[float, Any]] = None,
+) -> Optional[GlucoseAggregate]:
+    """Aggregate glucose readings.
+
+    Args:
+        readings: the timestamp and glucose value of the readings, oldest first
+        previous: the reading before the first one, if it should be used to
+            interpolate values
+    Returns:
+        the aggregate, or None if there are no readings
+    """
+    aggregate: Optional[GlucoseAggregate] = None
+    for ts, mgDl in readings:
+        total, count = _interpolate(previous, ts, mgDl)
+        aggregate = _add(
+            aggregate, GlucoseAggregate(sum=total, count=count, min=mgDl, max=mgDl)
+        )
+        previous = (ts, mgDl)
+    return aggregate
+
+
+def _aggregate_days(
+    readings: List[Tuple[float, Any]], days: Set[int]
+) -> Dict[int, Optional[GlucoseAggregate]]:
+    aggregates: Dict[int, Optional[GlucoseAggregate]] = {day: None for day in days}
+    previous: Optional[Tuple[float, Any]] = None
+    for ts, mgDl in readings:
+        day = _day(ts)
+        if day in aggregates:
+            aggregates[day] = _add(
+                aggregates[day],
+                aggregate_glucose_readings([(ts, mgDl)], previous=previous),
+            )
+        previous = (ts, mgDl)
+    return aggregates
+
+
+def _queue_write_days(
+    p: Pipeline, key: str, aggregates: Dict[int, Optional[GlucoseAggregate]]
+) -> None:
+    for day, aggregate in aggregates.items():
+        if aggregate is None:
+            p.hdel(get_daily_glucose_aggregates_key(key), day)
+        else:
+            p.hset(get_daily_glucose_aggregates_key(key), day, json.dumps(aggregate))
+
+
+def update_daily_glucose_aggregates(
+    redis_client: redis.Redis, *, key: str, timestamps: Iterable[float]
+) -> None:
+    """Update the daily aggregates after readings have changed.
+
+    The readings are read while watching their keys, and read again if they
+    change before the aggregates are written, so that concurrent updates of the
+    same days never leave aggregates computed from older readings. If they keep
+    changing, we give up and delete the aggregates instead, so that they are
+    built again on the next read.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        timestamps: the timestamps of the readings that have changed
+    """
+    # the next reading is interpolated from a changed one, when it is close
+    days = sorted(
+        {_day(ts) for ts in timestamps}
+        | {_day(ts + max_interpolation_duration) for ts in timestamps}
+    )
+    # read the readings of consecutive days at once
+    while days:
+        first_day = last_day = days.pop(0)
+        while days and days[0] == last_day + 1:
+            last_day = days.pop(0)
+        for retry in range(_MAX_RETRIES + 1):
+            if retry:
+                incr_metric("glucose.aggregates.retries")
+                time.sleep(random.uniform(0, _RETRY_BACKOFF * 2**retry))
+            try:
+                p = redis_client.pipeline()
+                p.watch(key, *get_glucose_archive_keys(key))
+                readings = find_glucose_readings(
+                    redis_client,
+                    key=key,
+                    min_ts=first_day * _DAY - max_interpolation_duration,
+                    max_ts=(last_day + 1) * _DAY,
+                )
+                p.multi()
+                _queue_write_days(
+                    p,
+                    key,
+                    _aggregate_days(readings, set(range(first_day, last_day + 1))),
+                )
+                p.execute()
+                break
+            except WatchError:
+                continue
+        else:
+            incr_metric("glucose.aggregates.given_up")
+            redis_client.delete(get_daily_glucose_aggregates_key(key))
+            return
+
+
+def rebuild_daily_glucose_aggregates(redis_client: redis.Redis, *, key: str) -> int:
+    """Compute the daily aggregates of all the readings again.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+    Returns:
+        the number of days with readings
+    """
+    readings = find_glucose_readings(
+        redis_client, key=key, min_ts=-math.inf, max_ts=math.inf
+    )
+    aggregates = _aggregate_days(readings, {_day(ts) for ts, _ in readings})
+    p = redis_client.pipeline()
+    p.delete(get_daily_glucose_aggregates_key(key))
+    p.hset(get_daily_glucose_aggregates_key(key), _built_field, "")
+    _queue_write_days(p, key, aggregates)
+    p.execute()
+    return len(aggregates)
+
+
+def _aggregate_buckets(
+    readings: List[Tuple[float, Any]],
+    *,
+    resolution: float,
+    previous: Optional[Tuple[float, Any]] = None,
+) -> Dict[int, GlucoseAggregate]:
+    """Aggregate glucose readings by buckets, like aggregate_glucose_readings.
+
+    Args:
+        readings: the timestamp and glucose value of the readings, oldest first
+        resolution: the duration of the buckets, in seconds
+        previous: the reading before the first one, if it should be used to
+            interpolate values
+    Returns:
+        the aggregates of the buckets with readings, by bucket index
+    """
+    if not readings:
+        return {}
+    timestamps = np.array([ts for ts, _ in readings], dtype=np.float64)
+    values = np.array([mgDl for _, mgDl in readings])
+    previous_timestamps = np.r_[previous[0] if previous else -np.inf, timestamps[:-1]]
+    previous_values = np.r_[previous[1] if previous else 0, values[:-1]]
+    # the same as _interpolate, for all readings at once
+    elapsed = (timestamps - previous_timestamps) / 60
+    minutes = np.floor(elapsed)
+    gaps = elapsed > max_interpolation_duration / 60
+    # values after a gap (or the first one) are not interpolated
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = (values - previous_values) / elapsed
+        sums = np.where(
+            gaps,
+            values,
+            minutes * previous_values + slopes * minutes * (minutes + 1) / 2,
+        )
+    counts = np.where(gaps, 1, minutes).astype(np.int64)
+
+    indexes = np.floor(timestamps / resolution).astype(np.int64)
+    buckets, starts = np.unique(indexes, return_index=True)
+    return {
+        bucket: GlucoseAggregate(sum=total, count=count, min=low, max=high)
+        for bucket, total, count, low, high in zip(
+            buckets.tolist(),
+            np.add.reduceat(sums, starts).tolist(),
+            np.add.reduceat(counts, starts).tolist(),
+            np.minimum.reduceat(values, starts).tolist(),
+            np.maximum.reduceat(values, starts).tolist(),
+        )
+    }
+
+
+def _get_full_days(from_ts: float, to_ts: float) -> Tuple[int, int]:
+    """Get the days whose daily aggregates can be used for a time range.
+
+    The first day must start late enough so that its first reading is
+    interpolated from a reading of the range (if at all).
+    """
+    first_day = math.ceil((from_ts + max_interpolation_duration) / _DAY)
+    last_day = math.floor(to_ts / _DAY) - 1
+    return first_day, last_day
+
+
+def _assert_built(redis_client: redis.Redis, *, key: str) -> None:
+    if not redis_client.hexists(get_daily_glucose_aggregates_key(key), _built_field):
+        rebuild_daily_glucose_aggregates(redis_client, key=key)
+
+
+def get_glucose_aggregate(
+    redis_client: redis.Redis, *, key: str, from_ts: float, to_ts: float
+) -> Optional[GlucoseAggregate]:
+    """Aggregate the readings of a time range.
+
+    This returns the same result as aggregating all the readings of the range,
+    but uses the daily aggregates for the days fully covered by the range.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        from_ts: the minimum timestamp of the readings
+        to_ts: the maximum timestamp of the readings
+    Returns:
+        the aggregate, or None if there are no readings
+    """
+    first_day, last_day = _get_full_days(from_ts, to_ts)
+    if first_day > last_day:
+        return aggregate_glucose_readings(
+            find_glucose_readings(redis_client, key=key, min_ts=from_ts, max_ts=to_ts)
+        )
+    _assert_built(redis_client, key=key)
+    incr_metric("glucose.aggregates.days", last_day - first_day + 1)
+
+    first_ts = first_day * _DAY
+    head = aggregate_glucose_readings(
+        (ts, mgDl)
+        for ts, mgDl in find_glucose_readings(
+            redis_client, key=key, min_ts=from_ts, max_ts=first_ts
+        )
+        if ts < first_ts
+    )
+    aggregate = head
+    for value in redis_client.hmget(
+        get_daily_glucose_aggregates_key(key), range(first_day, last_day + 1)
+    ):
+        if value is not None:
+            aggregate = _add(aggregate, json.loads(value))
+    end_ts = (last_day + 1) * _DAY
+    tail = find_glucose_readings(
+        redis_client, key=key, min_ts=end_ts - max_interpolation_duration, max_ts=to_ts
+    )
+    previous = [(ts, mgDl) for ts, mgDl in tail if ts < end_ts]
+    return _add(
+        aggregate,
+        aggregate_glucose_readings(
+            ((ts, mgDl) for ts, mgDl in tail if ts >= end_ts),
+            previous=previous[-1] if previous else None,
+        ),
+    )
+
+
+def get_glucose_buckets(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    from_ts: float,
+    to_ts: float,
+    resolution: float,
+) -> List[Tuple[float, GlucoseAggregate]]:
+    """Aggregate the readings of a time range by buckets.
+
+    Buckets start at multiples of resolution (the first one is cut at from_ts).
+    This returns the same result as aggregating all the readings of the range
+    by buckets, but uses the daily aggregates for the days fully covered by the
+    range, when resolution is a number of days.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        from_ts: the minimum timestamp of the readings
+        to_ts: the maximum timestamp of the readings
+        resolution: the duration of the buckets, in seconds
+    Returns:
+        the start timestamp and aggregate of the buckets with readings, oldest
+        first
+    """
+    first_day, last_day = _get_full_days(from_ts, to_ts)
+    if resolution % _DAY or first_day > last_day:
+        buckets = _aggregate_buckets(
+            find_glucose_readings(redis_client, key=key, min_ts=from_ts, max_ts=to_ts),
+            resolution=resolution,
+        )
+    else:
+        _assert_built(redis_client, key=key)
+        incr_metric("glucose.aggregates.days", last_day - first_day + 1)
+        first_ts = first_day * _DAY
+        end_ts = (last_day + 1) * _DAY
+        days = redis_client.hmget(
+            get_daily_glucose_aggregates_key(key), range(first_day, last_day + 1)
+        )
+        head = find_glucose_readings(
+            redis_client, key=key, min_ts=from_ts, max_ts=first_ts
+        )
+        buckets = _aggregate_buckets(
+            [(ts, mgDl) for ts, mgDl in head if ts < first_ts], resolution=resolution
+        )
+        for day, value in zip(range(first_day, last_day + 1), days):
+            if value is not None:
+                bucket = int(day * _DAY // resolution)
+                buckets[bucket] = _add(buckets.get(bucket), json.loads(value))
+        tail = find_glucose_readings(
+            redis_client,
+            key=key,
+            min_ts=end_ts - max_interpolation_duration,
+            max_ts=to_ts,
+        )
+        previous = [(ts, mgDl) for ts, mgDl in tail if ts < end_ts]
+        for bucket, aggregate in _aggregate_buckets(
+            [(ts, mgDl) for ts, mgDl in tail if ts >= end_ts],
+            resolution=resolution,
+            previous=previous[-1] if previous else None,
+        ).items():
+            buckets[bucket] = _add(buckets.get(bucket), aggregate)
+    return [
+        (max(bucket * resolution, from_ts), buckets[bucket])
+        for bucket in sorted(buckets)
+    ]
+
+
+def delete_daily_glucose_aggregates(
+    redis_client: redis.Redis, *, key: str, before_ts: float
+) -> None:
+    """Delete the daily aggregates of the days over before a timestamp.
+
+    This is called after deleting the readings of these days.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        before_ts: the timestamp before which readings have been deleted
+    """
+    days = [
+        field
+        for field in redis_client.hkeys(get_daily_glucose_aggregates_key(key))
+        if field != _built_field.encode() and (int(field) + 1) * _DAY <= before_ts
+    ]
+    if days:
+        redis_client.hdel(get_daily_glucose_aggregates_key(key), *days)
+    # the first reading after before_ts is not interpolated anymore
+    update_daily_glucose_aggregates(redis_client, key=key, timestamps=[before_ts])
@@ -0,0 +1,337 @@
+"""Archive old glucose readings in compact per-day blobs.
+
+Recent glucose readings are stored in a sorted set, one member per reading.
+Once a day is over for long enough, its readings are moved to an archive: a
+hash with one field per (UTC) day, whose value is all the readings of the day
+stored back to back, using the binary encoding of the members. This takes far
+less memory than sorted set members, and reading months of history is a few
+HMGET fields instead of tens of thousands of members.
+
+The archive is read and merged with the sorted set. Days before the
+`archived-until` watermark might be archived, and readings recorded in the
+sorted set afterwards (for instance when uploading old data again) take
+precedence over the archived ones.
+"""
+import bisect
+import math
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import redis
+
+from .glucose_encoding import (decode_glucose_blob, decode_glucose_members,
+                               is_encoded_glucose_member, split_glucose_blob)
+from .metrics import incr_metric
+from .redis import get_redis_client
+
+_DAY = 24 * 60 * 60
+
+# above this number of days, we list the archived days instead of reading all
+# the days of a range
+_MAX_HMGET_DAYS = 366
+
+# archive the readings of a day, unless they have changed since we read them
+_archive_day_script = get_redis_client(db=0).register_script(
+    """
+if (redis.call("HGET", KEYS[2], ARGV[1]) or "") ~= ARGV[2] then
+    return 0
+end
+for i = 5, #ARGV do
+    if not redis.call("ZSCORE", KEYS[1], ARGV[i]) then
+        return 0
+    end
+end
+redis.call("HSET", KEYS[2], ARGV[1], ARGV[3])
+for i = 5, #ARGV, 1000 do
+    redis.call("ZREM", KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+local archived_until = tonumber(redis.call("GET", KEYS[3]) or "0")
+if tonumber(ARGV[4]) > archived_until then
+    redis.call("SET", KEYS[3], ARGV[4])
+end
+return 1
+"""
+)
+
+
+def get_glucose_archive_keys(key: str) -> List[str]:
+    """Get the keys used to archive the readings of a sorted set."""
+    return [_archive_key(key), _archived_until_key(key)]
+
+
+def _archive_key(key: str) -> str:
+    return f"{key}:archive"
+
+
+def _archived_until_key(key: str) -> str:
+    return f"{key}:archived-until"
+
+
+def _day(ts: float) -> int:
+    return math.floor(ts / _DAY)
+
+
+def _get_archived_days(redis_client: redis.Redis, key: str) -> List[int]:
+    return sorted(int(day) for day in redis_client.hkeys(_archive_key(key)))
+
+
+def _read_archived_days(
+    redis_client: redis.Redis, key: str, days: List[int]
+) -> List[Tuple[float, Any]]:
+    if not days:
+        return []
+    blobs = redis_client.hmget(_archive_key(key), [str(day) for day in days])
+    return decode_glucose_blob(b"".join(blob for blob in blobs if blob))
+
+
+def _merge_readings(
+    archived: List[Tuple[float, Any]], live: List[Tuple[float, Any]]
+) -> List[Tuple[float, Any]]:
+    if not archived:
+        return live
+    # archived days are read in order, and their readings are sorted
+    if not live:
+        return archived
+    if live[0][0] > archived[-1][0]:
+        return archived + live
+    readings = dict(archived)
+    # readings of the sorted set take precedence over the archived ones
+    readings.update(live)
+    return sorted(readings.items())
+
+
+def find_glucose_readings(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    min_ts: float,
+    max_ts: float,
+    min_exclusive: bool = False,
+) -> List[Tuple[float, Any]]:
+    """Find the readings of a time range, in the sorted set and the archive.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        min_ts: the minimum timestamp of the readings
+        max_ts: the maximum timestamp of the readings
+        min_exclusive: whether to exclude the readings at min_ts
+    Returns:
+        the timestamp and glucose value of the readings, oldest first
+    """
+    min_arg = f"({min_ts!r}" if min_exclusive else min_ts
+    p = redis_client.pipeline(transaction=False)
+    p.get(_archived_until_key(key))
+    p.zrangebyscore(key, min_arg, max_ts)
+    archived_until, members = p.execute()
+    live = decode_glucose_members(members)
+    if archived_until is None or min_ts >= float(archived_until) or min_ts > max_ts:
+        return live
+    last_day = _day(float(archived_until)) - 1
+    if not math.isinf(max_ts):
+        last_day = min(last_day, _day(max_ts))
+    if math.isinf(min_ts) or last_day - _day(min_ts) > _MAX_HMGET_DAYS:
+        days = [
+            day
+            for day in _get_archived_days(redis_client, key)
+            if (day + 1) * _DAY > min_ts and day <= last_day
+        ]
+    else:
+        days = list(range(_day(min_ts), last_day + 1))
+    incr_metric("glucose.archive.reads")
+    # archived readings are sorted, we only need to trim the first and last days
+    archived = _read_archived_days(redis_client, key, days)
+    if min_exclusive:
+        start = bisect.bisect_right(archived, (min_ts, math.inf))
+    else:
+        start = bisect.bisect_left(archived, (min_ts,))
+    end = bisect.bisect_right(archived, (max_ts, math.inf))
+    return _merge_readings(archived[start:end], live)
+
+
+def iter_glucose_readings(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    min_ts: float,
+    max_ts: float,
+    min_exclusive: bool = False,
+    page_days: int = 7,
+) -> Iterator[Tuple[float, Any]]:
+    """Read the readings of a time range, by pages of a few days.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        min_ts: the minimum timestamp of the readings
+        max_ts: the maximum timestamp of the readings
+        min_exclusive: whether to exclude the readings at min_ts
+        page_days: the number of days to read at once
+    Returns:
+        the timestamp and glucose value of the readings, oldest first
+    """
+    # skip the part of the range before the first reading
+    first = redis_client.zrange(key, 0, 0, withscores=True)
+    archived_days = _get_archived_days(redis_client, key)
+    starts = [first[0][1]] if first else []
+    if archived_days:
+        starts.append(archived_days[0] * _DAY)
+    if not starts:
+        return
+    if min(starts) > min_ts:
+        page_start, min_exclusive = min(starts), False
+    else:
+        page_start = min_ts
+    while page_start <= max_ts:
+        page_end = min(max_ts, page_start + page_days * _DAY)
+        yield from find_glucose_readings(
+            redis_client,
+            key=key,
+            min_ts=page_start,
+            max_ts=page_end,
+            min_exclusive=min_exclusive,
+        )
+        if page_end == max_ts:
+            return
+        page_start = page_end
+        min_exclusive = True
+
+
+def get_latest_glucose_readings(
+    redis_client: redis.Redis, *, key: str, last_n: int
+) -> List[Tuple[float, Any]]:
+    """Get the last readings, in the sorted set and the archive.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        last_n: the number of readings to return
+    Returns:
+        the timestamp and glucose value of the readings, oldest first
+    """
+    p = redis_client.pipeline(transaction=False)
+    p.get(_archived_until_key(key))
+    p.zrange(key, -last_n, -1)
+    archived_until, members = p.execute()
+    live = decode_glucose_members(members)
+    if archived_until is None:
+        return live
+    if len(live) >= last_n and live[0][0] >= float(archived_until):
+        # all the last readings are more recent than the archive
+        return live
+    # read archived days, most recent first, until we have enough readings;
+    # the last readings are then all more recent than the first day we read
+    incr_metric("glucose.archive.reads")
+    days = [
+        day
+        for day in _get_archived_days(redis_client, key)
+        if day < _day(float(archived_until))
+    ]
+    archived: List[Tuple[float, Any]] = []
+    min_ts = -math.inf
+    while days and len(archived) < last_n:
+        chunk, days = days[-7:], days[:-7]
+        archived.extend(_read_archived_days(redis_client, key, chunk))
+        min_ts = chunk[0] * _DAY
+    if days:
+        live = decode_glucose_members(redis_client.zrangebyscore(key, min_ts, "+inf"))
+    else:
+        live = decode_glucose_members(redis_client.zrange(key, 0, -1))
+    return _merge_readings(archived, live)[-last_n:]
+
+
+def archive_glucose_readings(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    before_ts: float,
+    max_days: Optional[int] = None,
+) -> Tuple[int, bool]:
+    """Move the readings of the days over before a timestamp to the archive.
+
+    This can run while the server is running: days are archived one at a time,
+    in a script that skips them if they have changed in the meantime (they are
+    archived on the next run). Readings that can not use the binary encoding
+    are kept in the sorted set.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        before_ts: only archive the days that are over at this timestamp
+        max_days: the maximum number of days to archive, the next ones are
+            archived on the next call
+    Returns:
+        the number of archived readings, and whether all the days before the
+        timestamp have been processed
+    """
+    end_ts = _day(before_ts) * _DAY
+    archived = 0
+    days = 0
+    next_ts: Optional[float] = None
+    while True:
+        first = redis_client.zrangebyscore(
+            key,
+            "-inf" if next_ts is None else next_ts,
+            f"({end_ts}",
+            start=0,
+            num=1,
+            withscores=True,
+        )
+        if not first:
+            return archived, True
+        if max_days is not None and days >= max_days:
+            return archived, False
+        day = _day(first[0][1])
+        next_ts = (day + 1) * _DAY
+        days += 1
+        members = [
+            member
+            for member in redis_client.zrangebyscore(key, day * _DAY, f"({next_ts}")
+            if is_encoded_glucose_member(member)
+        ]
+        if not members:
+            continue
+        previous = redis_client.hget(_archive_key(key), str(day)) or b""
+        by_ts: Dict[float, bytes] = {
+            ts: member
+            for (ts, _), member in zip(
+                decode_glucose_blob(previous), split_glucose_blob(previous)
+            )
+        }
+        for (ts, _), member in zip(decode_glucose_members(members), members):
+            by_ts[ts] = member
+        blob = b"".join(by_ts[ts] for ts in sorted(by_ts))
+        if _archive_day_script(
+            keys=[key, _archive_key(key), _archived_until_key(key)],
+            args=[day, previous, blob, next_ts, *members],
+            client=redis_client,
+        ):
+            archived += len(members)
+            incr_metric("glucose.archive.archived", len(members))
+        else:
+            incr_metric("glucose.archive.conflicts")
+
+
+def delete_archived_glucose_readings(
+    redis_client: redis.Redis, *, key: str, before_ts: float
+) -> int:
+    """Delete the archived readings of the days over before a timestamp.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        before_ts: only delete the days that are over at this timestamp
+    Returns:
+        the number of deleted readings
+    """
+    days = [
+        day
+        for day in _get_archived_days(redis_client, key)
+        if (day + 1) * _DAY <= before_ts
+    ]
+    if not days:
+        return 0
+    p = redis_client.pipeline()
+    p.hmget(_archive_key(key), days)
+    p.hdel(_archive_key(key), *days)
+    blobs, _ = p.execute()
+    return sum(len(split_glucose_blob(blob)) for blob in blobs if blob)
@@ -0,0 +1,79 @@
+"""Encode glucose readings as compact sorted set members.
+
+Glucose readings used to be stored as JSON members (`{"ts": "...", "mgDl":
+...}`). They are now stored as fixed-width binary members: a version byte, the
+timestamp in microseconds and mgDl, so that they take less memory and a whole
+range can be decoded at once with `struct.iter_unpack`.
+
+Readings whose mgDl does not fit (such as non-integer values) are still stored
+as JSON, and JSON members are decoded as well, so that databases can be
+migrated online.
+"""
+import json
+import struct
+from typing import Any, List, Tuple
+
+_VERSION = 1
+_format = struct.Struct("<BqH")
+_version_byte = bytes([_VERSION])
+_member_format = struct.Struct(f"{_format.size}s")
+
+
+def encode_glucose_member(ts: float, mgDl: Any) -> bytes:
+    """Encode a glucose reading as a sorted set member.
+
+    Args:
+        ts: the timestamp of the reading, in seconds
+        mgDl: the glucose value
+    """
+    if type(mgDl) == int and 0 <= mgDl <= 0xFFFF:
+        return _format.pack(_VERSION, round(ts * 1_000_000), mgDl)
+    return json.dumps({"ts": str(ts), "mgDl": mgDl}).encode("utf-8")
+
+
+def is_encoded_glucose_member(member: bytes) -> bool:
+    """Check if a member uses the binary encoding (and not legacy JSON)."""
+    return len(member) == _format.size and member[:1] == _version_byte
+
+
+def decode_glucose_member(member: bytes) -> Tuple[float, Any]:
+    """Decode a glucose reading.
+
+    Returns:
+        the timestamp of the reading, in seconds, and its glucose value
+    """
+    if is_encoded_glucose_member(member):
+        _, ts_us, mgDl = _format.unpack(member)
+        return ts_us / 1_000_000, mgDl
+    record = json.loads(member.decode("utf-8"))
+    return float(record["ts"]), record["mgDl"]
+
+
+def decode_glucose_members(members: List[bytes]) -> List[Tuple[float, Any]]:
+    """Decode many glucose readings at once.
+
+    Returns:
+        the timestamp of each reading, in seconds, and its glucose value
+    """
+    if all(len(member) == _format.size for member in members):
+        data = b"".join(members)
+        if data[:: _format.size] == _version_byte * len(members):
+            return [
+                (ts_us / 1_000_000, mgDl)
+                for _, ts_us, mgDl in _format.iter_unpack(data)
+            ]
+    return [decode_glucose_member(member) for member in members]
+
+
+def decode_glucose_blob(blob: bytes) -> List[Tuple[float, Any]]:
+    """Decode readings stored back to back, as binary members.
+
+    Returns:
+        the timestamp of each reading, in seconds, and its glucose value
+    """
+    return [(ts_us / 1_000_000, mgDl) for _, ts_us, mgDl in _format.iter_unpack(blob)]
+
+
+def split_glucose_blob(blob: bytes) -> List[bytes]:
+    """Split readings stored back to back into binary members."""
+    return [member for (member,) in _member_format.iter_unpack(blob)]
@@ -1,33 +1,142 @@
+"""Log HTTP requests to redis, so that admins can debug them.
+
+Requests are buffered in memory, and written in batches by a background thread,
+so logging does not add a round trip to redis to each request. Which requests
+are logged can be configured with the `HTTP_REQUEST_LOG*` environment
+variables.
+"""
+import atexit
 import json
-from typing import List
+import os
+import random
+import time
+from threading import Condition, Thread
+from typing import List, Optional
 
 from flask import request
 
+from .metrics import incr_metric, observe_metric
 from .redis import get_redis_client
 
 _MAX_ITEMS = 500
 
+# log all requests, only requests of admins, or no request at all
+_mode = os.environ.get("HTTP_REQUEST_LOG", "all")
+assert _mode in ("all", "admin", "off"), f"Invalid HTTP_REQUEST_LOG: {_mode}"
+_sample_rate = float(os.environ.get("HTTP_REQUEST_LOG_SAMPLE_RATE", "1"))
+_max_body_size = int(os.environ.get("HTTP_REQUEST_LOG_MAX_BODY_SIZE", "4096"))
+_exclude_paths = [
+    path
+    for path in os.environ.get("HTTP_REQUEST_LOG_EXCLUDE_PATHS", "").split(",")
+    if path
+]
+_flush_interval = float(os.environ.get("HTTP_REQUEST_LOG_FLUSH_INTERVAL", "1"))
+_flush_size = 50
+
 _redis_client_zero = get_redis_client(db=0)
 
+_condition = Condition()
+_pending: List[str] = []
+_flusher_pid: Optional[int] = None
+
+
+def _should_log_request() -> bool:
+    if _mode == "off":
+        return False
+    if any(request.path.startswith(path) for path in _exclude_paths):
+        return False
+    if _sample_rate < 1 and random.random() >= _sample_rate:
+        incr_metric("http_request_log.sampled_out")
+        return False
+    if _mode == "admin":
+        from .login import is_current_request_logged_in_as_admin
+
+        return is_current_request_logged_in_as_admin()
+    return True
+
 
 def log_request_to_redis():
     """Log the current request to redis."""
+    if not _should_log_request():
+        return
     method = request.method
     path = request.path
     query_string = request.query_string.decode("utf-8")
     if query_string:
         path = f"{request.path}?{query_string}"
     headers = str(request.headers)
-    body = request.get_data().decode("utf-8")
-    _redis_client_zero.lpush(
-        "http_requests",
-        json.dumps({"method": method, "path": path, "headers": headers, "body": body}),
+    data = request.get_data()
+    body = data[:_max_body_size].decode("utf-8", errors="replace")
+    if len(data) > _max_body_size:
+        body += f"… ({len(data)} bytes)"
+    item = json.dumps(
+        {"method": method, "path": path, "headers": headers, "body": body}
+    )
+    incr_metric("http_request_log.logged")
+
+    if os.environ.get("PYTEST_CURRENT_TEST"):
+        # when running from pytest, do not use threads so we can retrieve
+        # requests synchronously
+        _write([item])
+        return
+    _ensure_flusher()
+    with _condition:
+        _pending.append(item)
+        if len(_pending) > _MAX_ITEMS:
+            incr_metric("http_request_log.dropped", len(_pending) - _MAX_ITEMS)
+            del _pending[: len(_pending) - _MAX_ITEMS]
+        if len(_pending) >= _flush_size:
+            _condition.notify()
+
+
+def _write(items: List[str]) -> None:
+    start = time.monotonic()
+    (
+        _redis_client_zero.pipeline(transaction=False)
+        .lpush("http_requests", *items)
+        .ltrim("http_requests", 0, _MAX_ITEMS)
+        .execute()
     )
-    _redis_client_zero.ltrim("http_requests", 0, _MAX_ITEMS)
+    observe_metric("http_request_log.flush_size", len(items))
+    observe_metric("http_request_log.flush_duration", time.monotonic() - start)
+
+
+def flush_http_request_log() -> None:
+    """Write the requests logged by this process that are not written yet."""
+    with _condition:
+        items = list(_pending)
+        _pending.clear()
+    if items:
+        _write(items)
+
+
+def _run_flusher() -> None:
+    while True:
+        with _condition:
+            _condition.wait_for(lambda: len(_pending) >= _flush_size, _flush_interval)
+        try:
+            flush_http_request_log()
+        except Exception:
+            incr_metric("http_request_log.flush_errors")
+
+
+def _ensure_flusher() -> None:
+    global _flusher_pid
+    with _condition:
+        # threads do not survive a fork, so we start one in each process
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        _pending.clear()
+    Thread(target=_run_flusher, name="http-request-log", daemon=True).start()
+
+
+atexit.register(flush_http_request_log)
 
 
 def get_last_http_requests() -> List[dict]:
     """Get the last http requests."""
+    flush_http_request_log()
     last_requests = []
     for last_request in _redis_client_zero.lrange("http_requests", 0, _MAX_ITEMS):
         last_requests.append(json.loads(last_request.decode("utf-8")))
@@ -1,24 +1,62 @@
 """A class to read and store instant glucose data."""
+import heapq
 import json
 import logging
+import math
 from datetime import datetime
-from typing import List, Optional, TypedDict
+from typing import Any, List, Optional, Tuple, TypedDict
 
-from flask import Response, abort, request
-from redis import WatchError
+import redis
+from flask import Response, abort, request, stream_with_context
 
 from .cgm import get_current_cgm_properties
 from .config import tz
 from .login import (assert_current_request_logged_in,
                     assert_get_current_request_redis_client)
-from .redis import bump_revision
-from .server import app
+from .pagination import encode_cursor, get_page_args, page_response
+from .record_store import (get_sorted_set_page, iter_sorted_set_pages,
+                           trim_sorted_set)
+from .redis import bump_revision, get_redis_client
+from .response_cache import get_response_cache_key
+from .server import app, limiter, upload_rate_limit
 from .userdata import set_userdata
 from .utils import parse_timestamp
-from .webhooks import call_webhooks
+from .webhooks import call_webhooks, invalidate_last_snapshot
 
 _key = "instant_glucose"
 
+_csv_header = "timestamp,model_name,device_id,instant,historic"
+
+# Upsert instant glucose records, replacing the record of the same model and
+# device at the same timestamp, if any (the same device can be used to record
+# multiple models, e.g. a Libre 2 and a Libre 3), and invalidate the cached
+# responses.
+_upsert_script = get_redis_client(db=0).register_script(
+    """
+for i = 1, #ARGV, 4 do
+    local ts, member = ARGV[i], ARGV[i + 1]
+    for _, existing in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], ts, ts)) do
+        local record = cjson.decode(existing)
+        if record["model_name"] == ARGV[i + 2]
+            and record["device_id"] == ARGV[i + 3] then
+            redis.call("ZREM", KEYS[1], existing)
+        end
+    end
+    redis.call("ZADD", KEYS[1], ts, member)
+end
+redis.call("DEL", KEYS[2])
+"""
+)
+
+# the number of records upserted by a script run, so that large uploads do not
+# block redis for long
+_upsert_batch_size = 1000
+
+# when downsampling, we keep one record per device every this number of seconds
+_downsample_interval = 5 * 60
+
+_DAY = 24 * 60 * 60
+
 
 class InstantGlucoseRecord(TypedDict):
     """An instantglucose record."""
@@ -36,49 +74,109 @@ def record_instant_glucose_data(
     device_id: str,
 ) -> None:
     """Record a new instant glucose reading."""
+    record_instant_glucose_records([(timestamp, mgDl, model_name, device_id)])
+
+
+def record_instant_glucose_records(
+    records: List[Tuple[datetime, int, str, str]]
+) -> None:
+    """Record instant glucose readings at once.
+
+    A reading replaces the one of the same model and device at the same
+    timestamp, if any.
+
+    Args:
+        records: the timestamp, mgDl, model name and device id of the readings
+    """
     redis_client = assert_get_current_request_redis_client()
-    ts = str(timestamp.timestamp())
-
-    # find all records with the same timestamp, and check if they are for the same device
-    # if so, update the record, otherwise, add a new record
-    # this is to handle the case where the same device is used to record multiple models
-    # e.g. a Libre 2 and a Libre 3
-    while True:
-        try:
-            p = redis_client.pipeline()
-            p.watch(_key)
-            prev_records = redis_client.zrangebyscore(_key, ts, ts)
-            for prev_record in prev_records:
-                prev_record = _member_to_instant_glucose_record(prev_record)
-                if (
-                    prev_record["model_name"] == model_name
-                    and prev_record["device_id"] == device_id
-                ):
-                    logging.debug(
-                        f"Found existing record for {model_name} {device_id} at {ts}, "
-                        + "deleting old"
-                    )
-                    p.zremrangebyscore(_key, ts, ts)
-            logging.info(f"Recording instant glucose data, ts={ts}, mgDl={mgDl}")
-            p.unwatch()
-            p.zadd(
-                _key,
-                {
-                    json.dumps(
-                        {
-                            "ts": ts,
-                            "mgDl": mgDl,
-                            "model_name": model_name,
-                            "device_id": device_id,
-                        }
-                    ): ts
-                },
+    logging.info(f"Recording {len(records)} instant glucose record(s)")
+    keys = [_key, get_response_cache_key()]
+    args: List[Any] = []
+    for timestamp, mgDl, model_name, device_id in records:
+        ts = str(timestamp.timestamp())
+        member = json.dumps(
+            {"ts": ts, "mgDl": mgDl, "model_name": model_name, "device_id": device_id}
+        )
+        args.extend([ts, member, model_name, device_id])
+        if len(args) == 4 * _upsert_batch_size:
+            _upsert_script(keys=keys, args=args, client=redis_client)
+            args = []
+    if args:
+        _upsert_script(keys=keys, args=args, client=redis_client)
+    invalidate_last_snapshot()
+
+
+def get_instant_glucose_key() -> str:
+    """Get the key holding the instant glucose records of a user."""
+    return _key
+
+
+def delete_instant_glucose_records(
+    redis_client: redis.Redis, *, before: datetime, max_days: int
+) -> Tuple[int, bool]:
+    """Delete the instant glucose records before a date.
+
+    Args:
+        redis_client: the redis client of the user
+        before: delete the records before this date
+        max_days: the maximum number of days to delete, the next ones are
+            deleted on the next call
+    Returns:
+        the number of deleted records, and whether all the records before the
+        date have been deleted
+    """
+    deleted, deleted_until = trim_sorted_set(
+        redis_client, key=_key, before_ts=before.timestamp(), max_days=max_days
+    )
+    if deleted:
+        redis_client.delete(get_response_cache_key())
+    return deleted, deleted_until == before.timestamp()
+
+
+def downsample_instant_glucose_records(
+    redis_client: redis.Redis, *, from_ts: float, before_ts: float, max_days: int
+) -> Tuple[int, float]:
+    """Keep one instant glucose record per model and device every 5 minutes.
+
+    Args:
+        redis_client: the redis client of the user
+        from_ts: the timestamp from which to downsample records
+        before_ts: the timestamp before which to downsample records
+        max_days: the maximum number of (UTC) days to downsample, the next ones
+            are downsampled on the next call
+    Returns:
+        the number of deleted records, and the timestamp before which records
+        are downsampled
+    """
+    deleted = 0
+    for _ in range(max_days):
+        first = redis_client.zrangebyscore(
+            _key, from_ts, f"({before_ts}", start=0, num=1, withscores=True
+        )
+        if not first:
+            return deleted, before_ts
+        end_ts = min((math.floor(first[0][1] / _DAY) + 1) * _DAY, before_ts)
+        slots = set()
+        extra_members = []
+        for member, score in redis_client.zrangebyscore(
+            _key, first[0][1], f"({end_ts}", withscores=True
+        ):
+            record = json.loads(member)
+            slot = (
+                record["model_name"],
+                record["device_id"],
+                math.floor(score / _downsample_interval),
             )
-            p.execute()
-            break
-        except WatchError:
-            logging.debug("WatchError, will retry")
-            pass
+            if slot in slots:
+                extra_members.append(member)
+            else:
+                slots.add(slot)
+        if extra_members:
+            deleted += redis_client.zrem(_key, *extra_members)
+        from_ts = end_ts
+    if deleted:
+        redis_client.delete(get_response_cache_key())
+    return deleted, from_ts
 
 
 def _member_to_instant_glucose_record(member: bytes) -> InstantGlucoseRecord:
@@ -150,6 +248,37 @@ def find_instant_glucose_records(from_date: datetime, to_date: datetime):
     return result
 
 
+def find_instant_glucose_records_page(
+    from_date: datetime,
+    to_date: datetime,
+    *,
+    limit: int,
+    cursor: Optional[Tuple[float, int]] = None,
+) -> Tuple[List[InstantGlucoseRecord], Optional[Tuple[float, int]]]:
+    """Find a page of the instant glucose records in the given time range.
+
+    Args:
+        from_date: the start of the time range
+        to_date: the end of the time range
+        limit: the maximum number of records to return
+        cursor: the cursor returned with the previous page
+    Returns:
+        the records, and the cursor of the next page if there are more
+    """
+    redis_client = assert_get_current_request_redis_client()
+    page, next_cursor = get_sorted_set_page(
+        redis_client,
+        key=_key,
+        from_ts=from_date.timestamp(),
+        to_ts=to_date.timestamp(),
+        limit=limit,
+        cursor=cursor,
+    )
+    return [
+        _member_to_instant_glucose_record(member) for member, _ in page
+    ], next_cursor
+
+
 class InsertInstantGlucoseRecordsStatus(TypedDict):
     """The response to a glucoses upload."""
 
@@ -170,13 +299,17 @@ def insert_instant_glucose_records(
     instant_glucose_records = sorted(
         instant_glucose_records, key=lambda record: record["timestamp"], reverse=False
     )
-    for record in instant_glucose_records:
-        record_instant_glucose_data(
-            parse_timestamp(record["timestamp"]),
-            record["mgDl"],
-            record["model_name"],
-            record["device_id"],
-        )
+    record_instant_glucose_records(
+        [
+            (
+                parse_timestamp(record["timestamp"]),
+                record["mgDl"],
+                record["model_name"],
+                record["device_id"],
+            )
+            for record in instant_glucose_records
+        ]
+    )
     return InsertInstantGlucoseRecordsStatus(
         success=True, status=f"added {len(instant_glucose_records)} record(s)"
     )
@@ -200,6 +333,7 @@ def _get_latest_instant_glucose_data():
 
 
 @app.route("/opengluck/instant-glucose/upload", methods=["GET", "POST"])
+@limiter.limit(upload_rate_limit)
 def _upload_instant_glucose_data():
     # decode the POST payload as an array of glucose records
     logging.info("Uploading instant glucose data")
@@ -231,40 +365,63 @@ def _upload_instant_glucose_data():
 def _download_instant_glucose_data():
     assert_current_request_logged_in()
     last_n = int(request.args.get("last_n", "288"))
-    rows = []
-    records = get_latest_instant_glucose_records(last_n=last_n)
-    if not records:
+    redis_client = assert_get_current_request_redis_client()
+    nb_records, last = (
+        redis_client.pipeline(transaction=False)
+        .zcard(_key)
+        .zrange(_key, -1, -1, withscores=True)
+        .execute()
+    )
+    if not last or last_n <= 0:
         logging.info("No instant glucose records found, not augmenting")
-    else:
-        for record in records:
-            rows.append(
-                f"{record['timestamp']},{record['model_name']},"
-                + f"{record['device_id']},{record['mgDl']},"
-            )
-        min_timestamp: datetime = min(
-            [parse_timestamp(record["timestamp"]) for record in records]
-        )
-        max_timestamp: datetime = max(
-            [parse_timestamp(record["timestamp"]) for record in records]
+        return Response(_csv_header, content_type="text/csv; charset=utf-8")
+    # only read the first of the last_n records, the others are streamed
+    first_index = -min(last_n, nb_records)
+    first = redis_client.zrange(_key, first_index, first_index, withscores=True)
+    min_ts = first[0][1] if first else last[0][1]
+    max_ts = last[0][1]
+    # stream the instant records, and the historic records around them, sorted
+    # by timestamp
+    instant_rows = (
+        (ts, _instant_glucose_record_to_row(_member_to_instant_glucose_record(member)))
+        for page in iter_sorted_set_pages(
+            redis_client, key=_key, from_ts=min_ts, to_ts=max_ts
         )
-        # remove 5m from min_timestamp and add 5m to max_timestamp
-        min_timestamp = datetime.fromtimestamp(min_timestamp.timestamp() - 300, tz=tz)
-        max_timestamp = datetime.fromtimestamp(max_timestamp.timestamp() + 300, tz=tz)
-        logging.info(
-            f"Augmenting with glucose records between {min_timestamp} "
-            + f"and {max_timestamp}"
-        )
-        from .glucose import GlucoseRecordType, find_glucose_records
+        for member, ts in page
+    )
+    min_timestamp = datetime.fromtimestamp(min_ts - 300, tz=tz)
+    max_timestamp = datetime.fromtimestamp(max_ts + 300, tz=tz)
+    logging.info(
+        f"Augmenting with glucose records between {min_timestamp} "
+        + f"and {max_timestamp}"
+    )
+    from .glucose import GlucoseRecordType, iter_glucose_records
 
-        historic_records = find_glucose_records(
+    historic_rows = (
+        (
+            parse_timestamp(record["timestamp"]).timestamp(),
+            f"{record['timestamp']},,,,{record['mgDl']},",
+        )
+        for record in iter_glucose_records(
             GlucoseRecordType.historic, min_timestamp, max_timestamp
         )
-        for historic_record in historic_records:
-            rows.append(f"{historic_record['timestamp']},,,,{historic_record['mgDl']},")
+    )
+
+    def _iter_csv():
+        yield _csv_header
+        for _, row in heapq.merge(instant_rows, historic_rows, key=lambda row: row[0]):
+            yield "\n" + row
+
+    return Response(
+        stream_with_context(_iter_csv()), content_type="text/csv; charset=utf-8"
+    )
 
-    rows.sort(key=lambda row: row.split(",")[0])
-    rows = ["timestamp,model_name,device_id,instant,historic"] + rows
-    return Response("\n".join(rows), content_type="text/csv; charset=utf-8")
+
+def _instant_glucose_record_to_row(record: InstantGlucoseRecord) -> str:
+    return (
+        f"{record['timestamp']},{record['model_name']},"
+        + f"{record['device_id']},{record['mgDl']},"
+    )
 
 
 @app.route("/opengluck/instant-glucose/find")
@@ -274,7 +431,20 @@ def _find_instant_glucose_data():
     to_date = request.args.get("to")
     if from_date is None or to_date is None:
         return abort(400)
-    records = find_instant_glucose_records(
-        parse_timestamp(from_date), parse_timestamp(to_date)
+    page_args = get_page_args(InstantGlucoseRecord.__annotations__)
+    if page_args["limit"] is None:
+        records = find_instant_glucose_records(
+            parse_timestamp(from_date), parse_timestamp(to_date)
+        )
+        return page_response(records, next_cursor=None, fields=page_args["fields"])
+    records, next_cursor = find_instant_glucose_records_page(
+        parse_timestamp(from_date),
+        parse_timestamp(to_date),
+        limit=page_args["limit"],
+        cursor=page_args["cursor"],
+    )
+    return page_response(
+        records,
+        next_cursor=encode_cursor(*next_cursor) if next_cursor else None,
+        fields=page_args["fields"],
     )
-    return Response(json.dumps(records), content_type="application/json")
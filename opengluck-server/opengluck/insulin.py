@@ -2,12 +2,14 @@
 import json
 import logging
 from datetime import datetime
-from typing import List, TypedDict
+from typing import Iterator, List, TypedDict
 
 from flask import Response
 
 from .config import tz
 from .login import assert_get_current_request_redis_client
+from .record_store import (find_hash_records, get_latest_hash_records,
+                           iter_hash_records)
 from .redis import bump_revision
 from .server import app
 from .utils import parse_timestamp
@@ -89,10 +91,9 @@ def get_latest_insulin_records(last_n: int = 288) -> List[InsulinRecord]:
     """Gets the latest last_n insulin records."""
     redis_client = assert_get_current_request_redis_client()
     records = []
-    # use zrange to return the last last_n entries ranked by score
-    res = redis_client.zrange(_key_set, -last_n, -1)
-    for id in res:
-        value = redis_client.hget(_key_hash, id)
+    for value in get_latest_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, last_n=last_n
+    ):
         assert value
         records.append(_value_to_insulin_record(value))
     records.reverse()
@@ -134,14 +135,39 @@ def find_insulin_records(from_date: datetime, to_date: datetime) -> List[Insulin
     redis_client = assert_get_current_request_redis_client()
     from_ts = from_date.timestamp()
     to_ts = to_date.timestamp()
-    from_ts = from_date.timestamp()
-    to_ts = to_date.timestamp()
     result = []
     logging.debug(f"Finding insulin records between {from_ts} and {to_ts}")
-    for id in redis_client.zrangebyscore(_key_set, from_ts, to_ts):
-        value = redis_client.hget(_key_hash, id)
+    for value in find_hash_records(
+        redis_client,
+        key_set=_key_set,
+        key_hash=_key_hash,
+        from_ts=from_ts,
+        to_ts=to_ts,
+    ):
         assert value
         result.append(_value_to_insulin_record(value))
     result.reverse()
     logging.debug(f"Found {len(result)} record(s)")
     return result
+
+
+def iter_insulin_records(
+    from_date: datetime, to_date: datetime, *, desc: bool = False
+) -> Iterator[InsulinRecord]:
+    """Find insulin records in the given time range, reading them by pages.
+
+    Args:
+        from_date: the start of the time range
+        to_date: the end of the time range
+        desc: whether to return the most recent records first
+    """
+    redis_client = assert_get_current_request_redis_client()
+    for value in iter_hash_records(
+        redis_client,
+        key_set=_key_set,
+        key_hash=_key_hash,
+        from_ts=from_date.timestamp(),
+        to_ts=to_date.timestamp(),
+        desc=desc,
+    ):
+        yield _value_to_insulin_record(value)
@@ -15,8 +15,8 @@ from .insulin import InsulinRecord, get_latest_insulin_records
 from .login import (assert_current_request_logged_in,
                     assert_get_current_request_redis_client)
 from .low import LowRecord, get_latest_low_records
-from .redis import get_revision
-from .server import app
+from .response_cache import get_cached_response, set_cached_response
+from .server import app, limiter, polling_rate_limit
 from .utils import parse_timestamp
 
 
@@ -116,14 +116,19 @@ def get_last(
 
 
 @app.route("/opengluck/last")
+@limiter.limit(polling_rate_limit)
 def _get_last_route():
     redis_client = assert_get_current_request_redis_client()
 
-    revision = get_revision(redis_client)
+    revision, cached = get_cached_response(redis_client)
     if_none_match = request.headers.get("if-none-match")
     if if_none_match is not None and if_none_match == str(revision):
         logging.debug("Sending 304")
         return Response(status=304)
+    if cached is not None:
+        return Response(
+            cached, headers={"content-type": "application/json", "etag": revision}
+        )
 
     record_type = request.args.get("type", "")
     last_n_glucose = int(request.args.get("last_n_glucose", "288"))
@@ -133,12 +138,14 @@ def _get_last_route():
         last_n_glucose=last_n_glucose,
         max_duration=max_duration,
     )
+    body = json.dumps(
+        {
+            "revision": revision,
+            **last,
+        }
+    )
+    set_cached_response(redis_client, body, revision=revision)
     return Response(
-        json.dumps(
-            {
-                "revision": revision,
-                **last,
-            }
-        ),
+        body,
         headers={"content-type": "application/json", "etag": revision},
     )
@@ -0,0 +1,72 @@
+"""Locks of a user, shared by all server processes.
+
+Locks are kept in the database of the user, so that requests of different
+users never wait for each other, while requests of the same user are
+serialized across all server processes. Locks have a lease timeout, so that a
+crashed process does not hold them forever.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import redis
+from flask import Response
+from redis.exceptions import LockNotOwnedError
+
+from .metrics import incr_metric, observe_metric
+from .server import app
+
+# the number of seconds after which a lock is released, if not released before
+_lock_timeout = float(os.environ.get("LOCK_TIMEOUT", "60"))
+
+# the number of seconds to wait for a lock, before giving up
+_lock_wait_timeout = float(os.environ.get("LOCK_WAIT_TIMEOUT", "10"))
+
+
+class LockTimeoutError(Exception):
+    """Raised when a lock could not be acquired in time."""
+
+
+@app.errorhandler(LockTimeoutError)
+def _lock_timeout_error(_: LockTimeoutError):
+    return Response(status=503, headers={"Retry-After": "1"})
+
+
+@contextmanager
+def user_lock(
+    redis_client: redis.Redis, name: str, *, wait_timeout: Optional[float] = None
+) -> Iterator[None]:
+    """Hold a lock of the user.
+
+    Args:
+        redis_client: the redis client of the user
+        name: the name of the lock
+        wait_timeout: the number of seconds to wait for the lock, defaults to
+            LOCK_WAIT_TIMEOUT
+    Raises:
+        LockTimeoutError: if the lock could not be acquired in time (which
+            returns a 503 response, when not caught)
+    """
+    lock = redis_client.lock(f"lock:{name}", timeout=_lock_timeout, sleep=0.05)
+    if not lock.acquire(blocking=False):
+        incr_metric(f"locks.{name}.contended")
+        started_at = time.time()
+        acquired = lock.acquire(
+            blocking_timeout=_lock_wait_timeout
+            if wait_timeout is None
+            else wait_timeout
+        )
+        observe_metric(f"locks.{name}.wait_duration", time.time() - started_at)
+        if not acquired:
+            incr_metric(f"locks.{name}.timeouts")
+            raise LockTimeoutError(f"Could not acquire lock {name}")
+    incr_metric(f"locks.{name}.acquired")
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except LockNotOwnedError:
+            # the lease expired, and the lock might be held by another request
+            incr_metric(f"locks.{name}.expired")
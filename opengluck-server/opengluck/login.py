@@ -1,12 +1,16 @@
 import json
 import logging
 import os
+import time
 import uuid
-from typing import Optional
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple, TypedDict
 
 import redis
-from flask import Response, abort, g, request
+from flask import Response, abort, g, has_request_context, request
 
+from .metrics import incr_metric
 from .redis import get_redis_client
 from .server import app  # , cors_headers
 
@@ -16,6 +20,34 @@ _redis_client_zero = get_redis_client(db=0)
 _dev_magic_token = "dev-token"
 _userdb_key = "userdb"
 
+# how long (in seconds) resolved tokens are kept in memory across requests,
+# disabled by default; accounts disabled or deleted from another process keep
+# being accepted by this process until then
+_token_cache_ttl = float(os.environ.get("TOKEN_CACHE_TTL", "0"))
+_token_cache_max_size = 1024
+_token_cache: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+_token_cache_lock = Lock()
+
+# get the token data and the user data of a token, in a single round trip
+_resolve_token_script = _redis_client_zero.register_script(
+    """
+local token_data = redis.call("GET", KEYS[1])
+if not token_data then
+    return {false, false}
+end
+local login = cjson.decode(token_data)["login"]
+return {token_data, redis.call("HGET", KEYS[2], login)}
+"""
+)
+
+
+class Principal(TypedDict):
+    """What a token resolves to."""
+
+    login: Optional[str]
+    scope: Optional[str]
+    user: Optional[str]
+
 
 def do_we_have_any_accounts() -> bool:
     """Check if we already have at least one account."""
@@ -82,6 +114,8 @@ def delete_account(login: str) -> None:
     redis_client_user = get_redis_client(db=db)
     redis_client_user.flushdb()
     _redis_client_zero.hdel("users", login)
+    _redis_client_zero.hdel(_userdb_key, f"{db}")
+    invalidate_token_cache(login)
 
 
 def _generate_token(login: str, scope: str) -> str:
@@ -127,23 +161,84 @@ def get_token(login: str, password: str, scope: str = "admin") -> str:
     return _generate_token(login, scope)
 
 
+def _resolve_token(token: str) -> Principal:
+    logging.debug(f"Resolving token {token}")
+    if _target == "dev" and token == _dev_magic_token:
+        return {"login": "dev-magic-token-login", "scope": "admin", "user": "{}"}
+    token_data, user_data = _resolve_token_script(
+        keys=[f"token:{token}", "users"], client=_redis_client_zero
+    )
+    if token_data is None:
+        logging.debug("Token data not found")
+        return {"login": None, "scope": None, "user": None}
+    token_data = json.loads(token_data.decode("utf-8"))
+    assert "login" in token_data
+    assert "scope" in token_data
+    if user_data is None:
+        logging.debug("User not found for token")
+    return {
+        "login": token_data["login"],
+        "scope": token_data["scope"],
+        "user": user_data.decode("utf-8") if user_data is not None else None,
+    }
+
+
+def get_token_principal(token: str) -> Principal:
+    """Returns what a token resolves to.
+
+    Tokens are resolved at most once per request, and optionally kept in
+    memory across requests for `TOKEN_CACHE_TTL` seconds.
+
+    Args:
+        token: The token to check.
+    """
+    principals = None
+    if has_request_context():
+        principals = g.setdefault("principals", {})
+        if token in principals:
+            return principals[token]
+    principal = None
+    if _token_cache_ttl > 0:
+        with _token_cache_lock:
+            cached = _token_cache.get(token)
+            if cached is not None and cached[0] > time.monotonic():
+                _token_cache.move_to_end(token)
+                principal = cached[1]
+        incr_metric(
+            "login.token_cache.hits" if principal else "login.token_cache.misses"
+        )
+    if principal is None:
+        principal = _resolve_token(token)
+        if _token_cache_ttl > 0 and principal["user"] is not None:
+            with _token_cache_lock:
+                _token_cache[token] = (time.monotonic() + _token_cache_ttl, principal)
+                _token_cache.move_to_end(token)
+                while len(_token_cache) > _token_cache_max_size:
+                    _token_cache.popitem(last=False)
+    if principals is not None:
+        principals[token] = principal
+    return principal
+
+
+def invalidate_token_cache(login: str) -> None:
+    """Forget the tokens of a user kept in memory across requests.
+
+    Args:
+        login: The login of the user.
+    """
+    with _token_cache_lock:
+        for token, (_, principal) in list(_token_cache.items()):
+            if principal["login"] == login:
+                del _token_cache[token]
+
+
 def get_token_login(token: str) -> Optional[str]:
     """Returns the login for a token.
 
     Args:
         token: The token to check.
     """
-    logging.debug(f"Checking token login {token}")
-    if _target == "dev" and token == _dev_magic_token:
-        return "dev-magic-token-login"
-    token_data = _redis_client_zero.get(f"token:{token}")
-    if token_data is None:
-        logging.debug("Token data not found")
-        return None
-    token_data = json.loads(token_data.decode("utf-8"))
-    assert "login" in token_data
-    login = token_data["login"]
-    return login
+    return get_token_principal(token)["login"]
 
 
 def get_token_scope(token: str) -> Optional[str]:
@@ -152,17 +247,7 @@ def get_token_scope(token: str) -> Optional[str]:
     Args:
         token: The token to check.
     """
-    logging.debug(f"Checking token scope {token}")
-    if _target == "dev" and token == _dev_magic_token:
-        return "admin"
-    token_data = _redis_client_zero.get(f"token:{token}")
-    if token_data is None:
-        logging.debug("Token scope not found")
-        return None
-    token_data = json.loads(token_data.decode("utf-8"))
-    assert "scope" in token_data
-    scope = token_data["scope"]
-    return scope
+    return get_token_principal(token)["scope"]
 
 
 def get_token_user(token: str) -> Optional[str]:
@@ -171,16 +256,7 @@ def get_token_user(token: str) -> Optional[str]:
     Args:
         token: The token to check.
     """
-    login = get_token_login(token)
-    if _target == "dev" and token == _dev_magic_token:
-        return "{}"
-    if login is None:
-        return None
-    user_data = _redis_client_zero.hget("users", login)
-    if user_data is None:
-        logging.debug("User not found for token")
-        return None
-    return user_data.decode("utf-8")
+    return get_token_principal(token)["user"]
 
 
 def get_token_redis_client(token: str) -> redis.Redis:
@@ -240,6 +316,7 @@ def _set_account_enabled(login: str, enabled: bool) -> None:
     user_data = json.loads(user)
     user_data["enabled"] = enabled
     _redis_client_zero.hset("users", login, json.dumps(user_data))
+    invalidate_token_cache(login)
 
 
 @app.route("/opengluck/enable-account", methods=["POST"])
@@ -345,15 +422,10 @@ def assert_get_current_request_login() -> str:
     token = get_current_request_token()
     if token is None:
         abort(401)
-    login = get_token_login(token)
-    if login is None:
-        abort(401)
-    if _target == "dev" and token == _dev_magic_token:
-        return login
-    user_data = _redis_client_zero.hget("users", login)
-    if user_data is None:
+    principal = get_token_principal(token)
+    if principal["login"] is None or principal["user"] is None:
         abort(401)
-    return login
+    return principal["login"]
 
 
 def assert_get_current_request_redis_client() -> redis.Redis:
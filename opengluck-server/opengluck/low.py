@@ -2,12 +2,13 @@
 import json
 import logging
 from datetime import datetime
-from typing import List, TypedDict
+from typing import Iterator, List, TypedDict
 
 from flask import Response
 
 from .config import tz
 from .login import assert_get_current_request_redis_client
+from .record_store import get_latest_hash_records, iter_hash_records
 from .redis import bump_revision
 from .server import app
 from .utils import parse_timestamp
@@ -93,10 +94,9 @@ def get_latest_low_records(last_n: int = 288) -> List[LowRecord]:
     """Gets the latest last_n low records."""
     redis_client = assert_get_current_request_redis_client()
     records = []
-    # use zrange to return the last last_n entries ranked by score
-    res = redis_client.zrange(_key_set, -last_n, -1)
-    for id in res:
-        value = redis_client.hget(_key_hash, id)
+    for value in get_latest_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, last_n=last_n
+    ):
         assert value
         records.append(_value_to_low_record(value))
     records.reverse()
@@ -131,3 +131,25 @@ def insert_low_records(low_records: List[dict]) -> InsertLowRecordsStatus:
     return InsertLowRecordsStatus(
         success=True, status=f"added {len(low_records)} record(s)"
     )
+
+
+def iter_low_records(
+    from_date: datetime, to_date: datetime, *, desc: bool = False
+) -> Iterator[LowRecord]:
+    """Find low records in the given time range, reading them by pages.
+
+    Args:
+        from_date: the start of the time range
+        to_date: the end of the time range
+        desc: whether to return the most recent records first
+    """
+    redis_client = assert_get_current_request_redis_client()
+    for value in iter_hash_records(
+        redis_client,
+        key_set=_key_set,
+        key_hash=_key_hash,
+        from_ts=from_date.timestamp(),
+        to_ts=to_date.timestamp(),
+        desc=desc,
+    ):
+        yield _value_to_low_record(value)
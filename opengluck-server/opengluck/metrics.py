@@ -0,0 +1,70 @@
+"""Process-local metrics.
+
+Metrics are kept in memory by each server process (i.e. each gunicorn worker),
+and can be retrieved by admins on /opengluck/metrics.
+"""
+import os
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+_lock = Lock()
+_counters: Dict[str, float] = {}
+_observations: Dict[str, Dict[str, float]] = {}
+_gauges: Dict[str, Callable[[], Any]] = {}
+
+
+def incr_metric(name: str, value: float = 1) -> None:
+    """Increment a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe_metric(name: str, value: float) -> None:
+    """Record an observation, such as a duration or a size."""
+    with _lock:
+        observation = _observations.get(name)
+        if observation is None:
+            _observations[name] = {"count": 1, "sum": value, "max": value}
+        else:
+            observation["count"] += 1
+            observation["sum"] += value
+            observation["max"] = max(observation["max"], value)
+
+
+def register_gauge(name: str, gauge: Callable[[], Any]) -> None:
+    """Register a gauge, whose value is computed when reading metrics."""
+    with _lock:
+        _gauges[name] = gauge
+
+
+def get_counter(name: str) -> float:
+    """Get the value of a counter."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def get_observation(name: str) -> Optional[Dict[str, float]]:
+    """Get the count, sum and max of observations, if any."""
+    with _lock:
+        observation = _observations.get(name)
+        return dict(observation) if observation is not None else None
+
+
+def get_metrics() -> dict:
+    """Get a snapshot of all the metrics of this process."""
+    with _lock:
+        counters = dict(_counters)
+        observations = {
+            name: {
+                **observation,
+                "avg": observation["sum"] / observation["count"],
+            }
+            for name, observation in _observations.items()
+        }
+        gauges = dict(_gauges)
+    return {
+        "pid": os.getpid(),
+        "counters": counters,
+        "observations": observations,
+        "gauges": {name: gauge() for name, gauge in gauges.items()},
+    }
@@ -0,0 +1,13 @@
+import json
+
+from flask import Response
+
+from .login import assert_current_request_is_logged_in_as_admin
+from .metrics import get_metrics
+from .server import app
+
+
+@app.route("/opengluck/metrics")
+def _metrics():
+    assert_current_request_is_logged_in_as_admin()
+    return Response(json.dumps(get_metrics()), content_type="application/json")
@@ -0,0 +1,89 @@
+"""Paginate the records returned by find routes.
+
+Find routes accept optional `limit`, `cursor` and `fields` parameters. When a
+limit is given, they return at most `limit` records, and the cursor of the next
+page in the `x-opengluck-next-cursor` header, if there are more records.
+Cursors are based on the score (timestamp) of the last returned record, so
+that pages stay stable when records are added before them. `fields` is a comma
+separated list of the fields to return for each record.
+"""
+import json
+from typing import Any, List, Optional, Sequence, Tuple, TypedDict
+
+from flask import Response, abort, request
+
+_MAX_LIMIT = 10000
+
+# used when a cursor is given without a limit
+_DEFAULT_LIMIT = 1000
+
+next_cursor_header = "x-opengluck-next-cursor"
+
+
+class PageArgs(TypedDict):
+    """The pagination parameters of a request."""
+
+    limit: Optional[int]
+    cursor: Optional[Tuple[float, int]]
+    fields: Optional[List[str]]
+
+
+def encode_cursor(score: float, skip: int = 0) -> str:
+    """Encode the cursor of the next page.
+
+    Args:
+        score: the score of the last returned record
+        skip: the number of returned records with this score
+    """
+    return f"{score!r}:{skip}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """Decode a cursor.
+
+    Returns:
+        the score of the last returned record, and the number of returned
+        records with this score
+    Raises:
+        ValueError: if the cursor is invalid
+    """
+    score, skip = cursor.split(":", 1)
+    if int(skip) < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return float(score), int(skip)
+
+
+def get_page_args(allowed_fields: Sequence[str]) -> PageArgs:
+    """Get the pagination parameters of the current request, or abort with 400.
+
+    Args:
+        allowed_fields: the fields of the records
+    """
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        cursor = request.args.get("cursor")
+        decoded_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400)
+    if limit is not None and not 0 < limit <= _MAX_LIMIT:
+        abort(400)
+    if decoded_cursor is not None and limit is None:
+        limit = _DEFAULT_LIMIT
+    fields = None
+    if request.args.get("fields"):
+        fields = request.args["fields"].split(",")
+        if any(field not in allowed_fields for field in fields):
+            abort(400)
+    return PageArgs(limit=limit, cursor=decoded_cursor, fields=fields)
+
+
+def page_response(
+    records: List[Any], *, next_cursor: Optional[str], fields: Optional[List[str]]
+) -> Response:
+    """Build the response of a page of records."""
+    if fields is not None:
+        records = [{field: record[field] for field in fields} for record in records]
+    response = Response(json.dumps(records), content_type="application/json")
+    if next_cursor is not None:
+        response.headers[next_cursor_header] = next_cursor
+    return response
@@ -0,0 +1,218 @@
+"""Helpers to read records stored in a sorted set index and a hash.
+
+Low, insulin and food records are stored using two keys: a sorted set of the
+record ids, scored by timestamp, and a hash of the record values, by id. These
+helpers read both at once, using server-side scripts.
+
+Long time ranges can also be read by pages, so that we never hold all the
+records of the range in memory, and old records can be deleted by days.
+"""
+import math
+from typing import Iterator, List, Optional, Tuple
+
+import redis
+
+from .redis import get_redis_client
+
+_DAY = 24 * 60 * 60
+
+# return the hash values of the given ids, in the order of the ids; we call
+# HMGET by chunks as Lua's unpack is limited in the number of values
+_hmget_ids = """
+local values = {}
+for i = 1, #ids, 1000 do
+    local chunk = redis.call("HMGET", KEYS[2], unpack(ids, i, math.min(i + 999, #ids)))
+    for j = 1, #chunk do
+        values[#values + 1] = chunk[j]
+    end
+end
+return values
+"""
+
+_get_by_rank_script = get_redis_client(db=0).register_script(
+    'local ids = redis.call("ZRANGE", KEYS[1], ARGV[1], ARGV[2])' + _hmget_ids
+)
+
+_get_by_score_script = get_redis_client(db=0).register_script(
+    'local ids = redis.call("ZRANGEBYSCORE", KEYS[1], ARGV[1], ARGV[2])' + _hmget_ids
+)
+
+
+def get_latest_hash_records(
+    redis_client: redis.Redis, *, key_set: str, key_hash: str, last_n: int
+) -> List[Optional[bytes]]:
+    """Get the values of the last_n records, oldest first."""
+    return _get_by_rank_script(
+        keys=[key_set, key_hash], args=[-last_n, -1], client=redis_client
+    )
+
+
+def find_hash_records(
+    redis_client: redis.Redis,
+    *,
+    key_set: str,
+    key_hash: str,
+    from_ts: float,
+    to_ts: float,
+) -> List[Optional[bytes]]:
+    """Get the values of the records in the given time range, oldest first."""
+    return _get_by_score_script(
+        keys=[key_set, key_hash], args=[from_ts, to_ts], client=redis_client
+    )
+
+
+def iter_sorted_set_pages(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    from_ts: float,
+    to_ts: float,
+    page_size: int = 1000,
+    desc: bool = False,
+) -> Iterator[List[Tuple[bytes, float]]]:
+    """Read the members of a sorted set in the given time range, by pages.
+
+    Pages start from the score of the last member of the previous page (and
+    skip the members of this score we have already returned), so that reading
+    a page does not depend on how many we have already read.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        from_ts: the minimum score
+        to_ts: the maximum score
+        page_size: the maximum number of members of a page
+        desc: whether to return the most recent members first
+    Returns:
+        the pages of members and their scores
+    """
+    cursor: float = to_ts if desc else from_ts
+    skip = 0
+    while True:
+        if desc:
+            page = redis_client.zrevrangebyscore(
+                key, cursor, from_ts, start=skip, num=page_size, withscores=True
+            )
+        else:
+            page = redis_client.zrangebyscore(
+                key, cursor, to_ts, start=skip, num=page_size, withscores=True
+            )
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        cursor, skip = _next_cursor(page, cursor=cursor, skip=skip)
+
+
+def _next_cursor(
+    page: List[Tuple[bytes, float]], *, cursor: float, skip: int
+) -> Tuple[float, int]:
+    """Get the score to start the next page from, and how many members to skip.
+
+    Args:
+        page: the members of the current page, and their scores
+        cursor: the score the current page started from
+        skip: the number of members the current page skipped
+    """
+    last_score = page[-1][1]
+    same_score = 0
+    while same_score < len(page) and page[-1 - same_score][1] == last_score:
+        same_score += 1
+    return last_score, same_score + (skip if last_score == cursor else 0)
+
+
+def get_sorted_set_page(
+    redis_client: redis.Redis,
+    *,
+    key: str,
+    from_ts: float,
+    to_ts: float,
+    limit: int,
+    cursor: Optional[Tuple[float, int]] = None,
+) -> Tuple[List[Tuple[bytes, float]], Optional[Tuple[float, int]]]:
+    """Read a page of the members of a sorted set in the given time range.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        from_ts: the minimum score
+        to_ts: the maximum score
+        limit: the maximum number of members to return
+        cursor: where to start from, as returned for the previous page
+    Returns:
+        the members and their scores, and the cursor of the next page if there
+        are more members
+    """
+    score, skip = cursor if cursor is not None else (from_ts, 0)
+    if score < from_ts:
+        score, skip = from_ts, 0
+    page = redis_client.zrangebyscore(
+        key, score, to_ts, start=skip, num=limit + 1, withscores=True
+    )
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, _next_cursor(page, cursor=score, skip=skip)
+
+
+def iter_hash_records(
+    redis_client: redis.Redis,
+    *,
+    key_set: str,
+    key_hash: str,
+    from_ts: float,
+    to_ts: float,
+    page_size: int = 1000,
+    desc: bool = False,
+) -> Iterator[bytes]:
+    """Read the values of the records in the given time range, by pages.
+
+    Returns:
+        the values of the records, oldest first unless desc is set
+    """
+    for page in iter_sorted_set_pages(
+        redis_client,
+        key=key_set,
+        from_ts=from_ts,
+        to_ts=to_ts,
+        page_size=page_size,
+        desc=desc,
+    ):
+        for value in redis_client.hmget(key_hash, [id for id, _ in page]):
+            # the record might have been deleted since we read the page
+            if value is not None:
+                yield value
+
+
+def trim_sorted_set(
+    redis_client: redis.Redis, *, key: str, before_ts: float, max_days: int
+) -> Tuple[int, float]:
+    """Delete the members of a sorted set scored before a timestamp.
+
+    Members are deleted one (UTC) day at a time, so that trimming a large set
+    does not block redis for long.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the sorted set
+        before_ts: delete the members scored before this timestamp
+        max_days: the maximum number of days to delete, the next ones are
+            deleted on the next call
+    Returns:
+        the number of deleted members, and the timestamp before which all
+        members are deleted
+    """
+    deleted = 0
+    days = 0
+    while True:
+        first = redis_client.zrangebyscore(
+            key, "-inf", f"({before_ts}", start=0, num=1, withscores=True
+        )
+        if not first:
+            return deleted, before_ts
+        day_start = math.floor(first[0][1] / _DAY) * _DAY
+        if days == max_days:
+            return deleted, day_start
+        end_ts = min(day_start + _DAY, before_ts)
+        deleted += redis_client.zremrangebyscore(key, "-inf", f"({end_ts}")
+        days += 1
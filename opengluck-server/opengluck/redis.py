@@ -1,25 +1,124 @@
 """The redis client."""
 import datetime
 import os
+from collections import OrderedDict
+from threading import Lock
+from typing import List
 
 import redis
+from redis.client import Pipeline
+
+from .metrics import incr_metric, register_gauge
 
 _redis_port = int(os.environ.get("REDIS_PORT", 6379))
 
+"""The maximum number of per-database connection pools kept by a process."""
+_max_pools = int(os.environ.get("REDIS_MAX_POOLS", 64))
+
+# One connection pool per database, shared by all the requests of the process,
+# so that we reuse warm connections instead of connecting on every request.
+# Each user has its own database (and we allow up to 100000 of them), so the
+# pools of the least recently used databases are evicted. The pool of db=0
+# holds the accounts and tokens, and is never evicted.
+_pools: "OrderedDict[int, redis.ConnectionPool]" = OrderedDict()
+_pools_lock = Lock()
+
+
+def _get_connection_pool(db: int) -> redis.ConnectionPool:
+    """Get the connection pool of a database, creating it if needed."""
+    evicted_pools: List[redis.ConnectionPool] = []
+    with _pools_lock:
+        pool = _pools.get(db)
+        if pool is not None:
+            _pools.move_to_end(db)
+            incr_metric("redis.pools.hits")
+            return pool
+        incr_metric("redis.pools.misses")
+        pool = redis.ConnectionPool(host="localhost", port=_redis_port, db=db)
+        _pools[db] = pool
+        for evicted_db in list(_pools.keys()):
+            if len(_pools) <= _max_pools:
+                break
+            if evicted_db not in (0, db):
+                evicted_pools.append(_pools.pop(evicted_db))
+    for evicted_pool in evicted_pools:
+        # connections still in use by a request are left alone, and will be
+        # garbage collected once released
+        incr_metric("redis.pools.evictions")
+        evicted_pool.disconnect(inuse_connections=False)
+    return pool
+
 
 def get_redis_client(*, db: int) -> redis.Redis:
     """Get a redis client."""
-    return redis.Redis(host="localhost", port=_redis_port, db=db)
+    return redis.Redis(connection_pool=_get_connection_pool(db))
+
+
+def get_redis_url(*, db: int) -> str:
+    """Get the URL of a redis database, for libraries making their own clients."""
+    return f"redis://localhost:{_redis_port}/{db}"
+
+
+def get_redis_pool_metrics() -> dict:
+    """Get metrics about the connection pools of this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {
+        "pools": len(pools),
+        "connections": sum(getattr(p, "_created_connections", 0) for p in pools),
+        "in_use_connections": sum(
+            len(getattr(p, "_in_use_connections", ())) for p in pools
+        ),
+    }
+
+
+register_gauge("redis", get_redis_pool_metrics)
+
+
+# the keys holding the revision number, and the date it was changed
+revision_keys = ["revision", "revision_changed_at"]
+
+# Lua code to bump the revision number from a script, like queue_bump_revision;
+# scripts pass revision_keys and get_bump_revision_args to bump_revision
+bump_revision_lua = """
+local function bump_revision(revision_keys, args)
+    redis.call("INCR", revision_keys[1])
+    redis.call("SET", revision_keys[2], args[1])
+    redis.call("PUBLISH", args[2], "")
+end
+"""
+
+
+def get_bump_revision_args(redis_client: redis.Redis) -> List[str]:
+    """Get the arguments of bump_revision_lua, for a database."""
+    return [
+        datetime.datetime.utcnow().isoformat(),
+        get_revision_channel(redis_client.connection_pool.connection_kwargs["db"]),
+    ]
 
 
 def bump_revision(redis_client: redis.Redis) -> None:
     """Bump the revision number."""
     p = redis_client.pipeline()
-    p.incr("revision")
-    p.set("revision_changed_at", datetime.datetime.utcnow().isoformat())
+    queue_bump_revision(p)
     p.execute()
 
 
+def queue_bump_revision(p: Pipeline) -> None:
+    """Queue the commands to bump the revision number on a pipeline.
+
+    This also notifies clients watching the revision, see revision_watch.
+    """
+    p.incr(revision_keys[0])
+    p.set(revision_keys[1], datetime.datetime.utcnow().isoformat())
+    p.publish(get_revision_channel(p.connection_pool.connection_kwargs["db"]), "")
+
+
+def get_revision_channel(db: int) -> str:
+    """Get the pub/sub channel notified when the revision of a database changes."""
+    return f"opengluck:revision:{db}"
+
+
 def get_revision(redis_client: redis.Redis) -> int:
     """Get the current revision number."""
     return int(redis_client.get("revision") or -1)
@@ -0,0 +1,73 @@
+"""Cache the responses of the routes polled by clients.
+
+Responses are cached per revision, for each route and query parameters, so
+that many clients polling the same account only cost one build per revision.
+
+Some changes do not bump the revision (instant glucose records, userdata), so
+they need to invalidate the cache explicitly. Responses filtering records by
+age are cached for at most `RESPONSE_CACHE_TTL` seconds.
+"""
+import os
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+
+import redis
+from flask import request
+from redis.client import Pipeline
+
+from .metrics import incr_metric
+from .redis import get_revision
+from .revision_cache import get_revision_cached, set_revision_cached
+
+_key = "response-cache"
+_ttl = int(os.environ.get("RESPONSE_CACHE_TTL", "60"))
+_max_entries = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "32"))
+
+
+def _get_field() -> str:
+    args = sorted(request.args.items(multi=True))
+    return f"{request.path}?{urlencode(args)}"
+
+
+def get_cached_response(redis_client: redis.Redis) -> Tuple[int, Optional[bytes]]:
+    """Get the cached response of the current request.
+
+    Returns:
+        the current revision, and the cached response body (if any)
+    """
+    if _ttl <= 0:
+        return get_revision(redis_client), None
+    revision, body = get_revision_cached(redis_client, _key, _get_field())
+    incr_metric("response_cache.hits" if body is not None else "response_cache.misses")
+    return revision, body
+
+
+def set_cached_response(redis_client: redis.Redis, body: str, *, revision: int) -> None:
+    """Cache the response of the current request.
+
+    Args:
+        redis_client: the redis client of the user
+        body: the response body
+        revision: the revision the response was built at
+    """
+    if _ttl <= 0:
+        return
+    set_revision_cached(
+        redis_client,
+        _key,
+        _get_field(),
+        body,
+        revision=revision,
+        max_fields=_max_entries,
+        ttl=_ttl,
+    )
+
+
+def get_response_cache_key() -> str:
+    """Get the key of the cached responses, for scripts that invalidate them."""
+    return _key
+
+
+def queue_invalidate_response_cache(p: Pipeline) -> None:
+    """Queue the commands to invalidate cached responses on a pipeline."""
+    p.delete(_key)
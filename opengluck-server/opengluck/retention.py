@@ -0,0 +1,210 @@
+"""Archive, downsample and delete old records, so that redis does not grow forever.
+
+Instant glucose records arrive every minute, and scan records are only useful
+until historic records are available, so both can be deleted after a number
+of days, and instant glucose records can be downsampled before. Glucose
+records are moved to the compact archive as well (see glucose_archive).
+
+The policy is applied to all users by scripts/run-retention.py, a few days at a
+time, so that each run is short and does not block redis for long: days left
+for later are handled on the next run. Runs take a lock on db=0, so that only
+one runs at once, and record their progress per user, and the memory they
+reclaimed, which are exposed with the metrics.
+"""
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Collection, Optional, TypedDict
+
+import redis
+
+from .config import tz
+from .glucose import (GlucoseRecordType, archive_glucose_records,
+                      delete_glucose_records, get_glucose_keys)
+from .instant_glucose import (delete_instant_glucose_records,
+                              downsample_instant_glucose_records,
+                              get_instant_glucose_key)
+from .metrics import register_gauge
+from .redis import get_redis_client
+
+
+class RetentionPolicy(TypedDict):
+    """The number of days after which records are processed, 0 for never."""
+
+    glucose_archive_after_days: int
+    scan_glucose_retention_days: int
+    instant_glucose_downsample_after_days: int
+    instant_glucose_retention_days: int
+    # the maximum number of days processed per user, key and run
+    max_days_per_run: int
+
+
+retention_policy = RetentionPolicy(
+    glucose_archive_after_days=int(os.environ.get("GLUCOSE_ARCHIVE_AFTER_DAYS", "30")),
+    scan_glucose_retention_days=int(os.environ.get("SCAN_GLUCOSE_RETENTION_DAYS", "0")),
+    instant_glucose_downsample_after_days=int(
+        os.environ.get("INSTANT_GLUCOSE_DOWNSAMPLE_AFTER_DAYS", "0")
+    ),
+    instant_glucose_retention_days=int(
+        os.environ.get("INSTANT_GLUCOSE_RETENTION_DAYS", "0")
+    ),
+    max_days_per_run=int(os.environ.get("RETENTION_MAX_DAYS_PER_RUN", "30")),
+)
+
+# the progress of a user, in their database
+_progress_key = "retention"
+_downsampled_until_field = "instant-glucose-downsampled-until"
+
+# the status of the last run, and the lock held while running, in db=0
+_status_key = "retention:status"
+_lock_key = "retention:lock"
+_lock_timeout = 10 * 60
+
+
+class RetentionResult(TypedDict):
+    """The result of applying the retention policy."""
+
+    archived: int
+    downsampled: int
+    deleted: int
+    reclaimed_bytes: int
+    # whether some days are left for the next run
+    pending: bool
+
+
+def _get_memory_usage(redis_client: redis.Redis) -> int:
+    keys = [get_instant_glucose_key(), *get_glucose_keys()]
+    return sum(redis_client.memory_usage(key) or 0 for key in keys)
+
+
+def apply_retention(
+    redis_client: redis.Redis,
+    *,
+    now: datetime,
+    policy: RetentionPolicy = retention_policy,
+) -> RetentionResult:
+    """Apply the retention policy to the records of a user.
+
+    Args:
+        redis_client: the redis client of the user
+        now: the current date
+        policy: the retention policy
+    """
+    max_days = policy["max_days_per_run"]
+    memory_usage = _get_memory_usage(redis_client)
+    result = RetentionResult(
+        archived=0, downsampled=0, deleted=0, reclaimed_bytes=0, pending=False
+    )
+    if policy["scan_glucose_retention_days"]:
+        deleted, done = delete_glucose_records(
+            redis_client,
+            record_type=GlucoseRecordType.scan,
+            before=now - timedelta(days=policy["scan_glucose_retention_days"]),
+            max_days=max_days,
+        )
+        result["deleted"] += deleted
+        result["pending"] |= not done
+    if policy["glucose_archive_after_days"]:
+        archived, done = archive_glucose_records(
+            redis_client,
+            before=now - timedelta(days=policy["glucose_archive_after_days"]),
+            max_days=max_days,
+        )
+        result["archived"] += archived
+        result["pending"] |= not done
+    if policy["instant_glucose_retention_days"]:
+        deleted, done = delete_instant_glucose_records(
+            redis_client,
+            before=now - timedelta(days=policy["instant_glucose_retention_days"]),
+            max_days=max_days,
+        )
+        result["deleted"] += deleted
+        result["pending"] |= not done
+    if policy["instant_glucose_downsample_after_days"]:
+        before_ts = (
+            now - timedelta(days=policy["instant_glucose_downsample_after_days"])
+        ).timestamp()
+        downsampled, downsampled_until = downsample_instant_glucose_records(
+            redis_client,
+            from_ts=float(
+                redis_client.hget(_progress_key, _downsampled_until_field) or "-inf"
+            ),
+            before_ts=before_ts,
+            max_days=max_days,
+        )
+        redis_client.hset(_progress_key, _downsampled_until_field, downsampled_until)
+        result["downsampled"] += downsampled
+        result["pending"] |= downsampled_until < before_ts
+    result["reclaimed_bytes"] = memory_usage - _get_memory_usage(redis_client)
+    redis_client.hset(
+        _progress_key,
+        mapping={"last-run-at": now.isoformat(), "last-result": json.dumps(result)},
+    )
+    return result
+
+
+def run_retention(
+    *,
+    now: Optional[datetime] = None,
+    logins: Optional[Collection[str]] = None,
+    policy: RetentionPolicy = retention_policy,
+) -> Optional[dict]:
+    """Apply the retention policy to all users.
+
+    Args:
+        now: the current date, defaults to the date each user is processed at
+        logins: only process these users, defaults to all of them
+        policy: the retention policy
+    Returns:
+        the status of the run, or None if another run is in progress
+    """
+    redis_client_zero = get_redis_client(db=0)
+    lock = redis_client_zero.lock(_lock_key, timeout=_lock_timeout)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        started_at = time.time()
+        status = {
+            "started_at": datetime.now(tz=tz).isoformat(),
+            "users": 0,
+            "pending_users": 0,
+            "archived": 0,
+            "downsampled": 0,
+            "deleted": 0,
+            "reclaimed_bytes": 0,
+        }
+        for login, user in redis_client_zero.hgetall("users").items():
+            if logins is not None and login.decode("utf-8") not in logins:
+                continue
+            result = apply_retention(
+                get_redis_client(db=json.loads(user)["db"]),
+                now=now or datetime.now(tz=tz),
+                policy=policy,
+            )
+            status["users"] += 1
+            status["pending_users"] += result["pending"]
+            for name in ("archived", "downsampled", "deleted", "reclaimed_bytes"):
+                status[name] += result[name]
+            lock.reacquire()
+        status["duration"] = time.time() - started_at
+        redis_client_zero.set(_status_key, json.dumps(status))
+        return status
+    finally:
+        lock.release()
+
+
+def get_retention_metrics() -> dict:
+    """Get the status of the last retention run, and of redis snapshots."""
+    redis_client_zero = get_redis_client(db=0)
+    status = redis_client_zero.get(_status_key)
+    persistence = redis_client_zero.info("persistence")
+    return {
+        "last_run": json.loads(status) if status else None,
+        "used_memory": redis_client_zero.info("memory")["used_memory"],
+        "rdb_last_bgsave_time_sec": persistence.get("rdb_last_bgsave_time_sec"),
+        "rdb_changes_since_last_save": persistence.get("rdb_changes_since_last_save"),
+    }
+
+
+register_gauge("retention", get_retention_metrics)
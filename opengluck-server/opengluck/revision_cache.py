@@ -0,0 +1,108 @@
+"""Caches of values computed from the records of a user, keyed by revision.
+
+Values are stored in a hash of the user database, along with the revision they
+were computed at, and are discarded as soon as the revision changes. Values
+can also expire after some time, in which case their expiry date is stored in
+the `expires:<field>` field of the hash.
+"""
+import time
+from typing import Optional, Tuple
+
+import redis
+
+from .redis import get_redis_client
+
+# store a value for a given revision, if it is still the current revision;
+# the cache is reset when storing a value for a new revision, and values are
+# not stored once the cache holds max_fields of them (that have not expired)
+_set_script = get_redis_client(db=0).register_script(
+    """
+local revision = redis.call("GET", KEYS[2]) or "-1"
+if revision ~= ARGV[1] then
+    return 0
+end
+if redis.call("HGET", KEYS[1], "revision") ~= revision then
+    redis.call("DEL", KEYS[1])
+    redis.call("HSET", KEYS[1], "revision", revision)
+end
+local ttl = tonumber(ARGV[5])
+local now = tonumber(ARGV[6])
+local max_len = tonumber(ARGV[4]) * (ttl > 0 and 2 or 1)
+if redis.call("HLEN", KEYS[1]) > max_len and ttl > 0 then
+    -- make room by removing the values that have expired
+    local fields = redis.call("HGETALL", KEYS[1])
+    for i = 1, #fields, 2 do
+        local name = fields[i]
+        if string.sub(name, 1, 8) == "expires:" and tonumber(fields[i + 1]) <= now then
+            redis.call("HDEL", KEYS[1], name, string.sub(name, 9))
+        end
+    end
+end
+if redis.call("HLEN", KEYS[1]) > max_len then
+    return 0
+end
+redis.call("HSET", KEYS[1], ARGV[2], ARGV[3])
+if ttl > 0 then
+    redis.call("HSET", KEYS[1], "expires:" .. ARGV[2], now + ttl)
+    redis.call("EXPIRE", KEYS[1], ttl)
+end
+return 1
+"""
+)
+
+
+def get_revision_cached(
+    redis_client: redis.Redis, key: str, field: str
+) -> Tuple[int, Optional[bytes]]:
+    """Get a cached value, if it was computed at the current revision.
+
+    Returns:
+        the current revision, and the cached value (if any)
+    """
+    revision, cached_revision, value, expires = (
+        redis_client.pipeline(transaction=False)
+        .get("revision")
+        .hget(key, "revision")
+        .hget(key, field)
+        .hget(key, f"expires:{field}")
+        .execute()
+    )
+    revision = int(revision or -1)
+    if cached_revision is None or int(cached_revision) != revision:
+        return revision, None
+    if expires is not None and float(expires) <= time.time():
+        return revision, None
+    return revision, value
+
+
+def set_revision_cached(
+    redis_client: redis.Redis,
+    key: str,
+    field: str,
+    value: str,
+    *,
+    revision: int,
+    max_fields: int = 32,
+    ttl: int = 0,
+) -> bool:
+    """Cache a value computed at the given revision.
+
+    Args:
+        redis_client: the redis client of the user
+        key: the key of the cache
+        field: the field of the value in the cache
+        value: the value to store
+        revision: the revision the value was computed at, nothing is stored
+            if the revision has changed since
+        max_fields: the maximum number of values to keep per revision
+        ttl: if set, the number of seconds after which the value expires
+    Returns:
+        whether the value was stored
+    """
+    return bool(
+        _set_script(
+            keys=[key, "revision"],
+            args=[revision, field, value, max_fields, ttl, time.time()],
+            client=redis_client,
+        )
+    )
@@ -0,0 +1,100 @@
+"""Wait for the revision of a user to change.
+
+Bumping the revision publishes a message on redis (see queue_bump_revision).
+Each process has a single thread listening to these messages, which wakes up
+the requests waiting for the revision of this user to change, so that clients
+can watch the revision without polling it.
+"""
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, Optional, Set
+
+import redis
+
+from .metrics import incr_metric, register_gauge
+from .redis import get_redis_client, get_revision, get_revision_channel
+
+_lock = Lock()
+# the events of the requests waiting for a revision change, per database
+_waiters: Dict[int, Set[Event]] = {}
+_listener_pid: Optional[int] = None
+
+
+def _notify(db: Optional[int] = None) -> None:
+    """Wake up the requests waiting on a database, or on all of them."""
+    with _lock:
+        if db is None:
+            events = [event for events in _waiters.values() for event in events]
+        else:
+            events = list(_waiters.get(db, ()))
+    for event in events:
+        event.set()
+
+
+def _listen() -> None:
+    while True:
+        try:
+            pubsub = get_redis_client(db=0).pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(get_revision_channel("*"))  # type: ignore
+            # we might have missed changes while (re)connecting
+            _notify()
+            for message in pubsub.listen():
+                channel = message["channel"].decode("utf-8")
+                _notify(int(channel.rsplit(":", 1)[1]))
+        except Exception as e:
+            logging.warning(f"Lost connection when watching revisions: {e}")
+            incr_metric("revision_watch.reconnections")
+            time.sleep(1)
+
+
+def _ensure_listener() -> None:
+    global _listener_pid
+    with _lock:
+        # threads do not survive a fork, so we start one in each process
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        _waiters.clear()
+    Thread(target=_listen, name="revision-watch", daemon=True).start()
+
+
+def wait_for_revision(redis_client: redis.Redis, revision: int, timeout: float) -> int:
+    """Wait until the revision is not the given one anymore.
+
+    Args:
+        redis_client: the redis client of the user
+        revision: the revision the client already has
+        timeout: the maximum number of seconds to wait
+    Returns:
+        the current revision, which is the given one if we timed out
+    """
+    _ensure_listener()
+    db = redis_client.connection_pool.connection_kwargs["db"]
+    event = Event()
+    with _lock:
+        _waiters.setdefault(db, set()).add(event)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            # check after we started to listen, so that we don't miss changes
+            current_revision = get_revision(redis_client)
+            remaining = deadline - time.monotonic()
+            if current_revision != revision or remaining <= 0:
+                return current_revision
+            event.wait(remaining)
+            event.clear()
+    finally:
+        with _lock:
+            _waiters[db].discard(event)
+            if not _waiters[db]:
+                del _waiters[db]
+
+
+def _get_watchers() -> int:
+    with _lock:
+        return sum(len(events) for events in _waiters.values())
+
+
+register_gauge("revision_watch.watchers", _get_watchers)
@@ -1,35 +1,70 @@
 """Main server module."""
+import hashlib
 import json
 import logging
 import os
 import random
 import sys
+import time
 
 from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_limiter import Limiter
 
 from .http_request_log import log_request_to_redis
-from .redis import get_revision, get_revision_changed_at
+from .metrics import (get_counter, get_observation, incr_metric, observe_metric,
+                      register_gauge)
+from .redis import get_redis_url, get_revision, get_revision_changed_at
 
 
 def _get_flask_limiter_key() -> str:
     """Get the key to use for flask_limiter.
 
-    If we have an authorization header, we return its value, else we return the
-    IP address of the current request.
+    If we have an authorization header, we return a hash of its value, else we
+    return the IP address of the current request.
     """
     if "Authorization" in request.headers:
-        return request.headers["Authorization"]
+        authorization = request.headers["Authorization"]
+        return hashlib.sha256(authorization.encode("utf-8")).hexdigest()
     return request.remote_addr or "no-ip"
 
 
+# Limits are stored on redis, so that they are shared by all the server
+# processes, as sliding-window counters: each limit is checked and incremented
+# atomically with the counters of the current and previous windows (the latter
+# weighted by how much it overlaps the sliding window), whatever its size, so
+# that bursts across a window boundary are limited as well. Routes polled by
+# clients, and routes to upload records, have their own limits.
+_rate_limit_storage_uri = os.environ.get("RATE_LIMIT_STORAGE_URI", get_redis_url(db=0))
+_rate_limit_default = os.environ.get(
+    "RATE_LIMIT_DEFAULT", "10 per second;60 per minute;1000 per hour"
+)
+_rate_limit_polling = os.environ.get(
+    "RATE_LIMIT_POLLING", "10 per second;300 per minute;10000 per hour"
+)
+_rate_limit_upload = os.environ.get(
+    "RATE_LIMIT_UPLOAD", "10 per second;120 per minute;2000 per hour"
+)
+
+
+def polling_rate_limit() -> str:
+    """Get the rate limits of routes polled by clients."""
+    return _rate_limit_polling
+
+
+def upload_rate_limit() -> str:
+    """Get the rate limits of routes uploading records."""
+    return _rate_limit_upload
+
+
 app = Flask("OpenGlück")
 limiter = Limiter(
     _get_flask_limiter_key,
     app=app,
-    default_limits=["10 per second", "60 per minute", "1000 per hour"],
-    storage_uri="memory://",
+    default_limits=[lambda: _rate_limit_default],
+    storage_uri=_rate_limit_storage_uri,
+    strategy="sliding-window-counter",
+    key_prefix="rate-limit",
 )
 if os.environ.get("CONTEXT") == "test":
     # when running from pytest, we disable the limiter
@@ -47,8 +82,20 @@ def _process_request():
     log_request_to_redis()
     from opengluck.login import is_current_request_logged_in_as_admin
 
-    from .webhooks import call_webhooks
+    from .webhooks import call_webhooks, has_webhook_subscribers
 
+    # only build the payload of admin requests, which are kept in the history
+    # (with the same payload as webhooks receive), even without subscribers
+    if (
+        "Authorization" not in request.headers
+        or not is_current_request_logged_in_as_admin()
+    ):
+        incr_metric("webhooks.app_request.skipped")
+        return
+    if not has_webhook_subscribers("app_request"):
+        incr_metric("webhooks.app_request.unsubscribed")
+
+    start = time.perf_counter()
     try:
         data = request.get_json()
     except Exception:
@@ -62,9 +109,20 @@ def _process_request():
         "cookies": dict(request.cookies),
         "data": data,
     }
+    observe_metric("webhooks.app_request.build_duration", time.perf_counter() - start)
+    call_webhooks("app_request", payload)
+
+
+def _get_app_request_saved_duration() -> float:
+    """Estimate the time saved by skipping app_request payloads, in seconds."""
+    build_duration = get_observation("webhooks.app_request.build_duration")
+    if build_duration is None:
+        return 0
+    skipped = get_counter("webhooks.app_request.skipped")
+    return skipped * build_duration["sum"] / build_duration["count"]
+
 
-    if is_current_request_logged_in_as_admin():
-        call_webhooks("app_request", payload)
+register_gauge("webhooks.app_request.saved_duration", _get_app_request_saved_duration)
 
 
 @app.before_request
@@ -96,6 +154,7 @@ def _random():
 
 
 @app.route("/opengluck/revision")
+@limiter.limit(polling_rate_limit)
 def _get_revision_info():
     from .login import assert_get_current_request_redis_client
 
@@ -111,6 +170,55 @@ def _get_revision_info():
     )
 
 
+_MAX_WATCH_TIMEOUT = 60
+
+# Waiting watches hold a thread. With sync workers (the default), that is a
+# whole worker process, which gunicorn kills after SERVER_TIMEOUT, so watches
+# are not available and clients should poll instead.
+_server_worker_class = os.environ.get("SERVER_WORKER_CLASS", "sync")
+_server_timeout = float(os.environ.get("SERVER_TIMEOUT", "30"))
+
+
+def _get_max_watch_timeout() -> float:
+    """Get the maximum number of seconds a watch waits for the revision."""
+    return min(_MAX_WATCH_TIMEOUT, _server_timeout / 2)
+
+
+@app.route("/opengluck/revision/watch")
+@limiter.limit(polling_rate_limit)
+def _watch_revision():
+    """Wait until the revision changes from the one given by the client.
+
+    This returns the same data as /opengluck/revision, once the revision is not
+    `revision` anymore, or after `timeout` seconds. With sync workers, this
+    returns a 501 instead, and clients should poll /opengluck/revision.
+    """
+    from .login import assert_get_current_request_redis_client
+    from .revision_watch import wait_for_revision
+
+    redis_client = assert_get_current_request_redis_client()
+    if _server_worker_class == "sync":
+        return Response(
+            "Watching the revision is not available, poll /opengluck/revision",
+            status=501,
+        )
+    try:
+        revision = int(request.args.get("revision", "-1"))
+        timeout = float(request.args.get("timeout", "30"))
+    except ValueError:
+        return Response("Invalid revision or timeout", status=400)
+    timeout = max(0, min(timeout, _get_max_watch_timeout()))
+    revision = wait_for_revision(redis_client, revision, timeout)
+    revision_changed_at = get_revision_changed_at(redis_client)
+    return Response(
+        status=200,
+        response=json.dumps(
+            {"revision": revision, "revision_changed_at": revision_changed_at}
+        ),
+        content_type="application/json",
+    )
+
+
 if __name__ == "__main__":
 
     logging.info("Starting OpenGlück server")
@@ -0,0 +1,149 @@
+"""Compute glucose statistics over a time range.
+
+Readings are loaded once in NumPy arrays, and interpolated linearly on a grid
+of one value per minute (readings further apart than an hour are not
+interpolated), so that all statistics are time-weighted and computed with a
+few vectorized operations.
+"""
+import json
+from typing import Optional, TypedDict
+
+import numpy as np
+from flask import Response, abort, request
+
+from .glucose import GlucoseRecordType, find_glucose_values
+from .glucose_aggregates import max_interpolation_duration
+from .login import assert_current_request_logged_in
+from .server import app
+from .utils import parse_timestamp
+
+_default_low = 70
+_default_high = 180
+
+
+class GlucoseStats(TypedDict):
+    """Statistics of glucose values.
+
+    Times in range are percentages of the interpolated values, the coefficient
+    of variation and the Glucose Management Indicator are percentages as well.
+    """
+
+    count: int
+    minutes: int
+    mean: Optional[float]
+    sd: Optional[float]
+    cv: Optional[float]
+    gmi: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+    time_below_range: Optional[float]
+    time_in_range: Optional[float]
+    time_above_range: Optional[float]
+
+
+def interpolate_glucose_values(
+    timestamps: np.ndarray, values: np.ndarray
+) -> np.ndarray:
+    """Interpolate glucose values linearly, one value per minute.
+
+    Readings further apart than max_interpolation_duration are not
+    interpolated: the grid starts again at the next reading.
+
+    Args:
+        timestamps: the timestamps of the readings, sorted
+        values: the glucose values of the readings
+    Returns:
+        the interpolated values
+    """
+    if len(timestamps) == 0:
+        return np.empty(0)
+    # split readings where they are too far apart
+    breaks = np.flatnonzero(np.diff(timestamps) > max_interpolation_duration) + 1
+    starts = timestamps[np.r_[0, breaks]]
+    ends = timestamps[np.r_[breaks - 1, len(timestamps) - 1]]
+    lengths = np.floor((ends - starts) / 60).astype(np.int64) + 1
+    # the minutes since the start of their segment, for each point of the grid
+    minutes = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    grid = np.repeat(starts, lengths) + minutes * 60
+    return np.interp(grid, timestamps, values)
+
+
+def compute_glucose_stats(
+    timestamps: np.ndarray, values: np.ndarray, *, low: float, high: float
+) -> GlucoseStats:
+    """Compute the statistics of glucose readings.
+
+    Args:
+        timestamps: the timestamps of the readings, sorted
+        values: the glucose values of the readings
+        low: values below are below range
+        high: values above are above range
+    """
+    interpolated = interpolate_glucose_values(timestamps, values)
+    if len(interpolated) == 0:
+        return GlucoseStats(
+            count=0,
+            minutes=0,
+            mean=None,
+            sd=None,
+            cv=None,
+            gmi=None,
+            min=None,
+            max=None,
+            time_below_range=None,
+            time_in_range=None,
+            time_above_range=None,
+        )
+    mean = float(interpolated.mean())
+    sd = float(interpolated.std())
+    below = float(np.count_nonzero(interpolated < low)) / len(interpolated)
+    above = float(np.count_nonzero(interpolated > high)) / len(interpolated)
+    return GlucoseStats(
+        count=len(timestamps),
+        minutes=len(interpolated),
+        mean=mean,
+        sd=sd,
+        cv=100 * sd / mean if mean else None,
+        gmi=3.31 + 0.02392 * mean,
+        min=float(values.min()),
+        max=float(values.max()),
+        time_below_range=100 * below,
+        time_in_range=100 * (1 - below - above),
+        time_above_range=100 * above,
+    )
+
+
+@app.route("/opengluck/stats")
+def _get_stats():
+    assert_current_request_logged_in()
+    from_date = request.args.get("from")
+    to_date = request.args.get("to")
+    if from_date is None or to_date is None:
+        return abort(400)
+    try:
+        from_timestamp = parse_timestamp(from_date)
+        to_timestamp = parse_timestamp(to_date)
+        record_type = GlucoseRecordType(request.args.get("type", "historic"))
+        low = float(request.args.get("low", _default_low))
+        high = float(request.args.get("high", _default_high))
+    except ValueError:
+        return abort(400)
+    readings = np.array(
+        find_glucose_values(record_type, from_timestamp, to_timestamp),
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    stats = compute_glucose_stats(readings[:, 0], readings[:, 1], low=low, high=high)
+    return Response(
+        json.dumps(
+            {
+                "from_date": from_timestamp.isoformat(),
+                "to_date": to_timestamp.isoformat(),
+                "low": low,
+                "high": high,
+                **stats,
+            }
+        ),
+        content_type="application/json",
+    )
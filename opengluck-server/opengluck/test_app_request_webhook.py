@@ -0,0 +1,50 @@
+from .metrics import get_counter
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+# nothing listens there, calls fail right away
+_url = "http://127.0.0.1:9/"
+
+
+def _get_last_app_requests(test_client, last_n):
+    response = test_client.get(
+        f"/opengluck/webhooks/app_request/last?last_n={last_n}", headers=_headers
+    )
+    assert response.status_code == 200
+    return response.json
+
+
+def test_app_request_skipped_without_subscribers():
+    with app.test_client() as test_client:
+        test_client.delete("/opengluck/webhooks/app_request", headers=_headers)
+        skipped = get_counter("webhooks.app_request.skipped")
+        unsubscribed = get_counter("webhooks.app_request.unsubscribed")
+        test_client.get("/opengluck/random")
+        test_client.get("/opengluck/random", headers=_headers)
+        assert get_counter("webhooks.app_request.skipped") == skipped + 1
+        assert get_counter("webhooks.app_request.unsubscribed") == unsubscribed + 1
+        # only the admin request is kept in the history, with its full payload,
+        # the first one is the request to get the last app requests
+        _, last_app_request = _get_last_app_requests(test_client, 3)
+        assert last_app_request["data"]["method"] == "GET"
+        assert last_app_request["data"]["path"] == "/opengluck/random"
+        assert last_app_request["data"]["headers"]["Authorization"] == (
+            _headers["Authorization"]
+        )
+
+
+def test_app_request_called_with_subscribers():
+    with app.test_client() as test_client:
+        test_client.delete("/opengluck/webhooks/app_request", headers=_headers)
+        test_client.put(
+            "/opengluck/webhooks/app_request", json={"url": _url}, headers=_headers
+        )
+        skipped = get_counter("webhooks.app_request.skipped")
+        test_client.get("/opengluck/random?subscribed", headers=_headers)
+        assert get_counter("webhooks.app_request.skipped") == skipped
+        # the first one is the request to get the last app requests
+        _, last_app_request = _get_last_app_requests(test_client, 2)
+        assert last_app_request["data"]["method"] == "GET"
+        assert last_app_request["data"]["path"] == "/opengluck/random"
+        test_client.delete("/opengluck/webhooks/app_request", headers=_headers)
@@ -1,3 +1,9 @@
+from datetime import datetime
+
+from .episode import (Episode, EpisodeRecord, InsertEpisodeStatus,
+                      insert_episode, insert_episodes)
+from .login import assert_get_current_request_redis_client
+from .redis import get_revision
 from .server import app
 
 _headers = {"Authorization": "Bearer dev-token"}
@@ -285,3 +291,68 @@ def test_detect_duplicates():
         assert response.json
         assert len(response.json) == 1
         assert response.json[0] == last_webhook
+
+
+def test_insert_episode_status():
+    with app.test_request_context(headers=_headers):
+        app.test_client().delete("/opengluck/episode", headers=_headers)
+        redis_client = assert_get_current_request_redis_client()
+
+        def insert(episode: Episode, timestamp: str) -> InsertEpisodeStatus:
+            return insert_episode(
+                episode=episode,
+                timestamp=datetime.fromisoformat(timestamp),
+                trigger_episode_changes=False,
+            )
+
+        assert insert(Episode.low, "2023-05-01T10:00:00+02:00") == "inserted"
+        assert insert(Episode.high, "2023-05-01T12:00:00+02:00") == "inserted"
+        # the high episode actually started earlier
+        assert insert(Episode.high, "2023-05-01T11:00:00+02:00") == "replaced"
+        # duplicates do not change the revision
+        revision = get_revision(redis_client)
+        assert insert(Episode.high, "2023-05-01T11:30:00+02:00") == "duplicate"
+        assert get_revision(redis_client) == revision
+        assert insert(Episode.normal, "2023-05-01T13:00:00+02:00") == "inserted"
+        assert get_revision(redis_client) == revision + 1
+        assert [
+            member.decode() for member in redis_client.zrange("episode", 0, -1)
+        ] == [
+            '{"ts": "1682928000.0", "episode": "low"}',
+            '{"ts": "1682931600.0", "episode": "high"}',
+            '{"ts": "1682938800.0", "episode": "normal"}',
+        ]
+
+
+def test_insert_episodes_in_one_transaction():
+    with app.test_request_context(headers=_headers):
+        app.test_client().delete("/opengluck/episode", headers=_headers)
+        insert_episode(
+            episode=Episode.high,
+            timestamp=datetime.fromisoformat("2023-05-02T12:00:00+02:00"),
+        )
+        redis_client = assert_get_current_request_redis_client()
+        revision = get_revision(redis_client)
+        status = insert_episodes(
+            [
+                EpisodeRecord(
+                    timestamp=f"2023-05-02T{hour}:00:00+02:00", episode=episode
+                )
+                for hour, episode in [
+                    (13, Episode.normal),
+                    (10, Episode.low),
+                    (11, Episode.low),
+                    (11, Episode.high),
+                ]
+            ]
+        )
+        assert status["nb_inserted"] == 2
+        assert status["nb_replaced"] == 1
+        assert status["nb_duplicates"] == 1
+        assert get_revision(redis_client) == revision + 1
+        response = app.test_client().get("/opengluck/episode/last", headers=_headers)
+        assert response.json == [
+            {"timestamp": "2023-05-02T13:00:00+02:00", "episode": "normal"},
+            {"timestamp": "2023-05-02T11:00:00+02:00", "episode": "high"},
+            {"timestamp": "2023-05-02T10:00:00+02:00", "episode": "low"},
+        ]
@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      find_glucose_records, record_glucose_records)
+from .insulin import (_clear_all_insulin_records, find_insulin_records,
+                      insert_insulin_records)
+from .low import _clear_all_low_records, insert_low_records
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+_start = tz.localize(datetime(2023, 6, 1))
+_end = _start + timedelta(days=3)
+
+
+def _fill():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        _clear_all_insulin_records()
+        _clear_all_low_records()
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [(_start + timedelta(minutes=5 * i), 100 + i % 50) for i in range(3 * 288)],
+        )
+        insert_insulin_records(
+            [
+                {
+                    "id": f"insulin-{i}",
+                    "timestamp": (_start + timedelta(hours=5 * i)).isoformat(),
+                    "units": i,
+                    "deleted": False,
+                }
+                for i in range(10)
+            ]
+        )
+        insert_low_records(
+            [
+                {
+                    "id": "low-1",
+                    "timestamp": (_start + timedelta(hours=1)).isoformat(),
+                    "sugar_in_grams": 15,
+                    "deleted": False,
+                }
+            ]
+        )
+
+
+def _export(**kwargs) -> str:
+    response = app.test_client().post(
+        "/opengluck/export",
+        headers=_headers,
+        json={"from": _start.isoformat(), "to": _end.isoformat(), **kwargs},
+    )
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_export_json():
+    _fill()
+    with app.test_request_context(headers=_headers):
+        expected = json.dumps(
+            {
+                "glucose": find_glucose_records(
+                    GlucoseRecordType.historic, _start, _end
+                ),
+                "insulin": find_insulin_records(_start, _end),
+            }
+        )
+    assert _export(type="json") == expected
+    assert json.loads(_export(type="json", series=["low"])) == {
+        "low": [
+            {
+                "id": "low-1",
+                "timestamp": (_start + timedelta(hours=1)).isoformat(),
+                "sugar_in_grams": 15,
+                "deleted": False,
+            }
+        ]
+    }
+
+
+def test_export_swift():
+    _fill()
+    result = _export(type="swift")
+    assert result.startswith("static let sample = CarbsSample(")
+    assert result.count("InsulinRecord(") == 10
+    assert result.count("GlucoseRecord(") == 3 * 288
+
+
+def test_export_ndjson_and_csv():
+    _fill()
+    lines = _export(type="ndjson", series=["insulin", "low"]).splitlines()
+    assert len(lines) == 11
+    assert json.loads(lines[0])["series"] == "insulin"
+    assert json.loads(lines[0])["units"] == 0
+    assert json.loads(lines[-1])["series"] == "low"
+
+    rows = list(csv.reader(io.StringIO(_export(type="csv", series=["glucose", "low"]))))
+    assert rows[0] == [
+        "series",
+        "timestamp",
+        "mgDl",
+        "record_type",
+        "id",
+        "sugar_in_grams",
+        "deleted",
+    ]
+    assert len(rows) == 1 + 3 * 288 + 1
+    assert rows[1] == ["glucose", _start.isoformat(), "100", "historic", "", "", ""]
+    assert rows[-1][0] == "low" and rows[-1][-1] == "false"
+
+
+def test_export_invalid_series():
+    response = app.test_client().post(
+        "/opengluck/export",
+        headers=_headers,
+        json={
+            "from": _start.isoformat(),
+            "to": _end.isoformat(),
+            "type": "json",
+            "series": ["unknown"],
+        },
+    )
+    assert response.status_code == 400
+
+
+def test_download_instant_glucose_data():
+    _fill()
+    client = app.test_client()
+    client.delete("/opengluck/instant-glucose", headers=_headers)
+    response = client.get("/opengluck/instant-glucose/download", headers=_headers)
+    assert response.get_data(as_text=True) == (
+        "timestamp,model_name,device_id,instant,historic"
+    )
+    client.post(
+        "/opengluck/instant-glucose/upload",
+        headers=_headers,
+        json={
+            "instant-glucose-records": [
+                {
+                    "timestamp": (_start + timedelta(minutes=i)).isoformat(),
+                    "mgDl": 90 + i,
+                    "model_name": "Model",
+                    "device_id": "device",
+                }
+                for i in range(12)
+            ]
+        },
+    )
+    response = client.get(
+        "/opengluck/instant-glucose/download?last_n=11", headers=_headers
+    )
+    rows = response.get_data(as_text=True).split("\n")
+    assert rows[0] == "timestamp,model_name,device_id,instant,historic"
+    # historic records from 5 minutes before the first instant record
+    assert rows[1:] == sorted(rows[1:], key=lambda row: row.split(",")[0])
+    assert rows[1] == f"{_start.isoformat()},,,,100,"
+    assert rows[2] == f"{(_start + timedelta(minutes=1)).isoformat()},Model,device,91,"
+    assert len(rows) == 1 + 11 + 4
@@ -0,0 +1,235 @@
+import random
+from datetime import datetime, timedelta
+
+from . import glucose_aggregates
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records, _key,
+                      aggregate_glucose_records, archive_glucose_records,
+                      find_glucose_buckets, find_glucose_records,
+                      record_glucose_records)
+from .glucose_aggregates import (_add, aggregate_glucose_readings,
+                                 find_glucose_readings,
+                                 get_daily_glucose_aggregates_key)
+from .hba1c import _calculate_hba1c
+from .login import assert_get_current_request_redis_client
+from .metrics import get_counter
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+_start = datetime(2023, 3, 1, 0, 0, 0, tzinfo=tz)
+
+
+def _assert_same_aggregate(from_date: datetime, to_date: datetime) -> None:
+    records = find_glucose_records(GlucoseRecordType.historic, from_date, to_date)
+    expected = aggregate_glucose_readings(
+        (datetime.fromisoformat(record["timestamp"]).timestamp(), record["mgDl"])
+        for record in records
+    )
+    aggregate = aggregate_glucose_records(
+        GlucoseRecordType.historic, from_date, to_date
+    )
+    if expected is None:
+        assert aggregate is None
+        return
+    assert aggregate is not None
+    assert aggregate["count"] == expected["count"]
+    assert abs(aggregate["sum"] - expected["sum"]) < 0.001
+    assert (aggregate["min"], aggregate["max"]) == (expected["min"], expected["max"])
+
+
+def test_aggregate_glucose_records():
+    random.seed(42)
+    readings = []
+    ts = _start
+    while ts < _start + timedelta(days=10):
+        readings.append((ts, random.randint(40, 300)))
+        # mostly 5 minutes apart, with a few gaps
+        ts += timedelta(seconds=random.choice([300] * 20 + [30, 301, 3600, 5000]))
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        record_glucose_records(GlucoseRecordType.historic, readings)
+        for from_days, to_days in [(0, 10), (0.3, 9.7), (1.99, 4), (2, 3), (5, 5.5)]:
+            _assert_same_aggregate(
+                _start + timedelta(days=from_days), _start + timedelta(days=to_days)
+            )
+
+        # change records, including in a day that is not in the range
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [
+                (readings[10][0], 400),
+                (readings[500][0] + timedelta(seconds=10), 400),
+                (_start + timedelta(days=4), 20),
+            ],
+        )
+        _assert_same_aggregate(_start, _start + timedelta(days=10))
+        _assert_same_aggregate(
+            _start + timedelta(hours=3), _start + timedelta(days=8, hours=3)
+        )
+
+        # aggregates are the same for archived records
+        redis_client = assert_get_current_request_redis_client()
+        archive_glucose_records(redis_client, before=_start + timedelta(days=5))
+        _assert_same_aggregate(_start, _start + timedelta(days=10))
+
+        # and are built again if missing
+        redis_client.delete(
+            get_daily_glucose_aggregates_key(_key(GlucoseRecordType.historic))
+        )
+        _assert_same_aggregate(_start, _start + timedelta(days=10))
+        _assert_same_aggregate(_start + timedelta(days=20), _start + timedelta(days=30))
+
+
+def test_aggregate_concurrent_uploads(monkeypatch):
+    def find_while_uploading(*args, **kwargs):
+        readings = find_glucose_readings(*args, **kwargs)
+        if not uploaded:
+            uploaded.append(True)
+            # another upload of the same day completes meanwhile
+            record_glucose_records(
+                GlucoseRecordType.historic, [(_start + timedelta(hours=1), 300)]
+            )
+        return readings
+
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        uploaded = [True]
+        monkeypatch.setattr(
+            glucose_aggregates, "find_glucose_readings", find_while_uploading
+        )
+        record_glucose_records(GlucoseRecordType.historic, [(_start, 100)])
+        retries = get_counter("glucose.aggregates.retries")
+        uploaded.clear()
+        record_glucose_records(
+            GlucoseRecordType.historic, [(_start + timedelta(hours=2), 200)]
+        )
+        # the older computation is not written over the newer one
+        assert get_counter("glucose.aggregates.retries") == retries + 1
+        _assert_same_aggregate(_start, _start + timedelta(days=1))
+
+
+def test_aggregate_concurrent_uploads_give_up(monkeypatch):
+    def find_while_uploading(*args, **kwargs):
+        readings = find_glucose_readings(*args, **kwargs)
+        if not uploading:
+            # another upload of the same day completes every time
+            uploading.append(True)
+            record_glucose_records(
+                GlucoseRecordType.historic,
+                [(_start + timedelta(hours=1), 100 + len(uploads))],
+            )
+            uploads.append(True)
+            uploading.clear()
+        return readings
+
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        uploading = [True]
+        uploads = []
+        monkeypatch.setattr(
+            glucose_aggregates, "find_glucose_readings", find_while_uploading
+        )
+        record_glucose_records(GlucoseRecordType.historic, [(_start, 100)])
+        retries = get_counter("glucose.aggregates.retries")
+        given_up = get_counter("glucose.aggregates.given_up")
+        uploading.clear()
+        record_glucose_records(
+            GlucoseRecordType.historic, [(_start + timedelta(hours=2), 200)]
+        )
+        # retries are capped, and the aggregates are built again on read
+        assert get_counter("glucose.aggregates.retries") == retries + 5
+        assert get_counter("glucose.aggregates.given_up") == given_up + 1
+        assert len(uploads) == 6
+        uploading.append(True)
+        _assert_same_aggregate(_start, _start + timedelta(days=1))
+
+
+def _assert_same_buckets(
+    from_date: datetime, to_date: datetime, resolution: float
+) -> None:
+    records = find_glucose_records(GlucoseRecordType.historic, from_date, to_date)
+    expected = {}
+    previous = None
+    for record in records:
+        reading = (
+            datetime.fromisoformat(record["timestamp"]).timestamp(),
+            record["mgDl"],
+        )
+        bucket = max(reading[0] // resolution * resolution, from_date.timestamp())
+        expected[bucket] = _add(
+            expected.get(bucket),
+            aggregate_glucose_readings([reading], previous=previous),
+        )
+        previous = reading
+    buckets = find_glucose_buckets(
+        GlucoseRecordType.historic, from_date, to_date, resolution=resolution
+    )
+    assert [
+        datetime.fromisoformat(bucket["timestamp"]).timestamp() for bucket in buckets
+    ] == list(expected)
+    for bucket, aggregate in zip(buckets, expected.values()):
+        assert aggregate is not None
+        assert abs(bucket["mgDl"] - aggregate["sum"] / aggregate["count"]) < 0.001
+        assert (bucket["min"], bucket["max"]) == (aggregate["min"], aggregate["max"])
+
+
+def test_find_glucose_buckets():
+    random.seed(43)
+    readings = []
+    ts = _start
+    while ts < _start + timedelta(days=10):
+        readings.append((ts, random.randint(40, 300)))
+        ts += timedelta(seconds=random.choice([300] * 20 + [301, 3600, 5000]))
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        record_glucose_records(GlucoseRecordType.historic, readings)
+        redis_client = assert_get_current_request_redis_client()
+        archive_glucose_records(redis_client, before=_start + timedelta(days=3))
+        for from_days, to_days in [(0, 10), (0.3, 9.7), (2, 3), (5, 5.5)]:
+            for resolution in [600, 4 * 3600, 86400, 2 * 86400]:
+                _assert_same_buckets(
+                    _start + timedelta(days=from_days),
+                    _start + timedelta(days=to_days),
+                    resolution,
+                )
+
+    client = app.test_client()
+    response = client.get(
+        "/opengluck/glucose/find",
+        query_string={
+            "from": _start.isoformat(),
+            "to": (_start + timedelta(days=10)).isoformat(),
+            "max_points": 100,
+        },
+        headers=_headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["x-opengluck-resolution"] == str(146 * 60)
+    buckets = response.json
+    assert buckets is not None and len(buckets) <= 100
+    assert set(buckets[0]) == {"timestamp", "mgDl", "min", "max", "record_type"}
+    response = client.get(
+        "/opengluck/glucose/find",
+        query_string={
+            "from": _start.isoformat(),
+            "to": (_start + timedelta(days=10)).isoformat(),
+            "resolution": 10,
+        },
+        headers=_headers,
+    )
+    assert response.status_code == 400
+
+
+def test_calculate_hba1c_after_a_gap():
+    with app.test_request_context(headers=_headers):
+        records = [
+            {"timestamp": "2021-01-01T00:00:00", "mgDl": 100},
+            {"timestamp": "2021-01-01T05:00:00", "mgDl": 100},
+            # interpolated from the previous record, after the gap
+            {"timestamp": "2021-01-01T05:10:00", "mgDl": 200},
+        ]
+        hba1c = _calculate_hba1c(records)  # type: ignore
+        avg = (100 + 100 + sum(100 + 10 * i for i in range(1, 11))) / 12
+        assert hba1c is not None
+        assert abs(hba1c - (avg + 46.7) / 28.7) < 0.00001
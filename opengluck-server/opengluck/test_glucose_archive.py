@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records, _key,
+                      archive_glucose_records, find_glucose_records,
+                      get_latest_glucose_records, record_glucose_records)
+from .glucose_archive import iter_glucose_readings
+from .login import assert_get_current_request_redis_client
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+_start = datetime(2023, 1, 1, 12, 0, 0, tzinfo=tz)
+
+
+def _record_days(nb_days: int) -> None:
+    record_glucose_records(
+        GlucoseRecordType.historic,
+        [
+            (_start + timedelta(minutes=5 * i), 70 + i % 150)
+            for i in range(nb_days * 288)
+        ],
+    )
+
+
+def test_archive_glucose_records():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        _record_days(10)
+        redis_client = assert_get_current_request_redis_client()
+        key = _key(GlucoseRecordType.historic)
+        range_end = _start + timedelta(days=10)
+        before = find_glucose_records(GlucoseRecordType.historic, _start, range_end)
+        latest = get_latest_glucose_records(GlucoseRecordType.historic, last_n=500)
+        assert len(before) == 10 * 288
+
+        archived, done = archive_glucose_records(
+            redis_client, before=_start + timedelta(days=7)
+        )
+        assert done
+        assert archived > 6 * 288
+        assert redis_client.zcard(key) == 10 * 288 - archived
+        assert find_glucose_records(GlucoseRecordType.historic, _start, range_end) == (
+            before
+        )
+        # a range starting in an archived day, just after a record
+        assert (
+            find_glucose_records(
+                GlucoseRecordType.historic,
+                _start + timedelta(days=2, minutes=1),
+                _start + timedelta(days=3),
+            )
+            == before[577:865]
+        )
+        assert (
+            get_latest_glucose_records(GlucoseRecordType.historic, last_n=500) == latest
+        )
+        # read by pages
+        assert [
+            ts
+            for ts, _ in iter_glucose_readings(
+                redis_client,
+                key=key,
+                min_ts=_start.timestamp(),
+                max_ts=range_end.timestamp(),
+                page_days=1,
+            )
+        ] == [
+            datetime.fromisoformat(record["timestamp"]).timestamp() for record in before
+        ]
+        # archiving again does nothing
+        assert archive_glucose_records(
+            redis_client, before=_start + timedelta(days=7)
+        ) == (0, True)
+
+        # get the last records when all of them are archived
+        assert archive_glucose_records(
+            redis_client, before=_start + timedelta(days=12)
+        ) == (10 * 288 - archived, True)
+        assert redis_client.zcard(key) == 0
+        assert (
+            get_latest_glucose_records(GlucoseRecordType.historic, last_n=500) == latest
+        )
+
+
+def test_archived_glucose_records_can_change():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        _record_days(3)
+        redis_client = assert_get_current_request_redis_client()
+        archive_glucose_records(redis_client, before=_start + timedelta(days=5))
+
+        # uploading the same records again does not change anything
+        _record_days(3)
+        assert redis_client.zcard(_key(GlucoseRecordType.historic)) == 0
+
+        # changed records take precedence over archived ones
+        record_glucose_records(GlucoseRecordType.historic, [(_start, 42)])
+        records = find_glucose_records(
+            GlucoseRecordType.historic, _start, _start + timedelta(minutes=5)
+        )
+        assert [record["mgDl"] for record in records] == [42, 71]
+
+        # and are archived again
+        assert archive_glucose_records(redis_client, before=_start + timedelta(days=5))[
+            0
+        ]
+        assert redis_client.zcard(_key(GlucoseRecordType.historic)) == 0
+        assert (
+            find_glucose_records(
+                GlucoseRecordType.historic, _start, _start + timedelta(minutes=5)
+            )
+            == records
+        )
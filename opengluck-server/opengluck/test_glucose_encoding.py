@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records, _key,
+                      find_glucose_records, migrate_glucose_records_encoding)
+from .glucose_encoding import (decode_glucose_member, decode_glucose_members,
+                               encode_glucose_member, is_encoded_glucose_member)
+from .login import assert_get_current_request_redis_client
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def test_encode_glucose_member():
+    ts = datetime(2023, 4, 22, 14, 0, 0, 123456, tzinfo=tz).timestamp()
+    member = encode_glucose_member(ts, 123)
+    assert is_encoded_glucose_member(member)
+    assert len(member) == 11
+    assert decode_glucose_member(member) == (ts, 123)
+
+
+def test_encode_glucose_member_falls_back_to_json():
+    member = encode_glucose_member(1682164800.0, 123.5)
+    assert not is_encoded_glucose_member(member)
+    assert json.loads(member) == {"ts": "1682164800.0", "mgDl": 123.5}
+    assert decode_glucose_member(member) == (1682164800.0, 123.5)
+
+
+def test_decode_glucose_members():
+    members = [encode_glucose_member(1682164800.0 + i * 300, 100 + i) for i in range(3)]
+    expected = [(1682164800.0 + i * 300, 100 + i) for i in range(3)]
+    assert decode_glucose_members(members) == expected
+    # legacy JSON members are decoded as well
+    members[1] = json.dumps({"ts": str(expected[1][0]), "mgDl": 101}).encode()
+    assert decode_glucose_members(members) == expected
+
+
+def test_migrate_glucose_records_encoding():
+    start = datetime(2023, 4, 22, 14, 0, 0, tzinfo=tz)
+    readings = [(start + timedelta(minutes=5 * i), 100 + i) for i in range(25)]
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        redis_client = assert_get_current_request_redis_client()
+        key = _key(GlucoseRecordType.historic)
+        redis_client.zadd(
+            key,
+            {
+                json.dumps({"ts": str(ts.timestamp()), "mgDl": mgDl}): ts.timestamp()
+                for ts, mgDl in readings
+            },
+        )
+        before = find_glucose_records(
+            GlucoseRecordType.historic, start, start + timedelta(days=1)
+        )
+        assert len(before) == 25
+
+        assert migrate_glucose_records_encoding(redis_client, chunk_size=10) == 25
+        assert all(
+            is_encoded_glucose_member(member)
+            for member in redis_client.zrange(key, 0, -1)
+        )
+        after = find_glucose_records(
+            GlucoseRecordType.historic, start, start + timedelta(days=1)
+        )
+        assert after == before
+        assert migrate_glucose_records_encoding(redis_client) == 0
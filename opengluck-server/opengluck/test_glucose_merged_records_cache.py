@@ -0,0 +1,87 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+from .cgm import do_we_have_realtime_cgm_data
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      _get_merged_glucose_records_impl, _key_merged,
+                      _merged_field, get_merged_glucose_records,
+                      record_glucose_data, record_glucose_records)
+from .login import assert_get_current_request_redis_client
+from .revision_cache import get_revision_cached
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+_start = datetime(2023, 4, 22, 14, 0, 0, tzinfo=tz)
+_historic = [(_start + timedelta(minutes=5 * i), 100 + i) for i in range(4)]
+_scan = [(_start + timedelta(minutes=i), 150 + i) for i in range(0, 40, 3)]
+
+
+def _get_cached():
+    redis_client = assert_get_current_request_redis_client()
+    _, cached = get_revision_cached(
+        redis_client, _key_merged, _merged_field(288, do_we_have_realtime_cgm_data())
+    )
+    return None if cached is None else json.loads(cached)
+
+
+def test_merged_records_cached_when_recording_records():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        for timestamp, mgDl in _historic + _scan:
+            record_glucose_data(
+                GlucoseRecordType.historic
+                if (timestamp, mgDl) in _historic
+                else GlucoseRecordType.scan,
+                timestamp,
+                mgDl,
+                trigger_episode_changes=False,
+            )
+        one_at_a_time = get_merged_glucose_records()
+
+        _clear_all_glucose_records()
+        record_glucose_records(GlucoseRecordType.historic, _historic)
+        record_glucose_records(GlucoseRecordType.scan, _scan)
+        cached = _get_cached()
+        assert cached is not None
+        assert cached == one_at_a_time
+        assert get_merged_glucose_records() == cached
+
+
+def test_merged_records_cache_discarded_on_new_revision():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        record_glucose_records(GlucoseRecordType.historic, _historic)
+        records = get_merged_glucose_records()
+        assert _get_cached() == records
+
+        redis_client = assert_get_current_request_redis_client()
+        redis_client.incr("revision")
+        assert _get_cached() is None
+        assert get_merged_glucose_records() == _get_merged_glucose_records_impl()
+        assert _get_cached() == records
+
+
+def test_merged_records_cached_same_as_merged_again():
+    rnd = random.Random(4)
+    with app.test_request_context(headers=_headers):
+        for _ in range(30):
+            _clear_all_glucose_records()
+            # mixed uploads of historic and scan records, one or many at a time
+            for step in range(rnd.randint(1, 8)):
+                record_type = rnd.choice(list(GlucoseRecordType))
+                minutes = sorted(rnd.sample(range(60), rnd.randint(1, 10)))
+                if record_type == GlucoseRecordType.historic:
+                    minutes = sorted({minute // 5 * 5 for minute in minutes})
+                record_glucose_records(
+                    record_type,
+                    [
+                        (_start + timedelta(minutes=minute), rnd.randint(50, 250))
+                        for minute in minutes
+                    ],
+                )
+                cached = _get_cached()
+                if cached is not None:
+                    assert cached == _get_merged_glucose_records_impl()
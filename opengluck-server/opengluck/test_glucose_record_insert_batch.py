@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      _get_merged_glucose_records_impl, _key_last_used_scan,
+                      record_glucose_data, record_glucose_records)
+from .login import assert_get_current_request_redis_client
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def _random_records(seed: int):
+    rnd = random.Random(seed)
+    start = datetime(2023, 4, 22, 14, 0, 0, tzinfo=tz)
+    historic = [
+        (start + timedelta(minutes=5 * i), rnd.randint(50, 200))
+        for i in range(rnd.randint(0, 6))
+    ]
+    scan = [
+        (start + timedelta(minutes=i), rnd.randint(50, 200))
+        for i in sorted(rnd.sample(range(40), rnd.randint(1, 30)))
+    ]
+    return historic, scan
+
+
+def _get_state():
+    redis_client = assert_get_current_request_redis_client()
+    return redis_client.get(_key_last_used_scan), _get_merged_glucose_records_impl()
+
+
+def test_record_glucose_records_same_as_one_at_a_time():
+    with app.test_request_context(headers=_headers):
+        for seed in range(20):
+            historic, scan = _random_records(seed)
+
+            _clear_all_glucose_records()
+            for timestamp, mgDl in historic:
+                record_glucose_data(
+                    GlucoseRecordType.historic,
+                    timestamp,
+                    mgDl,
+                    trigger_episode_changes=False,
+                )
+            for timestamp, mgDl in scan:
+                record_glucose_data(
+                    GlucoseRecordType.scan,
+                    timestamp,
+                    mgDl,
+                    trigger_episode_changes=False,
+                )
+            one_at_a_time = _get_state()
+
+            _clear_all_glucose_records()
+            record_glucose_records(GlucoseRecordType.historic, historic)
+            record_glucose_records(GlucoseRecordType.scan, scan)
+            assert _get_state() == one_at_a_time
+
+
+def test_record_glucose_records_skips_duplicates():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        historic, _ = _random_records(1)
+        assert record_glucose_records(GlucoseRecordType.historic, historic) == len(
+            historic
+        )
+        assert record_glucose_records(GlucoseRecordType.historic, historic) == 0
+        timestamp, mgDl = historic[-1]
+        assert (
+            record_glucose_records(
+                GlucoseRecordType.historic, historic + [(timestamp, mgDl + 1)]
+            )
+            == 1
+        )
@@ -0,0 +1,54 @@
+import json
+
+import opengluck.http_request_log
+
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def _get_last_requests(test_client):
+    response = test_client.get("/opengluck/last-requests", headers=_headers)
+    assert response.status_code == 200
+    last_requests = json.loads(response.data)
+    # skip the request we just made
+    if last_requests and last_requests[0]["path"] == "/opengluck/last-requests":
+        return last_requests[1:]
+    return last_requests
+
+
+def test_log_request_body_is_capped(monkeypatch):
+    monkeypatch.setattr(opengluck.http_request_log, "_max_body_size", 10)
+    with app.test_client() as test_client:
+        test_client.post("/opengluck/random", data="0123456789abcdef")
+        last_request = _get_last_requests(test_client)[0]
+        assert last_request["method"] == "POST"
+        assert last_request["path"] == "/opengluck/random"
+        assert last_request["body"] == "0123456789… (16 bytes)"
+
+
+def test_log_request_excluded_paths(monkeypatch):
+    monkeypatch.setattr(opengluck.http_request_log, "_exclude_paths", ["/opengluck/r"])
+    with app.test_client() as test_client:
+        test_client.get("/opengluck/ping", headers=_headers)
+        test_client.get("/opengluck/random", headers=_headers)
+        last_request = _get_last_requests(test_client)[0]
+        assert last_request["path"] == "/opengluck/ping"
+
+
+def test_log_request_admin_only(monkeypatch):
+    monkeypatch.setattr(opengluck.http_request_log, "_mode", "admin")
+    with app.test_client() as test_client:
+        test_client.get("/opengluck/ping", headers=_headers)
+        test_client.get("/opengluck/random?not-logged-in")
+        last_request = _get_last_requests(test_client)[0]
+        assert last_request["path"] == "/opengluck/ping"
+
+
+def test_log_request_off(monkeypatch):
+    with app.test_client() as test_client:
+        test_client.get("/opengluck/ping", headers=_headers)
+        monkeypatch.setattr(opengluck.http_request_log, "_mode", "off")
+        test_client.get("/opengluck/random")
+        last_request = _get_last_requests(test_client)[0]
+        assert last_request["path"] == "/opengluck/ping"
@@ -85,3 +85,48 @@ def test_insert_glucose_record():
             },
             "previous": None,
         }
+
+
+def test_upsert_instant_glucose_records():
+    test_clear_all_instant_glucose_records()
+    start = tz.localize(datetime(2023, 8, 1))
+
+    def upload(records):
+        with app.test_client() as test_client:
+            response = test_client.post(
+                "/opengluck/instant-glucose/upload",
+                headers=_headers,
+                json={
+                    "instant-glucose-records": [
+                        {
+                            "timestamp": (
+                                start + timedelta(minutes=minutes)
+                            ).isoformat(),
+                            "mgDl": mgDl,
+                            "model_name": model_name,
+                            "device_id": "device",
+                        }
+                        for minutes, mgDl, model_name in records
+                    ]
+                },
+            )
+            assert response.status_code == 200
+            response = test_client.get(
+                "/opengluck/instant-glucose/last?last_n=10", headers=_headers
+            )
+            return sorted(
+                (record["timestamp"], record["mgDl"], record["model_name"])
+                for record in response.json
+            )
+
+    assert upload([(0, 100, "Libre 2"), (0, 101, "Libre 3"), (1, 110, "Libre 3")]) == [
+        (start.isoformat(), 100, "Libre 2"),
+        (start.isoformat(), 101, "Libre 3"),
+        ((start + timedelta(minutes=1)).isoformat(), 110, "Libre 3"),
+    ]
+    # the record of the same model and device at the same timestamp is replaced
+    assert upload([(0, 120, "Libre 3")]) == [
+        (start.isoformat(), 100, "Libre 2"),
+        (start.isoformat(), 120, "Libre 3"),
+        ((start + timedelta(minutes=1)).isoformat(), 110, "Libre 3"),
+    ]
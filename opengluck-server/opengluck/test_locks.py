@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from . import locks
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      _key_last_used_scan, _key_last_used_scan_ts,
+                      _set_last_used_scan, get_merged_glucose_records,
+                      record_glucose_records)
+from .locks import LockTimeoutError, user_lock
+from .login import assert_get_current_request_redis_client
+from .metrics import get_counter
+from .redis import bump_revision, get_redis_client
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def test_user_lock():
+    redis_client = get_redis_client(db=1)
+    other_redis_client = get_redis_client(db=2)
+    contended = get_counter("locks.test.contended")
+    timeouts = get_counter("locks.test.timeouts")
+    with user_lock(redis_client, "test"):
+        # locks of other users are independent
+        with user_lock(other_redis_client, "test"):
+            pass
+        with pytest.raises(LockTimeoutError):
+            with user_lock(redis_client, "test", wait_timeout=0.1):
+                pass
+    assert get_counter("locks.test.contended") == contended + 1
+    assert get_counter("locks.test.timeouts") == timeouts + 1
+    # the lock is released
+    with user_lock(redis_client, "test", wait_timeout=0):
+        pass
+
+
+def test_upload_while_locked(monkeypatch):
+    monkeypatch.setattr(locks, "_lock_wait_timeout", 0.1)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        with user_lock(redis_client, "upload"):
+            response = app.test_client().post(
+                "/opengluck/upload", headers=_headers, json={"episodes": []}
+            )
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+    response = app.test_client().post(
+        "/opengluck/upload", headers=_headers, json={"episodes": []}
+    )
+    assert response.status_code == 200
+
+
+def test_last_used_scan_only_moves_forward():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        redis_client = assert_get_current_request_redis_client()
+        _set_last_used_scan(redis_client, "2023-04-22T14:10:00+02:00")
+        _set_last_used_scan(redis_client, "2023-04-22T12:05:00+00:00")
+        assert redis_client.get(_key_last_used_scan) == b"2023-04-22T14:10:00+02:00"
+        _set_last_used_scan(redis_client, "2023-04-22T12:15:00+00:00")
+        assert redis_client.get(_key_last_used_scan) == b"2023-04-22T12:15:00+00:00"
+
+
+def test_merged_records_while_locked(monkeypatch):
+    monkeypatch.setattr(locks, "_lock_wait_timeout", 0.1)
+    start = datetime(2023, 4, 22, 14, 0, 0, tzinfo=tz)
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        redis_client = assert_get_current_request_redis_client()
+        record_glucose_records(GlucoseRecordType.historic, [(start, 100)])
+        record_glucose_records(
+            GlucoseRecordType.scan, [(start + timedelta(minutes=10), 120)]
+        )
+        redis_client.delete(_key_last_used_scan, _key_last_used_scan_ts)
+        bump_revision(redis_client)
+        with user_lock(redis_client, "merged-glucose-records"):
+            # records are merged anyway, without moving the last used scan
+            assert len(get_merged_glucose_records()) == 2
+            assert redis_client.get(_key_last_used_scan) is None
+            with pytest.raises(LockTimeoutError):
+                record_glucose_records(
+                    GlucoseRecordType.scan, [(start + timedelta(minutes=20), 130)]
+                )
+        get_merged_glucose_records()
+        assert redis_client.get(_key_last_used_scan) is not None
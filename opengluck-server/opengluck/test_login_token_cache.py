@@ -0,0 +1,49 @@
+import uuid
+
+import opengluck.login
+
+from .login import (create_account, delete_account, get_token,
+                    get_token_principal)
+from .server import app
+
+
+def _create_account():
+    login = f"test-{uuid.uuid4().hex}"
+    password = uuid.uuid4().hex
+    create_account(login, password)
+    return login, get_token(login, password)
+
+
+def test_token_resolved_once_per_request():
+    login, token = _create_account()
+    try:
+        with app.test_request_context(headers={"Authorization": f"Bearer {token}"}):
+            principal = get_token_principal(token)
+            assert principal["login"] == login
+            assert principal["scope"] == "admin"
+            assert principal["user"] is not None
+            assert get_token_principal(token) is principal
+        with app.test_request_context():
+            assert get_token_principal(token) is not principal
+    finally:
+        delete_account(login)
+
+
+def test_token_cache_invalidated_on_disabled_account(monkeypatch):
+    monkeypatch.setattr(opengluck.login, "_token_cache_ttl", 60)
+    login, token = _create_account()
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        client = app.test_client()
+        assert client.get("/opengluck/ping", headers=headers).status_code == 200
+        assert token in opengluck.login._token_cache
+
+        response = client.post(
+            "/opengluck/disable-account", json={"login": login}, headers=headers
+        )
+        assert response.status_code == 200
+        assert token not in opengluck.login._token_cache
+        assert client.get("/opengluck/ping", headers=headers).status_code == 401
+    finally:
+        delete_account(login)
+    assert token not in opengluck.login._token_cache
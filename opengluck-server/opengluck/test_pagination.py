@@ -0,0 +1,106 @@
+import json
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      archive_glucose_records, record_glucose_records)
+from .instant_glucose import (_clear_all_instant_glucose_records,
+                              insert_instant_glucose_records)
+from .login import assert_get_current_request_redis_client
+from .pagination import next_cursor_header
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+_start = tz.localize(datetime(2023, 7, 1))
+_end = _start + timedelta(days=1)
+
+
+def _get_pages(path: str, **query_string):
+    client = app.test_client()
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(
+            path,
+            query_string={
+                "from": _start.isoformat(),
+                "to": _end.isoformat(),
+                **query_string,
+                **({"cursor": cursor} if cursor else {}),
+            },
+            headers=_headers,
+        )
+        assert response.status_code == 200
+        pages.append(json.loads(response.data))
+        cursor = response.headers.get(next_cursor_header)
+        if cursor is None:
+            return pages
+
+
+def test_glucose_find_pages():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [(_start + timedelta(minutes=5 * i), 100 + i) for i in range(100)],
+        )
+        # pages are read from archived readings as well
+        redis_client = assert_get_current_request_redis_client()
+        assert archive_glucose_records(
+            redis_client, before=_start + timedelta(minutes=5 * 30)
+        )[0]
+    (legacy,) = _get_pages("/opengluck/glucose/find")
+    assert len(legacy) == 100
+
+    pages = _get_pages("/opengluck/glucose/find", limit=30)
+    assert [len(page) for page in pages] == [30, 30, 30, 10]
+    assert [record for page in pages for record in page] == legacy
+
+    pages = _get_pages("/opengluck/glucose/find", limit=50, fields="mgDl")
+    assert [len(page) for page in pages] == [50, 50]
+    assert pages[1][0] == {"mgDl": 150}
+
+
+def test_instant_glucose_find_pages():
+    with app.test_request_context(headers=_headers):
+        _clear_all_instant_glucose_records()
+        # several records share the same timestamp
+        insert_instant_glucose_records(
+            [
+                {
+                    "timestamp": (_start + timedelta(minutes=i // 3)).isoformat(),
+                    "mgDl": 100 + i,
+                    "model_name": "Model",
+                    "device_id": f"device-{i % 3}",
+                }
+                for i in range(20)
+            ]
+        )
+    (legacy,) = _get_pages("/opengluck/instant-glucose/find")
+    assert len(legacy) == 20
+
+    pages = _get_pages("/opengluck/instant-glucose/find", limit=4)
+    assert [len(page) for page in pages] == [4] * 5
+    assert [record for page in pages for record in page] == legacy
+
+    pages = _get_pages(
+        "/opengluck/instant-glucose/find", limit=7, fields="timestamp,device_id"
+    )
+    assert [len(page) for page in pages] == [7, 7, 6]
+    assert set(pages[0][0]) == {"timestamp", "device_id"}
+
+
+def test_invalid_page_args():
+    client = app.test_client()
+    for query_string in ({"limit": 0}, {"cursor": "nope"}, {"fields": "unknown"}):
+        response = client.get(
+            "/opengluck/glucose/find",
+            query_string={
+                "from": _start.isoformat(),
+                "to": _end.isoformat(),
+                **query_string,
+            },
+            headers=_headers,
+        )
+        assert response.status_code == 400
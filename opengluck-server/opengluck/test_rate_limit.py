@@ -0,0 +1,65 @@
+import time
+
+import opengluck.server
+
+from .redis import get_redis_client
+from .server import app, limiter
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def test_polling_routes_have_their_own_limits(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(opengluck.server, "_rate_limit_default", "100 per minute")
+    monkeypatch.setattr(opengluck.server, "_rate_limit_polling", "2 per minute")
+    limiter.reset()
+    try:
+        with app.test_client() as test_client:
+            for _ in range(2):
+                response = test_client.get("/opengluck/revision", headers=_headers)
+                assert response.status_code == 200
+            response = test_client.get("/opengluck/revision", headers=_headers)
+            assert response.status_code == 429
+            # each limit is a pair of counters, whatever its size
+            redis_client_zero = get_redis_client(db=0)
+            keys = list(redis_client_zero.scan_iter("LIMITS:*rate-limit/*"))
+            assert keys
+            assert {redis_client_zero.type(key) for key in keys} == {b"string"}
+
+            # other routes use the default limits
+            response = test_client.get("/opengluck/random", headers=_headers)
+            assert response.status_code == 200
+
+            # limits are per authorization
+            response = test_client.get(
+                "/opengluck/revision", headers={"Authorization": "Bearer other"}
+            )
+            assert response.status_code == 401
+    finally:
+        limiter.reset()
+
+
+def test_polling_limits_slide_across_windows(monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(opengluck.server, "_rate_limit_polling", "2 per second")
+    limiter.reset()
+    try:
+        with app.test_client() as test_client:
+
+            def get_revision_status() -> int:
+                return test_client.get(
+                    "/opengluck/revision", headers=_headers
+                ).status_code
+
+            start = time.monotonic()
+            assert get_revision_status() == 200
+            # a burst of three requests across the end of the first window,
+            # which a fixed window would allow
+            time.sleep(0.9)
+            statuses = [get_revision_status()]
+            time.sleep(max(0, start + 1.05 - time.monotonic()))
+            statuses += [get_revision_status(), get_revision_status()]
+            assert statuses[0] == 200
+            assert 429 in statuses
+    finally:
+        limiter.reset()
@@ -0,0 +1,85 @@
+from .record_store import (find_hash_records, get_latest_hash_records,
+                           iter_hash_records)
+from .redis import get_redis_client
+
+_key_set = "test:record_store:set"
+_key_hash = "test:record_store:hash"
+
+
+def _fill(nb_records: int):
+    redis_client = get_redis_client(db=1)
+    redis_client.delete(_key_set, _key_hash)
+    redis_client.zadd(_key_set, {f"id-{i}": i for i in range(nb_records)})
+    redis_client.hset(
+        _key_hash, mapping={f"id-{i}": f"value-{i}" for i in range(nb_records)}
+    )
+    return redis_client
+
+
+def test_get_latest_hash_records():
+    redis_client = _fill(2500)
+    assert get_latest_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, last_n=3
+    ) == [b"value-2497", b"value-2498", b"value-2499"]
+    values = get_latest_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, last_n=2200
+    )
+    assert values == [f"value-{i}".encode() for i in range(300, 2500)]
+
+
+def test_find_hash_records():
+    redis_client = _fill(2500)
+    values = find_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, from_ts=10, to_ts=1500
+    )
+    assert values == [f"value-{i}".encode() for i in range(10, 1501)]
+    assert (
+        find_hash_records(
+            redis_client,
+            key_set=_key_set,
+            key_hash=_key_hash,
+            from_ts=3000,
+            to_ts=4000,
+        )
+        == []
+    )
+
+
+def test_find_hash_records_missing_value():
+    redis_client = _fill(3)
+    redis_client.hdel(_key_hash, "id-1")
+    assert find_hash_records(
+        redis_client, key_set=_key_set, key_hash=_key_hash, from_ts=0, to_ts=2
+    ) == [b"value-0", None, b"value-2"]
+    redis_client.delete(_key_set, _key_hash)
+
+
+def test_iter_hash_records():
+    redis_client = _fill(2500)
+    # records with the same score, across pages
+    redis_client.zadd(_key_set, {f"id-{i}": 1000 for i in range(1000, 1010)})
+    values = list(
+        iter_hash_records(
+            redis_client,
+            key_set=_key_set,
+            key_hash=_key_hash,
+            from_ts=10,
+            to_ts=1500,
+            page_size=4,
+        )
+    )
+    assert sorted(values) == sorted(f"value-{i}".encode() for i in range(10, 1501))
+    assert len(values) == len(set(values))
+    values = list(
+        iter_hash_records(
+            redis_client,
+            key_set=_key_set,
+            key_hash=_key_hash,
+            from_ts=10,
+            to_ts=1500,
+            page_size=3,
+            desc=True,
+        )
+    )
+    assert values[:2] == [b"value-1500", b"value-1499"]
+    assert sorted(values) == sorted(f"value-{i}".encode() for i in range(10, 1501))
@@ -0,0 +1,21 @@
+from . import redis as opengluck_redis
+from .redis import get_redis_client
+
+
+def test_get_redis_client_reuses_pool():
+    redis_client = get_redis_client(db=1)
+    assert get_redis_client(db=1).connection_pool is redis_client.connection_pool
+    assert get_redis_client(db=2).connection_pool is not redis_client.connection_pool
+
+
+def test_get_redis_client_evicts_least_recently_used_pools(monkeypatch):
+    monkeypatch.setattr(opengluck_redis, "_max_pools", 3)
+    pool_zero = get_redis_client(db=0).connection_pool
+    pool_one = get_redis_client(db=1).connection_pool
+    for db in range(100, 110):
+        get_redis_client(db=db)
+    assert list(opengluck_redis._pools.keys()) == [0, 108, 109]
+    # db=0 is never evicted, while evicted pools are created again on demand
+    assert get_redis_client(db=0).connection_pool is pool_zero
+    assert get_redis_client(db=1).connection_pool is not pool_one
+    assert get_redis_client(db=1).ping()
@@ -0,0 +1,121 @@
+import time
+from datetime import datetime, timedelta
+
+from .config import tz
+from .login import assert_get_current_request_redis_client
+from .metrics import get_metrics
+from .redis import get_revision
+from .revision_cache import get_revision_cached, set_revision_cached
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def _get_hits():
+    return get_metrics()["counters"].get("response_cache.hits", 0)
+
+
+def _upload(test_client, json):
+    response = test_client.post("/opengluck/upload", headers=_headers, json=json)
+    assert response.status_code == 200
+
+
+def test_current_response_cached_per_revision():
+    with app.test_client() as test_client:
+        test_client.delete("/opengluck/glucose", headers=_headers)
+        test_client.delete("/opengluck/instant-glucose", headers=_headers)
+        now = datetime.now(tz=tz)
+        _upload(
+            test_client,
+            {
+                "glucose-records": [
+                    {
+                        "mgDl": 123,
+                        "type": "scan",
+                        "timestamp": (now - timedelta(minutes=2)).isoformat(),
+                    }
+                ]
+            },
+        )
+
+        response = test_client.get("/opengluck/current", headers=_headers)
+        assert response.json["current_glucose_record"]["mgDl"] == 123
+        hits = _get_hits()
+        cached = test_client.get("/opengluck/current", headers=_headers)
+        assert _get_hits() == hits + 1
+        assert cached.data == response.data
+        assert cached.headers["etag"] == response.headers["etag"]
+
+        # a new revision is a new response
+        _upload(
+            test_client,
+            {
+                "glucose-records": [
+                    {
+                        "mgDl": 145,
+                        "type": "scan",
+                        "timestamp": (now - timedelta(minutes=1)).isoformat(),
+                    }
+                ]
+            },
+        )
+        response = test_client.get("/opengluck/current", headers=_headers)
+        assert response.json["current_glucose_record"]["mgDl"] == 145
+        assert _get_hits() == hits + 1
+
+        # instant glucose records do not bump the revision, but invalidate the
+        # cache
+        response = test_client.post(
+            "/opengluck/instant-glucose/upload",
+            headers=_headers,
+            json={
+                "instant-glucose-records": [
+                    {
+                        "mgDl": 150,
+                        "timestamp": now.isoformat(),
+                        "model_name": "test-model",
+                        "device_id": "test-device",
+                    }
+                ]
+            },
+        )
+        assert response.status_code == 200
+        response = test_client.get("/opengluck/current", headers=_headers)
+        assert response.json["current_instant_glucose_record"]["mgDl"] == 150
+
+
+def test_last_response_cached_per_query():
+    with app.test_client() as test_client:
+        test_client.get("/opengluck/last?last_n_glucose=1", headers=_headers)
+        hits = _get_hits()
+        response = test_client.get("/opengluck/last?last_n_glucose=2", headers=_headers)
+        assert _get_hits() == hits
+        cached = test_client.get("/opengluck/last?last_n_glucose=1", headers=_headers)
+        assert _get_hits() == hits + 1
+        assert cached.data != response.data or cached.json["glucose-records"] == []
+
+
+def test_cached_values_expire_separately():
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        redis_client.delete("test-cache")
+        revision = get_revision(redis_client)
+        assert set_revision_cached(
+            redis_client, "test-cache", "a", "1", revision=revision, ttl=1
+        )
+        time.sleep(0.6)
+        assert set_revision_cached(
+            redis_client, "test-cache", "b", "2", revision=revision, ttl=1
+        )
+        time.sleep(0.6)
+        # setting b renewed the hash, but not a
+        assert get_revision_cached(redis_client, "test-cache", "a")[1] is None
+        assert get_revision_cached(redis_client, "test-cache", "b")[1] == b"2"
+
+        # expired values make room for new ones
+        time.sleep(0.5)
+        assert set_revision_cached(
+            redis_client, "test-cache", "c", "3", revision=revision, ttl=1, max_fields=1
+        )
+        assert get_revision_cached(redis_client, "test-cache", "c")[1] == b"3"
+        redis_client.delete("test-cache")
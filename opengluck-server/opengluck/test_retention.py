@@ -0,0 +1,157 @@
+import json
+from datetime import datetime, timedelta
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records, _key,
+                      aggregate_glucose_records, archive_glucose_records,
+                      find_glucose_records, record_glucose_records)
+from .instant_glucose import (_clear_all_instant_glucose_records,
+                              find_instant_glucose_records,
+                              record_instant_glucose_records)
+from .login import assert_get_current_request_redis_client
+from .redis import get_redis_client
+from .retention import (RetentionPolicy, apply_retention, get_retention_metrics,
+                        run_retention)
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+# the user and database of test_run_retention
+_run_login = "test-retention"
+_run_db = 15
+
+_start = tz.localize(datetime(2023, 9, 1))
+_now = _start + timedelta(days=10)
+
+_policy = RetentionPolicy(
+    glucose_archive_after_days=0,
+    scan_glucose_retention_days=5,
+    instant_glucose_downsample_after_days=3,
+    instant_glucose_retention_days=5,
+    max_days_per_run=2,
+)
+
+
+def test_apply_retention():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        _clear_all_instant_glucose_records()
+        redis_client = assert_get_current_request_redis_client()
+        redis_client.delete("retention")
+        record_glucose_records(
+            GlucoseRecordType.scan,
+            [(_start + timedelta(minutes=5 * i), 100) for i in range(10 * 288)],
+        )
+        archive_glucose_records(redis_client, before=_start + timedelta(days=2))
+        record_instant_glucose_records(
+            [
+                (_start + timedelta(minutes=i), 100, "Model", "device")
+                for i in range(10 * 24 * 60)
+            ]
+        )
+
+        # the first run only processes two days of each key
+        result = apply_retention(redis_client, now=_now, policy=_policy)
+        assert result["pending"]
+        assert result["reclaimed_bytes"] > 0
+        while result["pending"]:
+            result = apply_retention(redis_client, now=_now, policy=_policy)
+
+        records = find_glucose_records(
+            GlucoseRecordType.scan, _start, _now + timedelta(days=1)
+        )
+        # records of the days over before the cutoff are deleted
+        first = datetime.fromisoformat(records[0]["timestamp"])
+        assert _now - timedelta(days=6) < first <= _now - timedelta(days=5)
+        assert (
+            aggregate_glucose_records(
+                GlucoseRecordType.scan, _start, first - timedelta(seconds=1)
+            )
+            is None
+        )
+        aggregate = aggregate_glucose_records(GlucoseRecordType.scan, first, _now)
+        assert aggregate is not None and aggregate["sum"] == 100 * aggregate["count"]
+
+        instant_records = find_instant_glucose_records(_start, _now)
+        assert instant_records[0]["timestamp"] == (_now - timedelta(days=5)).isoformat()
+        # downsampled to one record every 5 minutes, after 3 days
+        cutoff = (_now - timedelta(days=3)).isoformat()
+        assert (
+            len([record for record in instant_records if record["timestamp"] < cutoff])
+            == 2 * 24 * 12
+        )
+        assert (
+            len([record for record in instant_records if record["timestamp"] >= cutoff])
+            == 3 * 24 * 60
+        )
+
+        # nothing is left to do
+        result = apply_retention(redis_client, now=_now, policy=_policy)
+        assert result["deleted"] == result["downsampled"] == 0
+        assert not result["pending"]
+
+
+def test_apply_retention_archives_a_few_days_per_run():
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        _clear_all_instant_glucose_records()
+        redis_client = assert_get_current_request_redis_client()
+        redis_client.delete("retention")
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [(_start + timedelta(minutes=5 * i), 100) for i in range(10 * 288)],
+        )
+        policy = RetentionPolicy(
+            glucose_archive_after_days=1,
+            scan_glucose_retention_days=0,
+            instant_glucose_downsample_after_days=0,
+            instant_glucose_retention_days=0,
+            max_days_per_run=2,
+        )
+
+        # the first run only archives two days
+        result = apply_retention(redis_client, now=_now, policy=policy)
+        assert 0 < result["archived"] <= 2 * 288
+        assert result["pending"]
+        archived = result["archived"]
+        runs = 1
+        while result["pending"]:
+            result = apply_retention(redis_client, now=_now, policy=policy)
+            archived += result["archived"]
+            runs += 1
+        # the nine (UTC) days over before the cutoff are archived
+        assert runs == 5
+        assert redis_client.zcard(_key(GlucoseRecordType.historic)) == (
+            10 * 288 - archived
+        )
+        assert 288 <= 10 * 288 - archived < 2 * 288
+        assert (
+            len(
+                find_glucose_records(
+                    GlucoseRecordType.historic, _start, _now + timedelta(days=1)
+                )
+            )
+            == 10 * 288
+        )
+
+
+def test_run_retention():
+    # a dedicated user, so that the records of other tests are left alone
+    redis_client_zero = get_redis_client(db=0)
+    redis_client = get_redis_client(db=_run_db)
+    redis_client_zero.hset("users", _run_login, json.dumps({"db": _run_db}))
+    try:
+        status = run_retention(now=_now, logins=[_run_login], policy=_policy)
+        assert status is not None
+        assert status["users"] == 1
+        assert (
+            redis_client.hget("retention", "last-run-at") == _now.isoformat().encode()
+        )
+        # the lock is released after a run
+        assert run_retention(now=_now, logins=[_run_login], policy=_policy) is not None
+        metrics = get_retention_metrics()
+        assert metrics["last_run"]["users"] == 1
+        assert metrics["used_memory"] > 0
+    finally:
+        redis_client_zero.hdel("users", _run_login)
+        redis_client.flushdb()
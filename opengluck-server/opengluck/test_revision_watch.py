@@ -0,0 +1,93 @@
+import time
+from threading import Thread
+
+import pytest
+
+import opengluck.server
+
+from .login import assert_get_current_request_redis_client
+from .redis import bump_revision, get_revision
+from .server import app
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+@pytest.fixture(autouse=True)
+def _gthread_workers(monkeypatch):
+    monkeypatch.setattr(opengluck.server, "_server_worker_class", "gthread")
+
+
+def _get_revision():
+    with app.test_request_context(headers=_headers):
+        return get_revision(assert_get_current_request_redis_client())
+
+
+def _bump_revision_later():
+    time.sleep(0.2)
+    with app.test_request_context(headers=_headers):
+        bump_revision(assert_get_current_request_redis_client())
+
+
+def test_watch_revision_returns_when_revision_changes():
+    revision = _get_revision()
+    thread = Thread(target=_bump_revision_later)
+    thread.start()
+    with app.test_client() as test_client:
+        start = time.monotonic()
+        response = test_client.get(
+            f"/opengluck/revision/watch?revision={revision}&timeout=10",
+            headers=_headers,
+        )
+        assert time.monotonic() - start < 5
+    thread.join()
+    assert response.status_code == 200
+    assert response.json["revision"] == revision + 1
+
+
+def test_watch_revision_returns_right_away_when_outdated():
+    revision = _get_revision()
+    with app.test_client() as test_client:
+        response = test_client.get(
+            f"/opengluck/revision/watch?revision={revision - 1}&timeout=10",
+            headers=_headers,
+        )
+    assert response.status_code == 200
+    assert response.json["revision"] == revision
+
+
+def test_watch_revision_times_out():
+    revision = _get_revision()
+    with app.test_client() as test_client:
+        start = time.monotonic()
+        response = test_client.get(
+            f"/opengluck/revision/watch?revision={revision}&timeout=0.3",
+            headers=_headers,
+        )
+        assert time.monotonic() - start >= 0.3
+    assert response.status_code == 200
+    assert response.json["revision"] == revision
+
+
+def test_watch_revision_timeout_is_clamped(monkeypatch):
+    monkeypatch.setattr(opengluck.server, "_server_timeout", 0.6)
+    revision = _get_revision()
+    with app.test_client() as test_client:
+        start = time.monotonic()
+        response = test_client.get(
+            f"/opengluck/revision/watch?revision={revision}&timeout=10",
+            headers=_headers,
+        )
+        # watches wait at most half of the server timeout
+        assert 0.3 <= time.monotonic() - start < 0.6
+    assert response.status_code == 200
+
+    # sync workers would be blocked, so clients are told to poll instead
+    monkeypatch.setattr(opengluck.server, "_server_worker_class", "sync")
+    with app.test_client() as test_client:
+        start = time.monotonic()
+        response = test_client.get(
+            f"/opengluck/revision/watch?revision={revision}&timeout=10",
+            headers=_headers,
+        )
+        assert time.monotonic() - start < 0.3
+    assert response.status_code == 501
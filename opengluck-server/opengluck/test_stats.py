@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .config import tz
+from .glucose import (GlucoseRecordType, _clear_all_glucose_records,
+                      record_glucose_records)
+from .server import app
+from .stats import compute_glucose_stats, interpolate_glucose_values
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+
+def test_interpolate_glucose_values():
+    timestamps = np.array([0, 300, 600, 10000, 20000, 20120], dtype=np.float64)
+    values = np.array([60, 80, 80, 150, 200, 100], dtype=np.float64)
+    assert interpolate_glucose_values(timestamps, values).tolist() == [
+        # interpolated every minute
+        *[60 + 4 * i for i in range(6)],
+        *[80] * 5,
+        # readings that are too far apart are not interpolated
+        150,
+        200,
+        150,
+        100,
+    ]
+
+
+def test_compute_glucose_stats():
+    timestamps = np.array([0, 300], dtype=np.float64)
+    values = np.array([60, 80], dtype=np.float64)
+    stats = compute_glucose_stats(timestamps, values, low=70, high=75)
+    assert stats["count"] == 2
+    assert stats["minutes"] == 6
+    assert stats["mean"] == 70
+    assert stats["min"] == 60
+    assert stats["max"] == 80
+    assert stats["time_below_range"] == 50
+    assert abs((stats["time_in_range"] or 0) - 100 / 6) < 0.00001
+    assert abs((stats["time_above_range"] or 0) - 200 / 6) < 0.00001
+
+    stats = compute_glucose_stats(np.empty(0), np.empty(0), low=70, high=180)
+    assert stats["count"] == 0
+    assert stats["mean"] is None
+
+
+def test_stats_route():
+    start = datetime(2023, 5, 1, tzinfo=tz)
+    with app.test_request_context(headers=_headers):
+        _clear_all_glucose_records()
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [(start + timedelta(minutes=5 * i), 100) for i in range(288)],
+        )
+    client = app.test_client()
+    response = client.get(
+        "/opengluck/stats",
+        query_string={
+            "from": start.isoformat(),
+            "to": (start + timedelta(days=1)).isoformat(),
+        },
+        headers=_headers,
+    )
+    assert response.status_code == 200
+    stats = json.loads(response.data)
+    assert stats["count"] == 288
+    assert stats["mean"] == 100
+    assert stats["sd"] == 0
+    assert stats["cv"] == 0
+    assert abs(stats["gmi"] - 5.702) < 0.00001
+    assert stats["time_in_range"] == 100
+    assert stats["low"] == 70 and stats["high"] == 180
+
+
+def test_stats_route_invalid_args():
+    start = datetime(2023, 5, 1, tzinfo=tz)
+    client = app.test_client()
+    for query_string in (
+        {"type": "unknown"},
+        {"low": "nope"},
+        {"high": "nope"},
+        {"from": "nope"},
+    ):
+        response = client.get(
+            "/opengluck/stats",
+            query_string={
+                "from": start.isoformat(),
+                "to": (start + timedelta(days=1)).isoformat(),
+                **query_string,
+            },
+            headers=_headers,
+        )
+        assert response.status_code == 400
@@ -0,0 +1,79 @@
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from .webhook_dispatcher import WebhookDispatcher
+
+
+class _Server:
+    def __init__(self, *, statuses=None, delay=0):
+        self.bodies = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        lock = Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                with lock:
+                    server.concurrent += 1
+                    server.max_concurrent = max(
+                        server.max_concurrent, server.concurrent
+                    )
+                time.sleep(delay)
+                body = self.rfile.read(int(self.headers["content-length"]))
+                with lock:
+                    server.concurrent -= 1
+                    server.bodies.append(body.decode("utf-8"))
+                    status = statuses.pop(0) if statuses else 200
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/"
+        Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+
+
+def test_dispatcher_retries_failed_deliveries():
+    server = _Server(statuses=[503, 500])
+    try:
+        dispatcher = WebhookDispatcher(workers=2, retry_backoff=0.01)
+        assert dispatcher.dispatch({"url": server.url, "body": "1", "headers": {}})
+        assert dispatcher.wait_until_idle(5)
+        assert server.bodies == ["1", "1", "1"]
+    finally:
+        server.close()
+
+
+def test_dispatcher_limits_concurrent_deliveries_per_url():
+    server = _Server(delay=0.05)
+    try:
+        dispatcher = WebhookDispatcher(workers=8, max_per_url=2)
+        for i in range(10):
+            dispatcher.dispatch({"url": server.url, "body": f"{i}", "headers": {}})
+        assert dispatcher.wait_until_idle(5)
+        assert sorted(server.bodies, key=int) == [f"{i}" for i in range(10)]
+        assert server.max_concurrent == 2
+    finally:
+        server.close()
+
+
+def test_dispatcher_drops_deliveries_when_full():
+    server = _Server(delay=0.2)
+    try:
+        dispatcher = WebhookDispatcher(workers=1, queue_size=2)
+        dispatched = [
+            dispatcher.dispatch({"url": server.url, "body": f"{i}", "headers": {}})
+            for i in range(5)
+        ]
+        assert dispatched.count(False) >= 2
+        assert dispatcher.wait_until_idle(5)
+        assert len(server.bodies) == dispatched.count(True)
+    finally:
+        server.close()
@@ -0,0 +1,101 @@
+import json
+
+import opengluck.last
+
+from .login import assert_get_current_request_redis_client
+from .server import app
+from .webhooks import (_ensure_subscribed_webhooks_index, _key_index,
+                       call_webhooks)
+
+_headers = {"Authorization": "Bearer dev-token"}
+
+# nothing listens there, calls fail right away
+_url = "http://127.0.0.1:9/"
+
+
+def _count_get_last(monkeypatch):
+    calls = []
+    get_last = opengluck.last.get_last
+
+    def _get_last(**kwargs):
+        calls.append(kwargs)
+        return get_last(**kwargs)
+
+    monkeypatch.setattr(opengluck.last, "get_last", _get_last)
+    return calls
+
+
+def test_subscribed_webhooks_index():
+    client = app.test_client()
+    client.delete("/opengluck/webhooks/test:index", headers=_headers)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        assert "test:index" not in _ensure_subscribed_webhooks_index(redis_client)
+
+    client.put("/opengluck/webhooks/test:index", json={"url": _url}, headers=_headers)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        assert "test:index" in _ensure_subscribed_webhooks_index(redis_client)
+        # the index is rebuilt when missing
+        redis_client.delete(_key_index)
+        assert "test:index" in _ensure_subscribed_webhooks_index(redis_client)
+
+    response = client.get("/opengluck/webhooks/test:index", headers=_headers)
+    (webhook,) = json.loads(response.data)
+    client.delete(f"/opengluck/webhooks/test:index/{webhook['id']}", headers=_headers)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        assert "test:index" not in _ensure_subscribed_webhooks_index(redis_client)
+
+
+def test_subscribed_webhooks_index_delete_one():
+    client = app.test_client()
+    client.delete("/opengluck/webhooks/test:index", headers=_headers)
+    for _ in range(2):
+        client.put(
+            "/opengluck/webhooks/test:index", json={"url": _url}, headers=_headers
+        )
+    response = client.get("/opengluck/webhooks/test:index", headers=_headers)
+    first, second = json.loads(response.data)
+
+    # the webhook stays in the index until its last subscriber is deleted
+    client.delete(f"/opengluck/webhooks/test:index/{first['id']}", headers=_headers)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        assert redis_client.sismember(_key_index, "test:index")
+    client.delete(f"/opengluck/webhooks/test:index/{second['id']}", headers=_headers)
+    with app.test_request_context(headers=_headers):
+        redis_client = assert_get_current_request_redis_client()
+        assert not redis_client.sismember(_key_index, "test:index")
+        assert not redis_client.exists("webhooks:test:index")
+
+
+def test_last_not_computed_without_include_last(monkeypatch):
+    calls = _count_get_last(monkeypatch)
+    client = app.test_client()
+    client.delete("/opengluck/webhooks/test:lazy", headers=_headers)
+    with app.test_request_context(headers=_headers):
+        call_webhooks("test:lazy", {"value": 1})
+    client.put("/opengluck/webhooks/test:lazy", json={"url": _url}, headers=_headers)
+    with app.test_request_context(headers=_headers):
+        call_webhooks("test:lazy", {"value": 2})
+    assert calls == []
+    client.delete("/opengluck/webhooks/test:lazy", headers=_headers)
+
+
+def test_last_computed_once_per_request(monkeypatch):
+    calls = _count_get_last(monkeypatch)
+    client = app.test_client()
+    client.delete("/opengluck/webhooks/test:lazy", headers=_headers)
+    client.put(
+        "/opengluck/webhooks/test:lazy",
+        json={"url": _url, "include_last": True, "filter": "value > `1`"},
+        headers=_headers,
+    )
+    with app.test_request_context(headers=_headers):
+        call_webhooks("test:lazy", {"value": 1})
+        assert len(calls) == 0
+        call_webhooks("test:lazy", {"value": 2})
+        call_webhooks("test:lazy", {"value": 3})
+        assert len(calls) == 1
+    client.delete("/opengluck/webhooks/test:lazy", headers=_headers)
@@ -5,7 +5,6 @@ This is required because we don't want partial upload to trigger episodes change
 import json
 import logging
 from datetime import datetime
-from multiprocessing import Lock
 
 from flask import Response, abort, request
 
@@ -21,19 +20,19 @@ from .glucose import (get_current_glucose_record,
                       just_updated_glucose, keep_scan_records_apart_duration,
                       set_current_cgm_device_properties)
 from .insulin import insert_insulin_records
+from .locks import user_lock
 from .login import (assert_current_request_logged_in,
                     assert_get_current_request_redis_client)
 from .low import insert_low_records
 from .redis import get_revision
-from .server import app
-
-_lock = Lock()
+from .server import app, limiter, upload_rate_limit
 
 
 @app.route("/opengluck/upload", methods=["POST"])
+@limiter.limit(upload_rate_limit)
 def _upload_data_data():
     redis_client = assert_get_current_request_redis_client()
-    with _lock:
+    with user_lock(redis_client, "upload"):
         assert_current_request_logged_in()
         body = request.get_json()
         if not body:
@@ -9,6 +9,7 @@ from typing import Any, Optional
 from flask import Response, request
 
 from .login import assert_get_current_request_redis_client
+from .response_cache import queue_invalidate_response_cache
 from .server import app
 from .webhooks import call_webhooks
 
@@ -30,7 +31,10 @@ def _set_userdata(key):
     if key is None or value is None:
         return Response("Missing key or value", status=400)
 
-    redis_client.set(_get_redis_key(key), value)
+    p = redis_client.pipeline()
+    p.set(_get_redis_key(key), value)
+    queue_invalidate_response_cache(p)
+    p.execute()
     content_type = request.headers.get("Content-Type")
     if content_type is not None and content_type.startswith("application/json"):
         call_webhooks("userdata:set", {"key": key, "value": json.loads(value)})
@@ -48,14 +52,20 @@ def _delete_userdata(key):
     if key is None:
         return Response("Missing key or value", status=400)
 
-    redis_client.delete(_get_redis_key(key))
+    p = redis_client.pipeline()
+    p.delete(_get_redis_key(key))
+    queue_invalidate_response_cache(p)
+    p.execute()
     return Response("", status=204)
 
 
 def set_userdata(key: str, value: Any) -> None:
     """Set a value in the userdata."""
     redis_client = assert_get_current_request_redis_client()
-    redis_client.set(_get_redis_key(key), json.dumps(value))
+    p = redis_client.pipeline()
+    p.set(_get_redis_key(key), json.dumps(value))
+    queue_invalidate_response_cache(p)
+    p.execute()
     call_webhooks("userdata:set", {"key": key, "value": value})
 
 
@@ -2,7 +2,8 @@ import json
 
 from flask import Response
 
-from opengluck.login import assert_current_request_is_logged_in_as_admin
+from opengluck.login import (assert_current_request_is_logged_in_as_admin,
+                             invalidate_token_cache)
 
 from .redis import get_redis_client
 from .server import app
@@ -23,4 +24,5 @@ def _list_users():
 def _delete_user(login):
     assert_current_request_is_logged_in_as_admin()
     _redis_client_zero.hdel("users", login)
+    invalidate_token_cache(login)
     return Response(status=204)
@@ -0,0 +1,259 @@
+"""Deliver webhooks in the background.
+
+Webhook calls are queued on a bounded queue, and delivered by a fixed pool of
+worker threads, so that handling a request does not depend on the number of
+webhooks to call, or on how fast they answer. Failed deliveries are retried
+with an exponential backoff, and we never run more than a few concurrent
+deliveries to the same URL.
+"""
+import atexit
+import logging
+import os
+import time
+from threading import Condition, Thread
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from .metrics import incr_metric, observe_metric, register_gauge
+
+_WEBHOOK_TIMEOUT = 2
+
+_workers = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+_queue_size = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+_max_per_url = int(os.environ.get("WEBHOOK_MAX_PER_URL", "2"))
+_max_retries = int(os.environ.get("WEBHOOK_RETRIES", "3"))
+_retry_backoff = float(os.environ.get("WEBHOOK_RETRY_BACKOFF", "1"))
+
+_retry_status_codes = {429, 500, 502, 503, 504}
+
+
+class Delivery(TypedDict):
+    """A webhook call to deliver."""
+
+    url: str
+    body: str
+    headers: Dict[str, str]
+
+
+class _QueuedDelivery(TypedDict):
+    delivery: Delivery
+    attempt: int
+    queued_at: float
+
+
+class WebhookDispatcher:
+    """A bounded queue of webhook calls, delivered by a pool of threads."""
+
+    def __init__(
+        self,
+        *,
+        workers: int = _workers,
+        queue_size: int = _queue_size,
+        max_per_url: int = _max_per_url,
+        max_retries: int = _max_retries,
+        retry_backoff: float = _retry_backoff,
+    ):
+        """Create a dispatcher, its threads are started on the first call.
+
+        Args:
+            workers: the number of threads delivering webhooks
+            queue_size: the maximum number of deliveries waiting to be
+                delivered, more deliveries are dropped
+            max_per_url: the maximum number of concurrent deliveries to the
+                same URL
+            max_retries: the number of times we retry a failed delivery
+            retry_backoff: the delay before retrying a failed delivery for the
+                first time, it doubles after each attempt
+        """
+        self._nb_workers = max(1, workers)
+        self._queue_size = queue_size
+        self._max_per_url = max(1, max_per_url)
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._condition = Condition()
+        # deliveries waiting to be delivered, with the time they are due
+        self._queue: List[Tuple[float, _QueuedDelivery]] = []
+        self._in_flight: Dict[str, int] = {}
+        self._threads: List[Thread] = []
+        self._pid: Optional[int] = None
+        self._session = requests.Session()
+        adapter = HTTPAdapter(max_retries=Retry(total=0), pool_maxsize=self._nb_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def dispatch(self, delivery: Delivery) -> bool:
+        """Queue a webhook call.
+
+        Returns:
+            whether the call was queued, false if the queue is full
+        """
+        incr_metric("webhooks.dispatched")
+        self._ensure_workers()
+        return self._enqueue(self._queued(delivery), delay=0)
+
+    def deliver(self, delivery: Delivery) -> None:
+        """Deliver a webhook call right away, without retrying it."""
+        incr_metric("webhooks.dispatched")
+        self._deliver(self._queued(delivery), retry=False)
+
+    def _queued(self, delivery: Delivery) -> _QueuedDelivery:
+        return {"delivery": delivery, "attempt": 0, "queued_at": time.monotonic()}
+
+    def get_metrics(self) -> dict:
+        """Get the state of the queue."""
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": sum(self._in_flight.values()),
+                "workers": len(self._threads),
+            }
+
+    def wait_until_idle(self, timeout: float) -> bool:
+        """Wait until all queued webhooks are delivered.
+
+        Returns:
+            whether the queue is idle
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _ensure_workers(self) -> None:
+        with self._condition:
+            # threads do not survive a fork, so we start them in each process
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue.clear()
+            self._in_flight.clear()
+            self._threads = [
+                Thread(target=self._run, name=f"webhooks-{i}", daemon=True)
+                for i in range(self._nb_workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _enqueue(self, queued: _QueuedDelivery, *, delay: float) -> bool:
+        with self._condition:
+            if len(self._queue) >= self._queue_size:
+                incr_metric("webhooks.dropped")
+                logging.warning(
+                    f"Dropping webhook call to {queued['delivery']['url']}, "
+                    "the queue is full"
+                )
+                return False
+            self._queue.append((time.monotonic() + delay, queued))
+            # waiters are idle waiters and workers waiting on other deliveries,
+            # so waking only one of them might not wake any idle worker
+            self._condition.notify_all()
+            return True
+
+    def _next(self) -> _QueuedDelivery:
+        """Wait for the next due delivery to a URL that is not too busy."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                next_index: Optional[int] = None
+                wait: Optional[float] = None
+                for index, (due, queued) in enumerate(self._queue):
+                    if due > now:
+                        wait = due - now if wait is None else min(wait, due - now)
+                        continue
+                    url = queued["delivery"]["url"]
+                    if self._in_flight.get(url, 0) >= self._max_per_url:
+                        continue
+                    if next_index is None or due < self._queue[next_index][0]:
+                        next_index = index
+                if next_index is not None:
+                    _, queued = self._queue.pop(next_index)
+                    url = queued["delivery"]["url"]
+                    self._in_flight[url] = self._in_flight.get(url, 0) + 1
+                    return queued
+                # wait for a delivery to be due, to be queued, or to complete
+                self._condition.wait(wait)
+
+    def _run(self) -> None:
+        while True:
+            queued = self._next()
+            try:
+                self._deliver(queued)
+            except Exception as e:
+                logging.exception(f"Unexpected error delivering webhook: {e}")
+            finally:
+                url = queued["delivery"]["url"]
+                with self._condition:
+                    self._in_flight[url] -= 1
+                    if self._in_flight[url] == 0:
+                        del self._in_flight[url]
+                    self._condition.notify_all()
+
+    def _deliver(self, queued: _QueuedDelivery, *, retry: bool = True) -> None:
+        delivery = queued["delivery"]
+        url = delivery["url"]
+        logging.info(f"Calling webhook {url}")
+        start = time.monotonic()
+        should_retry = False
+        try:
+            resp = self._session.request(
+                "POST",
+                url,
+                data=delivery["body"],
+                headers={"content-type": "application/json", **delivery["headers"]},
+                allow_redirects=False,
+                timeout=_WEBHOOK_TIMEOUT,
+            )
+            if not resp.ok:
+                logging.debug(
+                    f"Calling webhook {url} returned non-200 response: {resp.status_code} {resp.text}"
+                )
+                should_retry = resp.status_code in _retry_status_codes
+        except Exception as e:
+            logging.debug(f"Calling webhook {url} failed: {e}")
+            should_retry = True
+        end = time.monotonic()
+        observe_metric("webhooks.duration", end - start)
+        if not should_retry:
+            incr_metric("webhooks.delivered")
+            observe_metric("webhooks.latency", end - queued["queued_at"])
+            return
+        if not retry or queued["attempt"] >= self._max_retries:
+            incr_metric("webhooks.failed")
+            observe_metric("webhooks.latency", end - queued["queued_at"])
+            return
+        incr_metric("webhooks.retried")
+        self._enqueue(
+            {**queued, "attempt": queued["attempt"] + 1},
+            delay=self._retry_backoff * 2 ** queued["attempt"],
+        )
+
+
+_dispatcher = WebhookDispatcher()
+
+register_gauge("webhooks", _dispatcher.get_metrics)
+
+
+@atexit.register
+def _wait_for_webhooks():
+    # give queued webhooks a chance to be delivered when the process exits
+    _dispatcher.wait_until_idle(_WEBHOOK_TIMEOUT)
+
+
+def dispatch_webhook(delivery: Delivery) -> bool:
+    """Queue a webhook call, to be delivered in the background.
+
+    Returns:
+        whether the call was queued, false if the queue is full
+    """
+    if os.environ.get("PYTEST_CURRENT_TEST"):
+        # when running from pytest, do not use threads so we can retrieve
+        # webhooks synchronously
+        _dispatcher.deliver(delivery)
+        return True
+    return _dispatcher.dispatch(delivery)
@@ -3,22 +3,38 @@ import logging
 import os
 import sys
 from datetime import datetime
-from threading import Thread
-from typing import Any
+from typing import Any, Callable, List, Set
 from uuid import uuid4
 
-import requests
-from flask import Response, request
-from requests.adapters import HTTPAdapter, Retry
+import redis
+from flask import Response, g, request
 
 from .jmespath import do_record_match_filter
 from .login import (assert_current_request_is_logged_in_as_admin,
                     assert_get_current_request_login,
                     assert_get_current_request_redis_client)
+from .redis import get_redis_client, get_revision
 from .server import app
+from .webhook_dispatcher import dispatch_webhook
 
 _MAX_ITEMS = 100
-_WEBHOOK_TIMEOUT = 2
+
+# the names of webhooks with at least one subscriber; the index always has an
+# empty member, so that we know whether it has been built
+_key_index = "webhooks-index"
+_index_built_member = ""
+
+# delete a subscriber of a webhook, and the webhook from the index if it was the
+# last one, so that a subscriber created meanwhile is not left out of the index
+_delete_webhook_id_script = get_redis_client(db=0).register_script(
+    """
+redis.call("HDEL", KEYS[1], ARGV[1])
+if redis.call("HLEN", KEYS[1]) == 0 then
+    redis.call("SREM", KEYS[2], ARGV[2])
+end
+return 1
+"""
+)
 
 if os.getenv("MAX_WEBHOOK_CALLS", ""):
     _MAX_WEBHOOK_CALLS: int = min(
@@ -28,14 +44,6 @@ else:
     _MAX_WEBHOOK_CALLS: int = sys.maxsize
 
 
-_s = requests.Session()
-
-retries = Retry(total=0, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-
-_s.mount("http://", HTTPAdapter(max_retries=retries))
-_s.mount("https://", HTTPAdapter(max_retries=retries))
-
-
 @app.route("/opengluck/webhooks/<webhook>")
 def _get_webhook(webhook):
     redis_client = assert_get_current_request_redis_client()
@@ -54,7 +62,14 @@ def _create_webhook(webhook):
     data = request.get_json()
 
     id = str(uuid4())
-    redis_client.hset(f"webhooks:{webhook}", id, json.dumps(data))
+    _ensure_subscribed_webhooks_index(redis_client)
+    (
+        redis_client.pipeline()
+        .hset(f"webhooks:{webhook}", id, json.dumps(data))
+        .sadd(_key_index, webhook)
+        .execute()
+    )
+    g.pop("subscribed_webhooks", None)
     return Response(status=204)
 
 
@@ -62,8 +77,15 @@ def _create_webhook(webhook):
 def _delete_webhook(webhook):
     redis_client = assert_get_current_request_redis_client()
 
-    redis_client.delete(f"webhooks:{webhook}")
-    redis_client.delete(f"last-webhooks:{webhook}")
+    _ensure_subscribed_webhooks_index(redis_client)
+    (
+        redis_client.pipeline()
+        .delete(f"webhooks:{webhook}")
+        .delete(f"last-webhooks:{webhook}")
+        .srem(_key_index, webhook)
+        .execute()
+    )
+    g.pop("subscribed_webhooks", None)
     return Response(status=204)
 
 
@@ -71,7 +93,13 @@ def _delete_webhook(webhook):
 def _delete_webhook_id(webhook, id):
     redis_client = assert_get_current_request_redis_client()
 
-    redis_client.hdel(f"webhooks:{webhook}", id)
+    _ensure_subscribed_webhooks_index(redis_client)
+    _delete_webhook_id_script(
+        keys=[f"webhooks:{webhook}", _key_index],
+        args=[id, webhook],
+        client=redis_client,
+    )
+    g.pop("subscribed_webhooks", None)
     return Response(status=204)
 
 
@@ -93,68 +121,133 @@ def _get_last_webhooks(webhook):
     return Response(json.dumps(last_webhooks), content_type="application/json")
 
 
-def _call_webhook(id: str, webhook: dict, data: Any, login: str, last: dict):
-    """Call the given webhook."""
+def _ensure_subscribed_webhooks_index(redis_client: redis.Redis) -> Set[str]:
+    """Get the names of webhooks with subscribers, building the index if needed.
+
+    Returns:
+        the names of webhooks with subscribers
+    """
+    names = {name.decode("utf-8") for name in redis_client.smembers(_key_index)}
+    if _index_built_member not in names:
+        names = {_index_built_member}
+        for key in redis_client.scan_iter(match="webhooks:*"):
+            if redis_client.hlen(key) > 0:
+                names.add(key.decode("utf-8").split(":", 1)[1])
+        redis_client.sadd(_key_index, *names)
+    return names - {_index_built_member}
+
+
+def _get_subscribed_webhooks() -> Set[str]:
+    """Get the names of webhooks with subscribers, once per request."""
+    if g.get("subscribed_webhooks") is None:
+        redis_client = assert_get_current_request_redis_client()
+        g.subscribed_webhooks = _ensure_subscribed_webhooks_index(redis_client)
+    return g.subscribed_webhooks
+
+
+def has_webhook_subscribers(webhook: str) -> bool:
+    """Check if the given webhook has subscribers.
+
+    This lets callers skip building the data of webhooks nobody receives.
+    """
+    return webhook in _get_subscribed_webhooks()
+
+
+def _get_last_body() -> str:
+    """Get the last records as JSON, to send to webhooks with `include_last`.
+
+    They are only computed once per request, until the revision changes (or
+    instant glucose records are recorded, see invalidate_last_snapshot).
+    """
+    from .last import get_last
+
+    redis_client = assert_get_current_request_redis_client()
+    revision = get_revision(redis_client)
+    snapshot = g.get("last_snapshot")
+    if snapshot is None or snapshot[0] != revision:
+        snapshot = (revision, json.dumps(get_last()))
+        g.last_snapshot = snapshot
+    return snapshot[1]
+
+
+def invalidate_last_snapshot() -> None:
+    """Forget the last records sent to webhooks during the current request.
+
+    This is needed when changing records without bumping the revision.
+    """
+    g.pop("last_snapshot", None)
+
+
+def _call_webhook(
+    id: str,
+    webhook: dict,
+    data: Any,
+    body: str,
+    login: str,
+    get_last_body: Callable[[], str],
+):
+    """Queue a call to the given webhook.
+
+    Args:
+        id: the id of the webhook
+        webhook: the webhook
+        data: the data to send
+        body: the data to send, as JSON
+        login: the login of the user
+        get_last_body: returns the last records, as JSON
+    """
     url = webhook["url"]
     filter = webhook.get("filter", "")
     include_last = webhook.get("include_last", False)
-    available_calls = _MAX_WEBHOOK_CALLS
     if do_record_match_filter(data, filter):
-
-        logging.info(f"Calling webhook {url}")
-
-        if include_last:
-            data = {"data": data, "last": last}
-        try:
-            available_calls -= 1
-            if available_calls < 0:
-                logging.info(
-                    "Reached too many webhooks calls, we had %s call(s) total",
-                    _MAX_WEBHOOK_CALLS,
-                )
-                return
-            resp = _s.request(
-                "POST",
-                url,
-                data=json.dumps(data),
-                headers={
-                    "content-type": "application/json",
-                    "x-opengluck-login": login,
-                },
-                allow_redirects=False,
-                timeout=_WEBHOOK_TIMEOUT,
+        if _MAX_WEBHOOK_CALLS <= 0:
+            logging.info(
+                "Reached too many webhooks calls, we had %s call(s) total",
+                _MAX_WEBHOOK_CALLS,
             )
-            if not resp.ok:
-                logging.debug(
-                    f"Calling webhook {url} returned non-200 response: {resp.status_code} {resp.text}"
-                )
-        except Exception as e:
-            logging.debug(f"Calling webhook {url} failed: {e}")
+            return
+        if include_last:
+            body = f'{{"data": {body}, "last": {get_last_body()}}}'
+        dispatch_webhook(
+            {"url": url, "body": body, "headers": {"x-opengluck-login": login}}
+        )
 
 
 def call_webhooks(webhook: str, data: Any):
     """Call all webhooks for the given webhook name."""
-    from .last import get_last
+    call_webhooks_many(webhook, [data])
 
-    redis_client = assert_get_current_request_redis_client()
-    login = assert_get_current_request_login()
-    last = get_last()
 
-    def _impl():
-        for key, value in redis_client.hgetall(f"webhooks:{webhook}").items():
-            id = key.decode("utf-8")
-            webhook_value: dict = json.loads(value.decode("utf-8"))
-            _call_webhook(id, webhook_value, data, login, last)
+def call_webhooks_many(webhook: str, data_list: List[Any]):
+    """Call all webhooks for the given webhook name, once for each data.
 
-        redis_client.lpush(
+    Calls are queued and delivered in the background, see webhook_dispatcher.
+    The last records are only computed if a webhook needs them.
+    """
+    if not data_list:
+        return
+    redis_client = assert_get_current_request_redis_client()
+    has_subscribers = has_webhook_subscribers(webhook)
+
+    now = datetime.now().isoformat()
+    p = redis_client.pipeline()
+    if has_subscribers:
+        p.hgetall(f"webhooks:{webhook}")
+    (
+        p.lpush(
             f"last-webhooks:{webhook}",
-            json.dumps({"date": datetime.now().isoformat(), "data": data}),
-        )
-        redis_client.ltrim(f"last-webhooks:{webhook}", 0, _MAX_ITEMS)
-
-    if os.environ.get("PYTEST_CURRENT_TEST"):
-        # when running from pytest, do not use threads so we can retrieve
-        # webhooks synchronously
-        _impl()
-    else:
-        Thread(target=_impl).start()
+            *[json.dumps({"date": now, "data": data}) for data in data_list],
+        ).ltrim(f"last-webhooks:{webhook}", 0, _MAX_ITEMS)
+    )
+    res = p.execute()
+    if not has_subscribers:
+        return
+    login = assert_get_current_request_login()
+    webhooks = [
+        (key.decode("utf-8"), json.loads(value.decode("utf-8")))
+        for key, value in res[0].items()
+    ]
+    for data in data_list:
+        body = json.dumps(data)
+        for id, webhook_value in webhooks:
+            _call_webhook(id, webhook_value, data, body, login, _get_last_body)
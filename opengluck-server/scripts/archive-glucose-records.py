@@ -0,0 +1,30 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import json  # noqa: E402
+import os  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+
+from opengluck.config import tz  # noqa: E402
+from opengluck.glucose import archive_glucose_records  # noqa: E402
+from opengluck.redis import get_redis_client  # noqa: E402
+
+# This script moves the glucose records older than GLUCOSE_ARCHIVE_AFTER_DAYS
+# days of all users to the archive. It can run while the server is running, and
+# is meant to be run daily.
+#
+# Usage: archive-glucose-records.py [<nb-days>]
+
+nb_days = int(
+    sys.argv[1]
+    if len(sys.argv) > 1
+    else os.environ.get("GLUCOSE_ARCHIVE_AFTER_DAYS", "30")
+)
+before = datetime.now(tz=tz) - timedelta(days=nb_days)
+for login, user in get_redis_client(db=0).hgetall("users").items():
+    db = json.loads(user)["db"]
+    archived, _ = archive_glucose_records(get_redis_client(db=db), before=before)
+    print(f"{login.decode('utf-8')}: archived {archived} record(s)")
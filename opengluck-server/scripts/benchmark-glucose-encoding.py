@@ -0,0 +1,85 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import json  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+
+import opengluck.login  # noqa: E402
+from opengluck.config import tz  # noqa: E402
+from opengluck.glucose import GlucoseRecordType  # noqa: E402
+from opengluck.glucose import _members_to_glucose_records  # noqa: E402
+from opengluck.glucose_archive import archive_glucose_readings  # noqa: E402
+from opengluck.glucose_archive import find_glucose_readings  # noqa: E402
+from opengluck.glucose_archive import get_glucose_archive_keys  # noqa: E402
+from opengluck.glucose_encoding import decode_glucose_members  # noqa: E402
+from opengluck.glucose_encoding import encode_glucose_member  # noqa: E402
+from opengluck.login import get_token_redis_client  # noqa: E402
+
+# This script compares the memory used by a year of 5-minute glucose readings,
+# and the time to decode them, when stored as JSON and binary members, and once
+# archived. It runs on a temporary account that is deleted afterwards.
+#
+# Usage: benchmark-glucose-encoding.py [<nb-days>]
+
+nb_days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+start = datetime.now(tz=tz) - timedelta(days=nb_days)
+readings = [
+    ((start + timedelta(minutes=5 * i)).timestamp(), 70 + i % 150)
+    for i in range(nb_days * 288)
+]
+encodings = {
+    "json": lambda ts, mgDl: json.dumps({"ts": str(ts), "mgDl": mgDl}),
+    "binary": encode_glucose_member,
+}
+
+login = f"benchmark-{uuid.uuid4().hex}"
+password = uuid.uuid4().hex
+opengluck.login.create_account(login, password)
+try:
+    token = opengluck.login.get_token(login, password)
+    redis_client = get_token_redis_client(token)
+    print(f"{len(readings)} reading(s)")
+    for name, encode in encodings.items():
+        key = f"benchmark:{name}"
+        for i in range(0, len(readings), 10000):
+            chunk = readings[i:][:10000]
+            redis_client.zadd(key, {encode(ts, mgDl): ts for ts, mgDl in chunk})
+        memory = redis_client.memory_usage(key, samples=0)
+        t0 = time.perf_counter()
+        members = redis_client.zrange(key, 0, -1)
+        t1 = time.perf_counter()
+        decoded = decode_glucose_members(members)
+        t2 = time.perf_counter()
+        records = _members_to_glucose_records(GlucoseRecordType.historic, members)
+        t3 = time.perf_counter()
+        assert len(decoded) == len(records) == len(readings)
+        print(
+            f"{name:>6}: {memory / 1024 / 1024:6.1f} MiB, read in {t1 - t0:.3f}s, "
+            f"decoded in {t2 - t1:.3f}s ({t3 - t2:.3f}s as glucose records)"
+        )
+    key = "benchmark:binary"
+    archive_glucose_readings(redis_client, key=key, before_ts=time.time())
+    memory = sum(
+        redis_client.memory_usage(key, samples=0) or 0
+        for key in [key, *get_glucose_archive_keys(key)]
+    )
+    t0 = time.perf_counter()
+    decoded = find_glucose_readings(
+        redis_client, key=key, min_ts=readings[0][0], max_ts=readings[-1][0]
+    )
+    t1 = time.perf_counter()
+    assert len(decoded) == len(readings)
+    print(f"archive: {memory / 1024 / 1024:5.1f} MiB, read in {t1 - t0:.3f}s")
+    t0 = time.perf_counter()
+    decoded = find_glucose_readings(
+        redis_client, key=key, min_ts=readings[-90 * 288][0], max_ts=readings[-1][0]
+    )
+    t1 = time.perf_counter()
+    print(f"archive: read 90 days in {t1 - t0:.3f}s")
+finally:
+    opengluck.login.delete_account(login)
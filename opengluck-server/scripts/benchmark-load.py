@@ -0,0 +1,75 @@
+#!/opt/venv/bin/python
+
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import requests
+
+# This script benchmarks a running server under load, with many concurrent
+# clients polling the read-heavy routes, and prints the p50/p99 latencies for
+# each level of concurrency. Make sure rate limits are high enough for the
+# token you use (see RATE_LIMIT_POLLING).
+#
+# Usage: benchmark-load.py <url> <token> [<duration> [<concurrency>...]]
+
+if len(sys.argv) < 3:
+    print("Usage: benchmark-load.py <url> <token> [<duration> [<concurrency>...]]")
+    sys.exit(1)
+
+url = sys.argv[1].rstrip("/")
+token = sys.argv[2]
+duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+concurrencies = [int(arg) for arg in sys.argv[4:]] or [50, 100, 200, 500]
+paths = [
+    "/opengluck/current",
+    "/opengluck/last",
+    "/opengluck/revision",
+    "/opengluck/glucose/find?from=2023-01-01T00:00:00Z&to=2023-01-02T00:00:00Z",
+]
+
+
+def _client(index: int, stop: Event) -> list:
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    latencies = []
+    i = index
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            resp = session.get(f"{url}{path}", timeout=30)
+            ok = resp.ok
+        except requests.RequestException:
+            ok = False
+        latencies.append((time.perf_counter() - start, ok))
+    return latencies
+
+
+def _percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+print(
+    f"{'clients':>8} {'requests/s':>11} {'errors':>7} {'p50 (ms)':>9} {'p99 (ms)':>9}"
+)
+for concurrency in concurrencies:
+    stop = Event()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_client, i, stop) for i in range(concurrency)]
+        time.sleep(duration)
+        stop.set()
+        results = [latency for future in futures for latency in future.result()]
+    latencies = sorted(latency for latency, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    if not latencies:
+        print(f"{concurrency:>8} {'-':>11} {errors:>7}")
+        continue
+    print(
+        f"{concurrency:>8} {len(results) / duration:>11.1f} {errors:>7}"
+        f" {statistics.median(latencies) * 1000:>9.1f}"
+        f" {_percentile(latencies, 0.99) * 1000:>9.1f}"
+    )
@@ -0,0 +1,98 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import time  # noqa: E402
+import uuid  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from typing import List  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+import opengluck.login  # noqa: E402
+from opengluck.config import tz  # noqa: E402
+from opengluck.glucose import (GlucoseRecord, GlucoseRecordType,  # noqa: E402
+                               find_glucose_records, find_glucose_values,
+                               record_glucose_records)
+from opengluck.hba1c import _calculate_hba1c  # noqa: E402
+from opengluck.server import app  # noqa: E402
+from opengluck.stats import compute_glucose_stats  # noqa: E402
+from opengluck.utils import parse_timestamp  # noqa: E402
+
+# This script compares the time to compute statistics over 14, 90 and 365 days
+# of 5-minute glucose readings: with the per-minute loop HbA1c used to be
+# computed with, the current HbA1c computation, and the NumPy statistics. It
+# runs on a temporary account that is deleted afterwards.
+#
+# Usage: benchmark-stats.py
+
+
+def _legacy_hba1c(glucose_records: List[GlucoseRecord]) -> float:
+    # the per-minute loop hba1c._calculate_hba1c used to run
+    values: List[float] = []
+    last_record = glucose_records[0]
+    values.append(last_record["mgDl"])
+    for record in glucose_records[1:]:
+        record_ts = parse_timestamp(record["timestamp"])
+        elapsed = record_ts - parse_timestamp(last_record["timestamp"])
+        delta_seconds = elapsed.total_seconds()
+        if delta_seconds > 60 * 60:
+            values.append(record["mgDl"])
+            continue
+        delta_mgDl = record["mgDl"] - last_record["mgDl"]
+        current_ts = parse_timestamp(last_record["timestamp"]) + timedelta(minutes=1)
+        i = 1
+        while current_ts <= record_ts:
+            values.append(last_record["mgDl"] + delta_mgDl * i / (delta_seconds / 60))
+            current_ts += timedelta(minutes=1)
+            i += 1
+        last_record = record
+    return (sum(values) / len(values) + 46.7) / 28.7
+
+
+def _stats(from_date: datetime, to_date: datetime) -> None:
+    readings = np.array(
+        find_glucose_values(GlucoseRecordType.historic, from_date, to_date),
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    compute_glucose_stats(readings[:, 0], readings[:, 1], low=70, high=180)
+
+
+login = f"benchmark-{uuid.uuid4().hex}"
+password = uuid.uuid4().hex
+opengluck.login.create_account(login, password)
+try:
+    token = opengluck.login.get_token(login, password)
+    with app.test_request_context(headers={"Authorization": f"Bearer {token}"}):
+        end = datetime.now(tz=tz)
+        start = end - timedelta(days=365)
+        record_glucose_records(
+            GlucoseRecordType.historic,
+            [
+                (start + timedelta(minutes=5 * i), 70 + i % 150)
+                for i in range(365 * 288)
+            ],
+        )
+        for nb_days in (14, 90, 365):
+            from_date = end - timedelta(days=nb_days)
+            timings = {}
+            for name, compute in {
+                "legacy loop": lambda: _legacy_hba1c(
+                    find_glucose_records(GlucoseRecordType.historic, from_date, end)
+                ),
+                "hba1c": lambda: _calculate_hba1c(
+                    find_glucose_records(GlucoseRecordType.historic, from_date, end)
+                ),
+                "numpy stats": lambda: _stats(from_date, end),
+            }.items():
+                t0 = time.perf_counter()
+                compute()
+                timings[name] = time.perf_counter() - t0
+            print(
+                f"{nb_days:>3} days: "
+                + ", ".join(f"{name} {timing:.3f}s" for name, timing in timings.items())
+            )
+finally:
+    opengluck.login.delete_account(login)
@@ -0,0 +1,56 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import time  # noqa: E402
+import uuid  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+
+import opengluck.login  # noqa: E402
+from opengluck.config import tz  # noqa: E402
+from opengluck.glucose import GlucoseRecordType  # noqa: E402
+from opengluck.glucose import _clear_all_glucose_records  # noqa: E402
+from opengluck.glucose import record_glucose_data  # noqa: E402
+from opengluck.glucose import record_glucose_records  # noqa: E402
+from opengluck.server import app  # noqa: E402
+
+# This script benchmarks recording glucose readings, comparing recording them
+# one at a time (as we used to) and all at once. It runs on a temporary account
+# that is deleted afterwards.
+#
+# Usage: benchmark-upload.py [<nb-records>]
+
+nb_records = int(sys.argv[1]) if len(sys.argv) > 1 else 288
+start = datetime.now(tz=tz) - timedelta(days=1)
+records = [
+    (start + timedelta(minutes=5 * i), 100 + i % 50) for i in range(nb_records)
+]
+
+login = f"benchmark-{uuid.uuid4().hex}"
+password = uuid.uuid4().hex
+opengluck.login.create_account(login, password)
+try:
+    token = opengluck.login.get_token(login, password)
+    with app.test_request_context(headers={"Authorization": f"Bearer {token}"}):
+        t0 = time.perf_counter()
+        for timestamp, mgDl in records:
+            record_glucose_data(
+                GlucoseRecordType.historic,
+                timestamp,
+                mgDl,
+                trigger_episode_changes=False,
+            )
+        one_at_a_time = time.perf_counter() - t0
+
+        _clear_all_glucose_records()
+        t0 = time.perf_counter()
+        record_glucose_records(GlucoseRecordType.historic, records)
+        all_at_once = time.perf_counter() - t0
+
+    print(f"{nb_records} historic record(s)")
+    print(f"one at a time: {nb_records / one_at_a_time:10.1f} records/s")
+    print(f"all at once:   {nb_records / all_at_once:10.1f} records/s")
+finally:
+    opengluck.login.delete_account(login)
@@ -0,0 +1,18 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import json  # noqa: E402
+
+from opengluck.glucose import migrate_glucose_records_encoding  # noqa: E402
+from opengluck.redis import get_redis_client  # noqa: E402
+
+# This script migrates the glucose records of all users from JSON members to the
+# binary encoding. It can run while the server is running, and can be run again
+# safely.
+for login, user in get_redis_client(db=0).hgetall("users").items():
+    db = json.loads(user)["db"]
+    migrated = migrate_glucose_records_encoding(get_redis_client(db=db))
+    print(f"{login.decode('utf-8')}: migrated {migrated} record(s)")
@@ -0,0 +1,18 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import json  # noqa: E402
+
+from opengluck.glucose import rebuild_glucose_aggregates  # noqa: E402
+from opengluck.redis import get_redis_client  # noqa: E402
+
+# This script computes the daily aggregates of the glucose records of all users
+# again. Aggregates are built when they are first needed, so this is only
+# useful if they are out of sync with the records.
+for login, user in get_redis_client(db=0).hgetall("users").items():
+    db = json.loads(user)["db"]
+    nb_days = rebuild_glucose_aggregates(get_redis_client(db=db))
+    print(f"{login.decode('utf-8')}: aggregated {nb_days} day(s)")
@@ -0,0 +1,38 @@
+#!/opt/venv/bin/python
+
+import sys
+
+sys.path.append("/app")
+
+import logging  # noqa: E402
+import os  # noqa: E402
+import time  # noqa: E402
+
+from opengluck.retention import run_retention  # noqa: E402
+
+# This script archives, downsamples and deletes old records of all users, see
+# opengluck/retention.py. It can run while the server is running. With --loop,
+# it runs every RETENTION_INTERVAL seconds (and exits if it is 0, the default).
+#
+# Usage: run-retention.py [--loop]
+
+interval = int(os.environ.get("RETENTION_INTERVAL", "0"))
+loop = "--loop" in sys.argv[1:]
+if loop and interval <= 0:
+    print("RETENTION_INTERVAL is not set, not running retention")
+    sys.exit(0)
+
+while True:
+    try:
+        status = run_retention()
+        if status is None:
+            print("Retention is already running, skipping")
+        else:
+            print(f"Retention: {status}")
+    except Exception:
+        if not loop:
+            raise
+        logging.exception("Could not run retention")
+    if not loop:
+        break
+    time.sleep(interval)